@@ -0,0 +1,39 @@
+import gzip
+import hashlib
+import json
+import os
+
+# Payload fields that decide which listings a response contains
+FIXTURE_KEY_FIELDS = [
+    'selectedSellerIds', 'searchText', 'categoryId', 'page', 'pageSize', 'sortColumn', 'sortDescending'
+]
+
+def fixture_key(payload):
+    """Return a stable key for an ItemListing request payload."""
+    fields = {field: str(payload.get(field, '')) for field in FIXTURE_KEY_FIELDS}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+def record_response(directory, payload, data):
+    """Save a raw ItemListing response and the request that produced it as a gzipped fixture."""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{fixture_key(payload)}.json.gz")
+        fixture = {
+            'request': {field: payload.get(field) for field in FIXTURE_KEY_FIELDS},
+            'response': data
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            json.dump(fixture, file)
+    except Exception as e:
+        print(f"Error recording fixture: {str(e)}")
+
+def load_fixtures(directory):
+    """Load every recorded fixture in directory as {fixture_key: response}."""
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json.gz'):
+            continue
+        with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as file:
+            fixture = json.load(file)
+        fixtures[fixture_key(fixture['request'])] = fixture['response']
+    return fixtures
@@ -6,14 +6,16 @@ import pytz
 import json
 import os
 import asyncio
-from get_products import get_data
+from get_products import get_data, CRAWL_HORIZON_HOURS
+from crawl_session import CrawlSession
 from notifications import send_notifications
 from dotenv import load_dotenv
 from gemini import analyze_item_price, update_prices
 import schedule
 import time
 import threading
-from db import get_db_cursor, init_db, get_pending_price_updates_count, DB_PATH
+from db import get_db_cursor, init_db, DB_PATH
+from price_scheduler import get_pending_priority_count
 from map import get_seller_name  
 
 # Load environment variables
@@ -30,7 +32,7 @@ def get_categories():
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT DISTINCT search_term FROM items WHERE search_term IS NOT NULL")
+    c.execute("SELECT DISTINCT search_term FROM item_search_terms ORDER BY search_term")
     categories = [row['search_term'] for row in c.fetchall() if row['search_term']]
     conn.close()
     return jsonify(categories)
@@ -82,7 +84,7 @@ def get_products():
         FROM items 
         WHERE ebay_price IS NOT NULL AND ebay_price > 0
         AND auction_end_time > ?
-        AND search_term IN ({placeholders_terms})
+        AND id IN (SELECT item_id FROM item_search_terms WHERE search_term IN ({placeholders_terms}))
         AND seller_id IN ({placeholders_sellers})
         ORDER BY price_difference DESC
         '''
@@ -97,7 +99,7 @@ def get_products():
         FROM items 
         WHERE ebay_price IS NOT NULL AND ebay_price > 0
         AND auction_end_time > ?
-        AND search_term IN ({placeholders})
+        AND id IN (SELECT item_id FROM item_search_terms WHERE search_term IN ({placeholders}))
         ORDER BY price_difference DESC
         '''
         params.extend(search_terms)
@@ -335,7 +337,7 @@ def manual_search():
         
         # Count items for the specific search
         if search_term:
-            c.execute("SELECT COUNT(*) as count FROM items WHERE search_term = ?", (search_term,))
+            c.execute("SELECT COUNT(*) as count FROM item_search_terms WHERE search_term = ?", (search_term,))
             search_items = c.fetchone()['count']
         else:
             search_items = total_items
@@ -378,7 +380,7 @@ def manual_price_update():
         ))
         
         # Get statistics
-        remaining_updates = get_pending_price_updates_count()
+        remaining_updates = get_pending_priority_count()
         
         return jsonify({
             'success': True,
@@ -489,14 +491,10 @@ def scheduled_search():
         if not seller_ids:
             seller_ids = ['19', '198']
             
-        # If no search terms, use empty string to get all items
-        if not search_terms:
-            # Run a single search with empty term
-            asyncio.run(get_data(seller_ids, ''))
-        else:
-            # Run a search for each term
-            for term in search_terms:
-                asyncio.run(get_data(seller_ids, term))
+        # Crawl every term in one run over one pooled session; no search terms fetches all items
+        with CrawlSession() as crawl:
+            crawl.run(get_data(seller_ids, search_terms, session=crawl.http, horizon_hours=CRAWL_HORIZON_HOURS))
+            print(f"Scheduled search connections: {crawl.summary()}")
         
         print(f"Scheduled search completed at {datetime.now()}")
     except Exception as e:
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Measure pricing throughput offline.
+
+Builds a synthetic database of active listings, runs gemini.update_prices
+against fake_gemini.FakeGeminiModel and reports items/s, call latency
+percentiles and database write time. No API key is needed, so concurrency
+and batching changes can be compared before they are deployed:
+
+    python benchmark_pricing.py --items 2000 --max-concurrent 60 --latency 400 --throttle-rate 0.02
+    python benchmark_pricing.py --items 2000 --items-per-prompt 8 --json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values (fraction between 0 and 1), or 0.0 if empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class TimedModel:
+    """Wraps a model and records how long each of its calls takes, failed calls included."""
+
+    def __init__(self, model):
+        self.model = model
+        self.latencies = []
+
+    async def generate_content_async(self, contents, **kwargs):
+        started = time.monotonic()
+        try:
+            return await self.model.generate_content_async(contents, **kwargs)
+        finally:
+            self.latencies.append(time.monotonic() - started)
+
+def near_duplicate_title(title, rng):
+    """Return a relist-style variant of title: different case or punctuation, or an extra filler word."""
+    from fake_gemini import FILLER_WORDS
+    variant = rng.choice(['upper', 'dash', 'filler'])
+    if variant == 'upper':
+        return title.upper()
+    if variant == 'dash':
+        return title.replace(' ', ' - ', 1)
+    return f"{title} {rng.choice(FILLER_WORDS).capitalize()}"
+
+def create_synthetic_items(count, image_url=None, seed=0, near_duplicates=0.0):
+    """
+    Fill the database at db.DB_PATH with count active listings from
+    fake_api's catalogue generator. A near_duplicates fraction of them copy
+    the title and category of an earlier listing, with small differences.
+    """
+    from db import get_db_cursor, init_db
+    from fake_api import FakeItemListingAPI
+
+    init_db()
+    api = FakeItemListingAPI(pages_per_seller=math.ceil(count / 40), seed=seed)
+    listings = api.seller_listings('198')[:count]
+    rng = random.Random(seed)
+    rows = []
+    for index, listing in enumerate(listings):
+        title, category = listing['title'], listing['categoryName']
+        if index and rng.random() < near_duplicates:
+            original = listings[rng.randrange(index)]
+            title, category = near_duplicate_title(original['title'], rng), original['categoryName']
+        rows.append((
+            str(listing['itemId']), 'benchmark', 'Benchmark Seller', title, listing['currentPrice'],
+            listing['endTime'], f"{image_url}?{index}" if image_url else '', listing['shippingPrice'],
+            listing['numBids'], str(listing['sellerId']), category
+        ))
+    with get_db_cursor() as cursor:
+        cursor.executemany('''
+        INSERT INTO items (id, search_term, seller_name, product_name, price, auction_end_time, image_url,
+                           shipping_price, bids, seller_id, category_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return len(rows)
+
+def run_benchmark(args):
+    """Run update_prices against the fake backend and return the measurements."""
+    import db
+    db.DB_PATH = args.db
+    created = create_synthetic_items(args.items, args.image_url, args.seed, args.near_duplicates)
+
+    import gemini
+    from fake_gemini import FakeGeminiModel
+    from price_scheduler import get_pending_priority_count
+    from price_writer import PriceWriter
+    # Listings closing within the pricing lead time are skipped by update_prices
+    pending = get_pending_priority_count()
+    if not args.verbose:
+        logging.getLogger("gemini").setLevel(logging.WARNING)
+    fake = FakeGeminiModel(args.latency, args.distribution, args.spread, args.image_latency, args.error_rate,
+                           args.throttle_rate, args.omit_rate, args.quota, args.seed)
+    model = TimedModel(fake)
+    gemini.set_backend(model)
+
+    started = time.monotonic()
+    pipeline = asyncio.run(gemini.update_prices(
+        batch_size=args.batch_size,
+        max_concurrent=args.max_concurrent,
+        items_per_prompt=args.items_per_prompt,
+        cascade=args.cascade,
+        cluster=args.cluster
+    ))
+    elapsed = time.monotonic() - started
+
+    with db.get_db_cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM items WHERE price_update_attempted = 1")
+        priced = cursor.fetchone()[0]
+
+    writes = pipeline.writer.stats if pipeline else PriceWriter(None).stats
+    return {
+        'items': created,
+        'pending': pending,
+        'priced': priced,
+        'seconds': round(elapsed, 2),
+        'items_per_second': round(priced / elapsed, 1) if elapsed else 0.0,
+        'calls': len(model.latencies),
+        'items_per_call': round(priced / len(model.latencies), 2) if model.latencies else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(model.latencies, 0.50) * 1000, 1),
+            'p95': round(percentile(model.latencies, 0.95) * 1000, 1),
+            'p99': round(percentile(model.latencies, 0.99) * 1000, 1),
+            'max': round(max(model.latencies, default=0.0) * 1000, 1)
+        },
+        'db_write': {
+            'transactions': writes['flushes'],
+            'rows': writes['rows'],
+            'total_ms': round(writes['flush_seconds'] * 1000, 1),
+            'avg_ms': round(writes['flush_seconds'] / writes['flushes'] * 1000, 2) if writes['flushes'] else 0.0,
+            'max_ms': round(writes['max_flush_seconds'] * 1000, 2)
+        },
+        'backend': fake.stats,
+        'errors': dict(pipeline.counters['errors']) if pipeline else dict.fromkeys(gemini.error_stats, 0),
+        'concurrency': pipeline.limiter.summary() if pipeline else 'n/a',
+        'cache': gemini.price_cache.summary(),
+        'clusters': dict(gemini.cluster_stats)
+    }
+
+def print_report(result, args):
+    latency = result['latency_ms']
+    writes = result['db_write']
+    backend = result['backend']
+    print(f"Config: items={args.items}, batch_size={args.batch_size}, max_concurrent={args.max_concurrent}, "
+          f"items_per_prompt={args.items_per_prompt}, cascade={args.cascade}, latency={args.latency} ms "
+          f"({args.distribution}), error_rate={args.error_rate}, throttle_rate={args.throttle_rate}, "
+          f"quota={args.quota}, cluster={args.cluster}, near_duplicates={args.near_duplicates}")
+    print(f"Priced {result['priced']} of {result['pending']} pending items ({result['items']} created) "
+          f"in {result['seconds']:.2f}s: "
+          f"{result['items_per_second']:.1f} items/s")
+    print(f"Calls: {result['calls']} ({result['items_per_call']:.2f} items per call), "
+          f"{backend['throttled']} throttled, {backend['errors']} errors, {result['errors']['retried']} retried")
+    print(f"Call latency: p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, p99 {latency['p99']:.0f} ms, "
+          f"max {latency['max']:.0f} ms")
+    print(f"DB writes: {writes['rows']} rows in {writes['transactions']} transactions, "
+          f"{writes['total_ms']:.0f} ms total ({writes['avg_ms']:.1f} ms avg, {writes['max_ms']:.1f} ms max)")
+    print(f"Concurrency: {result['concurrency']}")
+    print(f"Cache: {result['cache']}")
+    if args.cluster:
+        clusters = result['clusters']
+        print(f"Clusters: {clusters['clusters']} clusters, {clusters['propagated']} estimates shared, "
+              f"{clusters['audits']} audits, {clusters['drifted']} drifted, {clusters['unshared']} priced alone")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark update_prices against an offline Gemini stand-in')
+    parser.add_argument('--items', type=int, default=1000, help='Synthetic listings to price')
+    parser.add_argument('--db', help='Database file to create (default: a temporary file)')
+    parser.add_argument('--batch-size', type=int, default=30, help='Rows claimed per database round trip')
+    parser.add_argument('--max-concurrent', type=int, default=60, help='Max concurrent calls (1-60)')
+    parser.add_argument('--items-per-prompt', type=int, default=1, help='Items priced per request')
+    parser.add_argument('--cascade', action='store_true', help='Price from text first (see gemini.py --cascade)')
+    parser.add_argument('--cluster', action='store_true',
+                        help='Share estimates between near-duplicates (see gemini.py --cluster)')
+    parser.add_argument('--near-duplicates', type=float, default=0.0,
+                        help='Fraction of listings that are relist-style copies of earlier ones')
+    parser.add_argument('--image-url', help='Give every listing this image (e.g. from a local http.server)')
+    parser.add_argument('--latency', type=float, default=300, help='Mean call latency in ms')
+    parser.add_argument('--distribution', choices=['fixed', 'uniform', 'exponential', 'lognormal'],
+                        default='lognormal', help='Call latency distribution')
+    parser.add_argument('--spread', type=float, default=0.5,
+                        help='Lognormal sigma, or the uniform range as a fraction of the mean')
+    parser.add_argument('--image-latency', type=float, default=150, help='Extra latency per image in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of calls answered with 429')
+    parser.add_argument('--omit-rate', type=float, default=0.0,
+                        help='Chance that a grouped answer leaves out each item')
+    parser.add_argument('--quota', type=int, help='Calls in flight above which the fake answers 429')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for listings, latencies and faults')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='Keep gemini.py\'s per-item logging')
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.db:
+        if os.path.exists(args.db):
+            sys.exit(f"{args.db} already exists; the benchmark needs a fresh database")
+    else:
+        temp_dir = tempfile.TemporaryDirectory(prefix='pricing-benchmark-')
+        args.db = os.path.join(temp_dir.name, 'benchmark.db')
+    # Keep processed benchmark images out of the real image cache
+    os.environ.setdefault('IMAGE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(args.db)), 'image_cache'))
+
+    try:
+        result = run_benchmark(args)
+    finally:
+        if temp_dir:
+            temp_dir.cleanup()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, args)
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import aiohttp
+
+# Connection pool tuning for the shopgoodwill API
+CONNECTION_LIMIT = 100
+CONNECTIONS_PER_HOST = int(os.getenv("CRAWL_CONNECTIONS_PER_HOST", "20"))
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle connection is kept open for reuse
+DNS_CACHE_TTL = 600  # Seconds a resolved address is cached
+
+def new_connection_stats():
+    """Return an empty set of connection counters."""
+    return {
+        'requests': 0,
+        'connections_created': 0,
+        'connections_reused': 0,
+        'dns_cache_hits': 0,
+        'dns_cache_misses': 0
+    }
+
+def create_trace_config(stats):
+    """Build an aiohttp TraceConfig that counts requests and connection reuse into stats."""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        stats['requests'] += 1
+
+    async def on_connection_create_end(session, context, params):
+        stats['connections_created'] += 1
+
+    async def on_connection_reuseconn(session, context, params):
+        stats['connections_reused'] += 1
+
+    async def on_dns_cache_hit(session, context, params):
+        stats['dns_cache_hits'] += 1
+
+    async def on_dns_cache_miss(session, context, params):
+        stats['dns_cache_misses'] += 1
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+    trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+    return trace_config
+
+def create_http_session(stats=None):
+    """
+    Create an aiohttp ClientSession with a keep-alive, DNS-caching connector.
+    Must be called from inside a running event loop.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTION_LIMIT,
+        limit_per_host=CONNECTIONS_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        use_dns_cache=True
+    )
+    trace_configs = [create_trace_config(stats)] if stats is not None else None
+    return aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+
+def format_connection_stats(stats):
+    """Return a one-line summary of connection reuse."""
+    connections = stats['connections_created'] + stats['connections_reused']
+    reuse_ratio = stats['connections_reused'] / connections if connections else 0
+    return (f"{stats['requests']} requests, {stats['connections_created']} connections opened, "
+            f"{stats['connections_reused']} reused ({reuse_ratio:.0%}), "
+            f"DNS cache {stats['dns_cache_hits']} hits / {stats['dns_cache_misses']} misses")
+
+class CrawlSession:
+    """
+    One event loop and one pooled HTTP session for an entire crawl run.
+
+    Every search term and seller crawled inside the run shares the same
+    connections, so TLS handshakes and DNS lookups are paid once:
+
+        with CrawlSession() as crawl:
+            crawl.run(get_data(seller_ids, search_terms, session=crawl.http))
+            print(crawl.summary())
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.http = None
+        self.stats = new_connection_stats()
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.http = self.loop.run_until_complete(self._open())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.loop.run_until_complete(self.http.close())
+            # Give the connector a moment to close its transports cleanly
+            self.loop.run_until_complete(asyncio.sleep(0.25))
+        finally:
+            asyncio.set_event_loop(None)
+            self.loop.close()
+        return False
+
+    async def _open(self):
+        return create_http_session(self.stats)
+
+    def run(self, coro):
+        """Run a coroutine to completion on the session's event loop."""
+        return self.loop.run_until_complete(coro)
+
+    def summary(self):
+        """Return a one-line summary of the connection reuse seen so far."""
+        return format_connection_stats(self.stats)
@@ -3,8 +3,6 @@ import threading
 from contextlib import contextmanager
 import os
 import json
-from datetime import datetime
-import pytz
 
 # Database path
 DB_PATH = r'/Users/brodybagnall/Documents/goodwill/Goodwill-app/backend/data/gw_data.db'
@@ -12,6 +10,8 @@ DB_PATH = r'/Users/brodybagnall/Documents/goodwill/Goodwill-app/backend/data/gw_
 # Thread-local storage for database connections
 local = threading.local()
 
+_price_filtered_column_ready = False
+
 def get_db():
     """Get a thread-local database connection."""
     if not hasattr(local, "db"):
@@ -69,6 +69,34 @@ def upgrade_schema(cursor):
             print("Adding margin column to items table")
             cursor.execute("ALTER TABLE items ADD COLUMN margin REAL")
         
+        if not table_has_column(cursor, 'items', 'fingerprint'):
+            print("Adding fingerprint column to items table")
+            cursor.execute("ALTER TABLE items ADD COLUMN fingerprint TEXT")
+        
+        if not table_has_column(cursor, 'items', 'changed_at'):
+            print("Adding changed_at column to items table")
+            cursor.execute("ALTER TABLE items ADD COLUMN changed_at TEXT")
+        
+        if not table_has_column(cursor, 'items', 'category_name'):
+            print("Adding category_name column to items table")
+            cursor.execute("ALTER TABLE items ADD COLUMN category_name TEXT")
+        
+        # Pricing workers lease items so two workers never price the same one
+        if not table_has_column(cursor, 'items', 'price_lease_owner'):
+            print("Adding price lease columns to items table")
+            cursor.execute("ALTER TABLE items ADD COLUMN price_lease_owner TEXT")
+            cursor.execute("ALTER TABLE items ADD COLUMN price_lease_expires TEXT")
+        
+        # Non-retryable pricing failures; items rejected too often are no longer claimed
+        if not table_has_column(cursor, 'items', 'price_failures'):
+            print("Adding price_failures column to items table")
+            cursor.execute("ALTER TABLE items ADD COLUMN price_failures INTEGER DEFAULT 0")
+        
+        # Items the local pre-filter marked $0.00 without asking Gemini
+        if not table_has_column(cursor, 'items', 'price_filtered'):
+            print("Adding price_filtered column to items table")
+            cursor.execute("ALTER TABLE items ADD COLUMN price_filtered BOOLEAN DEFAULT 0")
+        
         # Make sure image_url is TEXT, not BLOB
         cursor.execute("PRAGMA table_info(items)")
         columns = cursor.fetchall()
@@ -93,6 +121,21 @@ def upgrade_schema(cursor):
                 cursor.execute("DROP TABLE items_old")
                 break
 
+def backfill_item_search_terms(cursor):
+    """
+    Give items crawled before item_search_terms existed a membership row for
+    their search_term. Runs only while the table is still empty.
+    """
+    cursor.execute("SELECT 1 FROM item_search_terms LIMIT 1")
+    if cursor.fetchone() is not None:
+        return
+    cursor.execute('''
+    INSERT OR IGNORE INTO item_search_terms (item_id, search_term)
+    SELECT id, search_term FROM items WHERE search_term IS NOT NULL AND search_term != ''
+    ''')
+    if cursor.rowcount > 0:
+        print(f"Backfilled {cursor.rowcount} search term memberships")
+
 def create_items_table(cursor):
     """Create the items table with the correct schema."""
     cursor.execute('''
@@ -147,6 +190,17 @@ def init_db():
         )
         ''')
         
+        # Create item/search term membership table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item_search_terms (
+            item_id TEXT NOT NULL,
+            search_term TEXT NOT NULL,
+            PRIMARY KEY (item_id, search_term)
+        )
+        ''')
+        
+        backfill_item_search_terms(cursor)
+        
         # Create promising table
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS promising (
@@ -164,6 +218,8 @@ def init_db():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_seller_id ON items(seller_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_ebay_price ON items(ebay_price)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_auction_end ON items(auction_end_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_changed_at ON items(changed_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_item_search_terms_term ON item_search_terms(search_term)')
         
         # Insert default settings if not present
         cursor.execute("SELECT COUNT(*) FROM settings")
@@ -180,35 +236,15 @@ def init_db():
                 json.dumps(['microwave']), json.dumps(['19', '198'])
             ))
 
-def get_items_for_price_update(batch_size=None, test_mode=False):
-    """Get items that need price updates."""
+def get_margin_threshold(default=50):
+    """Get the margin threshold (percent) from settings, or default if none is set."""
     with get_db_cursor() as cursor:
-        # Get current date in Pacific timezone for comparison
-        pacific = pytz.timezone('US/Pacific')
-        pacific_time = datetime.now(pacific)
-        pacific_time_str = pacific_time.strftime('%Y-%m-%dT%H:%M:%S')
-        
-        query = '''
-        SELECT id, product_name, image_url, price, shipping_price
-        FROM items
-        WHERE (ebay_price IS NULL OR price_update_attempted = 0)
-        AND auction_end_time > ?
-        '''
-        
-        params = [pacific_time_str]
-        
-        if test_mode:
-            query += ' LIMIT ?'
-            cursor.execute(query, params + [batch_size or 5])
-        elif batch_size:
-            query += ' LIMIT ?'
-            cursor.execute(query, params + [batch_size])
-        else:
-            cursor.execute(query, params)
-            
-        # Convert sqlite3.Row objects to dictionaries
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+        try:
+            cursor.execute("SELECT margin_threshold FROM settings ORDER BY id LIMIT 1")
+        except sqlite3.OperationalError:
+            return default
+        row = cursor.fetchone()
+        return row['margin_threshold'] if row and row['margin_threshold'] is not None else default
 
 def update_item_price(item_id, ebay_price, update_time, price=0, shipping_price=0):
     """Update an item's price and margin in the database."""
@@ -227,20 +263,61 @@ def update_item_price(item_id, ebay_price, update_time, price=0, shipping_price=
         WHERE id = ?
         ''', (ebay_price, update_time, profit, margin, item_id))
 
-def get_pending_price_updates_count():
-    """Get count of items needing price updates."""
+def update_item_prices(updates):
+    """
+    Update several items' prices and margins in one transaction.
+
+    updates is a list of (item_id, ebay_price, update_time, price, shipping_price)
+    tuples, as passed to update_item_price.
+    """
+    rows = []
+    for item_id, ebay_price, update_time, price, shipping_price in updates:
+        price = price or 0
+        profit = ebay_price - price - (shipping_price or 0)
+        margin = (profit / price * 100) if price > 0 else 0
+        rows.append((ebay_price, update_time, profit, margin, item_id))
+
     with get_db_cursor() as cursor:
-        # Get current date in Pacific timezone for comparison
-        pacific = pytz.timezone('US/Pacific')
-        pacific_time = datetime.now(pacific)
-        pacific_time_str = pacific_time.strftime('%Y-%m-%dT%H:%M:%S')
-        
-        cursor.execute('''
-        SELECT COUNT(*) as count
-        FROM items
-        WHERE (ebay_price IS NULL OR price_update_attempted = 0)
-        AND auction_end_time > ?
-        ''', [pacific_time_str])
-        
-        result = cursor.fetchone()
-        return result['count'] if result else 0 
\ No newline at end of file
+        cursor.executemany('''
+        UPDATE items
+        SET ebay_price = ?,
+            price_update_attempted = 1,
+            last_price_update = ?,
+            profit = ?,
+            margin = ?
+        WHERE id = ?
+        ''', rows)
+
+def ensure_price_filtered_column(cursor):
+    """Add the price_filtered column to items if this database predates it."""
+    global _price_filtered_column_ready
+    if _price_filtered_column_ready:
+        return
+    if not table_has_column(cursor, 'items', 'price_filtered'):
+        cursor.execute("ALTER TABLE items ADD COLUMN price_filtered BOOLEAN DEFAULT 0")
+    _price_filtered_column_ready = True
+
+def mark_items_filtered(items, update_time):
+    """
+    Record items the pre-filter skipped as priced at $0.00, flagged with
+    price_filtered so they are not mistaken for Gemini estimates. items are
+    dicts with id, price and shipping_price.
+    """
+    rows = []
+    for item in items:
+        price = item.get('price') or 0
+        profit = -price - (item.get('shipping_price') or 0)
+        margin = (profit / price * 100) if price > 0 else 0
+        rows.append((update_time, profit, margin, item['id']))
+    with get_db_cursor() as cursor:
+        ensure_price_filtered_column(cursor)
+        cursor.executemany('''
+        UPDATE items
+        SET ebay_price = 0,
+            price_update_attempted = 1,
+            last_price_update = ?,
+            profit = ?,
+            margin = ?,
+            price_filtered = 1
+        WHERE id = ?
+        ''', rows)
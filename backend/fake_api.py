@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the shopgoodwill ItemListing API.
+
+Replays fixtures recorded by get_products.py --record, or synthesizes
+realistic listings, with configurable latency, errors and 429s. Point the
+crawler at it to measure crawl throughput, the rate limiter and ingest speed
+offline:
+
+    python fake_api.py --pages 200 --latency 150 --error-rate 0.02 --throttle-rate 0.01
+    GOODWILL_API_URL=http://127.0.0.1:8787/api/Search/ItemListing python get_products.py --sellers 19,198
+"""
+
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+import pytz
+from aiohttp import web
+from api_recorder import fixture_key, load_fixtures
+from map import category_names, get_category_name
+
+LISTING_PATH = '/api/Search/ItemListing'
+
+BRANDS = ['Sony', 'Pyrex', 'Levi\'s', 'Nintendo', 'KitchenAid', 'Dewalt', 'Coach', 'Canon', 'Lego', 'Fossil',
+          'Samsung', 'Corningware', 'Hamilton', 'Fender', 'Nike', 'Apple', 'Bose', 'Le Creuset', 'Seiko', 'Disney']
+PRODUCTS = ['Camera', 'Mixing Bowl Set', 'Jeans 32x34', 'Game Console', 'Stand Mixer', 'Cordless Drill', 'Handbag',
+            'Lens', 'Building Set', 'Watch', 'Microwave', 'Casserole Dish', 'Guitar', 'Sneakers', 'iPad',
+            'Headphones', 'Dutch Oven', 'Figurine Lot', 'DVD Lot', 'Book Lot']
+CONDITIONS = ['', 'Vintage', 'New In Box', 'Untested', 'Lot of 3', 'Bundle']
+
+class FakeItemListingAPI:
+    """Serves ItemListing responses from fixtures or synthesized listings."""
+
+    def __init__(self, fixtures=None, pages_per_seller=50, latency_ms=100, jitter_ms=50,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=2, seed=0):
+        self.fixtures = fixtures or {}
+        self.pages_per_seller = pages_per_seller
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.started = datetime.now(pytz.timezone('US/Pacific'))
+        self.listings = {}
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0, 'replayed': 0, 'synthesized': 0}
+
+    def seller_listings(self, seller_id):
+        """Generate (once) a deterministic catalogue for a seller."""
+        if seller_id not in self.listings:
+            rng = random.Random(f"{self.seed}:{seller_id}")
+            category_ids = sorted(category_names)
+            items = []
+            for index in range(self.pages_per_seller * 40):
+                category_id = rng.choice(category_ids)
+                condition = rng.choice(CONDITIONS)
+                title = f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)}" + (f" {condition}" if condition else "")
+                end_time = self.started + timedelta(minutes=rng.randint(10, 14 * 24 * 60))
+                items.append({
+                    'itemId': int(seller_id) * 10_000_000 + index,
+                    'sellerId': int(seller_id),
+                    'title': title,
+                    'currentPrice': round(rng.choice([rng.uniform(1, 20), rng.uniform(5, 150)]), 2),
+                    'endTime': end_time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'imageURL': f"https://images.example.invalid/{seller_id}/{index}.jpg",
+                    'shippingPrice': round(rng.uniform(4, 30), 2),
+                    'numBids': rng.choice([0, 0, 0, 1, 2, 5, 12]),
+                    'categoryId': category_id,
+                    'categoryName': get_category_name(category_id)
+                })
+            self.listings[seller_id] = items
+        return self.listings[seller_id]
+
+    def synthesize(self, payload):
+        """Build a response for payload from the synthetic catalogues."""
+        seller_ids = [sid for sid in str(payload.get('selectedSellerIds', '')).split(',') if sid.strip().isdigit()]
+        search_text = str(payload.get('searchText') or '').lower()
+        category_id = int(payload.get('categoryId') or 0)
+        page = int(payload.get('page') or 1)
+        page_size = int(payload.get('pageSize') or 40)
+
+        items = []
+        for seller_id in seller_ids:
+            items.extend(self.seller_listings(seller_id.strip()))
+        if search_text:
+            items = [item for item in items if search_text in item['title'].lower()]
+        if category_id:
+            items = [item for item in items if item['categoryId'] == category_id]
+        if str(payload.get('sortColumn')) == '1':
+            items = sorted(items, key=lambda item: item['endTime'],
+                           reverse=str(payload.get('sortDescending')).lower() == 'true')
+
+        start = (page - 1) * page_size
+        return {'searchResults': {'items': items[start:start + page_size], 'totalItems': len(items)}}
+
+    async def handle_listing(self, request):
+        self.stats['requests'] += 1
+        payload = await request.json()
+        delay = max(0.0, self.random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            self.stats['throttled'] += 1
+            return web.Response(status=429, text='Too Many Requests',
+                                headers={'Retry-After': str(self.retry_after)})
+        if roll < self.throttle_rate + self.error_rate:
+            self.stats['errors'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+
+        key = fixture_key(payload)
+        if key in self.fixtures:
+            self.stats['replayed'] += 1
+            data = self.fixtures[key]
+        elif self.pages_per_seller:
+            self.stats['synthesized'] += 1
+            data = self.synthesize(payload)
+        else:
+            data = {'searchResults': {'items': [], 'totalItems': 0}}
+        self.stats['ok'] += 1
+        return web.json_response(data)
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post(LISTING_PATH, self.handle_listing)
+        app.router.add_get('/stats', self.handle_stats)
+        return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the shopgoodwill ItemListing API')
+    parser.add_argument('--port', type=int, default=8787, help='Port to listen on')
+    parser.add_argument('--fixtures', help='Directory of fixtures recorded with get_products.py --record')
+    parser.add_argument('--pages', type=int, default=50,
+                        help='Pages of synthetic listings per seller for requests without a fixture (0 disables)')
+    parser.add_argument('--latency', type=float, default=100, help='Mean response latency in ms')
+    parser.add_argument('--jitter', type=float, default=50, help='Latency standard deviation in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=2, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthetic listings and fault injection')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else {}
+    api = FakeItemListingAPI(fixtures, args.pages, args.latency, args.jitter, args.error_rate,
+                             args.throttle_rate, args.retry_after, args.seed)
+    print(f"Serving {len(fixtures)} fixtures" + (f" and {args.pages} synthetic pages per seller" if args.pages else "")
+          + f" at http://127.0.0.1:{args.port}{LISTING_PATH}")
+    web.run_app(api.app(), port=args.port, print=None)
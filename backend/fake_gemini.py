@@ -0,0 +1,141 @@
+"""
+Offline stand-in for the Gemini model used by gemini.py.
+
+FakeGeminiModel answers the same prompts as the real model (single, grouped
+and text-first requests) with deterministic prices derived from each product
+name, after a latency drawn from a configurable distribution. It can inject
+5xx errors and 429s, and answer 429 whenever more than max_in_flight requests
+are outstanding, like a quota would. Select it with PRICING_BACKEND=fake or
+gemini.set_backend(FakeGeminiModel(...)); benchmark_pricing.py uses it to
+measure pricing throughput without an API key.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+# Words relisted items often gain that leave their fake price unchanged
+FILLER_WORDS = ('used', 'preowned', 'nice', 'clean', 'cute')
+
+class FakeAPIError(Exception):
+    """An injected API error; code is the HTTP status, like google.api_core exceptions."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+def fake_estimate(product_name):
+    """
+    Return the deterministic (price, confidence) the fake gives a product
+    name. Case, punctuation and FILLER_WORDS are ignored, so near-duplicate
+    titles get the same estimate.
+    """
+    words = [word for word in re.findall(r'[a-z0-9]+', (product_name or '').lower()) if word not in FILLER_WORDS]
+    digest = hashlib.sha1(' '.join(words).encode('utf-8')).digest()
+    if digest[0] < 38:  # About 15% of items are not worth buying
+        price = 0.0
+    else:
+        price = round(3 + int.from_bytes(digest[1:3], 'big') / 65535 * 147, 2)
+    confidence = round(0.3 + digest[3] / 255 * 0.7, 2)
+    return price, confidence
+
+class FakeGeminiModel:
+    """
+    Drop-in for genai.GenerativeModel's generate_content_async.
+
+    Latency is latency_ms on average, drawn from distribution ('fixed',
+    'uniform' within +/- spread of the mean, 'exponential', or 'lognormal'
+    with sigma spread), plus image_latency_ms per attached image. error_rate
+    and throttle_rate are the chances of a 503 or 429, and omit_rate the
+    chance that a grouped answer leaves an item out. The seed fixes latencies
+    and injected faults; prices depend only on the product name.
+    """
+
+    def __init__(self, latency_ms=300, distribution='lognormal', spread=0.5, image_latency_ms=150,
+                 error_rate=0.0, throttle_rate=0.0, omit_rate=0.0, max_in_flight=None, seed=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}'")
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.spread = spread
+        self.image_latency_ms = image_latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.omit_rate = omit_rate
+        self.max_in_flight = max_in_flight
+        self.random = random.Random(seed)
+        self.in_flight = 0
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0, 'items': 0, 'images': 0}
+
+    def _latency(self, images):
+        mean = self.latency_ms / 1000
+        if self.distribution == 'fixed':
+            latency = mean
+        elif self.distribution == 'uniform':
+            latency = self.random.uniform(mean * (1 - self.spread), mean * (1 + self.spread))
+        elif self.distribution == 'exponential':
+            latency = self.random.expovariate(1 / mean) if mean > 0 else 0.0
+        else:
+            # Scale the median so the mean stays at latency_ms
+            latency = self.random.lognormvariate(0, self.spread) * mean / math.exp(self.spread ** 2 / 2)
+        return max(0.0, latency) + images * self.image_latency_ms / 1000
+
+    def _answer(self, texts):
+        prompt = '\n'.join(texts)
+        text_first = '"confidence"' in prompt
+        items = [text for text in texts if text.lstrip().startswith('ITEM ')]
+        if items:
+            answer = []
+            for index, text in enumerate(items, start=1):
+                if self.random.random() < self.omit_rate:
+                    continue
+                name = re.search(r'Product Name: (.*)', text)
+                price, confidence = fake_estimate(name.group(1) if name else '')
+                entry = {'item': index, 'price': price}
+                if text_first:
+                    entry['confidence'] = confidence
+                answer.append(entry)
+            self.stats['items'] += len(items)
+            return json.dumps(answer)
+
+        name = re.search(r'Product Name: (.*)', prompt)
+        price, confidence = fake_estimate(name.group(1) if name else '')
+        self.stats['items'] += 1
+        if text_first:
+            return json.dumps({'price': price, 'confidence': confidence})
+        return f"${price:.2f}"
+
+    async def generate_content_async(self, contents, generation_config=None, **kwargs):
+        parts = contents if isinstance(contents, list) else [contents]
+        texts = [part for part in parts if isinstance(part, str)]
+        images = len(parts) - len(texts)
+        self.stats['requests'] += 1
+        self.stats['images'] += images
+
+        self.in_flight += 1
+        try:
+            if self.max_in_flight and self.in_flight > self.max_in_flight:
+                # Over quota: rejected quickly, without doing the work
+                await asyncio.sleep(self.latency_ms / 10000)
+                self.stats['throttled'] += 1
+                raise FakeAPIError(429, 'Resource has been exhausted (e.g. check quota).')
+            await asyncio.sleep(self._latency(images))
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                self.stats['throttled'] += 1
+                raise FakeAPIError(429, 'Resource has been exhausted (e.g. check quota).')
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats['errors'] += 1
+                raise FakeAPIError(503, 'The service is currently unavailable.')
+            self.stats['ok'] += 1
+            return FakeResponse(self._answer(texts))
+        finally:
+            self.in_flight -= 1
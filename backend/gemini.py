@@ -1,6 +1,9 @@
 import asyncio
+import atexit
+import contextvars
 import google.generativeai as genai
 import re
+import json
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
@@ -8,9 +11,20 @@ import os
 import logging
 import sys
 import base64
-import requests
-from io import BytesIO
-from db import get_items_for_price_update, update_item_price, get_pending_price_updates_count
+import time
+import concurrent.futures
+import aiohttp
+from crawl_session import create_http_session
+from price_cache import PriceCache, cache_totals
+from image_prep import ImagePreprocessor
+from price_writer import PriceWriter
+from listing_clusters import ListingClusters
+from price_filter import PriceFilter
+from rate_limiter import AdaptiveConcurrencyLimiter, CircuitBreaker
+from db import get_margin_threshold, mark_items_filtered
+from price_scheduler import (claim_priority_items, release_items, renew_leases, record_price_failure, new_worker_id,
+                             get_pending_priority_count, get_too_late_count, MAX_PRICE_FAILURES,
+                             LEASE_SECONDS)
 
 # Set up logging
 logging.basicConfig(
@@ -27,23 +41,213 @@ logger.info("Starting Gemini module")
 # Load environment variables
 load_dotenv()
 api_key = os.getenv("API_KEY")
-if not api_key:
-    raise ValueError("API_KEY not found in .env file")
+# "gemini" calls the real API; "fake" uses fake_gemini.FakeGeminiModel, which needs no API key
+PRICING_BACKEND = os.getenv("PRICING_BACKEND", "gemini")
 
-# Configure Gemini with API key
-genai.configure(api_key=api_key)
-logger.info("Gemini API configured")
+if api_key:
+    # Configure Gemini with API key
+    genai.configure(api_key=api_key)
+    logger.info("Gemini API configured")
 
 # Pacific timezone for timestamps
 pacific = pytz.timezone('US/Pacific')
 
 # Using flash-lite model for fast multimodal processing
 MODEL_NAME = 'models/gemini-2.0-flash-lite'
+# Bump whenever the appraisal prompt changes; cached estimates from other versions are discarded
+PROMPT_VERSION = 2
 
-def get_image_data(image_url):
+IMAGE_TIMEOUT = 10  # Seconds allowed for an image download
+REQUEST_TIMEOUT = 60  # Seconds allowed for a Gemini request
+# Attempts per request when Gemini answers with quota, server or timeout errors
+REQUEST_ATTEMPTS = int(os.getenv("GEMINI_REQUEST_ATTEMPTS", "4"))
+
+# Database reads and writes run on this single thread so they never block the event loop
+# (and only one thread ever writes, keeping SQLite lock contention out of the picture)
+db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='gemini-db')
+
+_model = None
+
+# Estimates keyed on listing content, so relisted items skip the model call
+price_cache = PriceCache(f"{MODEL_NAME}:v{PROMPT_VERSION}")
+
+# Downscales and re-encodes images in worker processes, caching the results on disk. Runs on other
+# threads may be using the pool, so it is only shut down when the process exits
+image_preprocessor = ImagePreprocessor()
+atexit.register(image_preprocessor.close)
+
+# Listings packed into one Gemini request by update_prices; 1 (the default) prices every item on its own.
+# Grouped estimates are cached apart from single ones, so turning grouping on starts from a cold cache.
+ITEMS_PER_PROMPT = int(os.getenv("GEMINI_ITEMS_PER_PROMPT", "1"))
+# Grouped requests sent and items they priced, plus items that had to be retried alone
+batch_stats = {'requests': 0, 'items': 0, 'fallbacks': 0}
+# Gemini requests made by this process; each run's call budget is checked against its pipeline's own count
+usage = {'calls': 0}
+
+# Every Gemini request goes through generate(): the breaker pauses requests while Gemini keeps failing,
+# and each PricingPipeline's own limiter adapts the number it has in flight (AIMD) to latency and throttling
+breaker = CircuitBreaker('gemini')
+# Gemini requests that failed, and how many of those were retried
+error_stats = {'failed': 0, 'retried': 0}
+
+class PricingError(Exception):
+    """
+    A pricing request failed, as opposed to the model pricing an item at $0.00.
+    retryable is set for quota, server and timeout errors, which are worth
+    another attempt.
+    """
+    
+    def __init__(self, message, retryable=False, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+# Cascade mode prices each item from its text first and only downloads its image when the
+# text estimate is unsure or lands close to the buy/skip decision
+CASCADE = os.getenv("GEMINI_CASCADE", "0") == "1"
+# Text estimates below this confidence (0-1) are checked again with the image
+CASCADE_MIN_CONFIDENCE = float(os.getenv("GEMINI_CASCADE_MIN_CONFIDENCE", "0.7"))
+# ...as are estimates whose margin is within this many percentage points of the margin threshold
+CASCADE_MARGIN_BAND = float(os.getenv("GEMINI_CASCADE_MARGIN_BAND", "20"))
+# Items the cascade priced from text alone and items it sent on to the image request
+cascade_stats = {'text': 0, 'escalated': 0}
+
+# Clustering prices one representative of each group of near-duplicate listings and shares
+# its estimate with the rest (see listing_clusters.py)
+CLUSTERING = os.getenv("GEMINI_CLUSTERING", "0") == "1"
+# Cluster counts summed over this process's runs
+cluster_stats = {}
+
+# The local pre-filter (price_filter.py) skips items it predicts are not worth a Gemini call:
+# 'off', 'shadow' (only log what it would skip) or 'on'
+PREFILTER = os.getenv("GEMINI_PREFILTER", "off")
+
+# The counters above are totals for the process. Each PricingPipeline also keeps its own copy, and
+# its own limiter, which count() and generate() find through this context variable, so a run's budget
+# and summary cover that run alone and runs on different threads' event loops never share a limiter
+STATS = {'usage': usage, 'batch': batch_stats, 'errors': error_stats, 'cascade': cascade_stats}
+_current_run = contextvars.ContextVar('current_run', default=None)
+
+def count(name, key, amount=1):
+    """Add amount to STATS[name][key] and to the same counter of the pipeline running this task."""
+    STATS[name][key] += amount
+    run = _current_run.get()
+    if run is not None:
+        run.counters[name][key] += amount
+
+def current_limiter():
+    """Return the limiter of the pipeline running this task; a request outside one gets its own."""
+    run = _current_run.get()
+    return run.limiter if run is not None else AdaptiveConcurrencyLimiter('gemini', max_limit=1)
+
+def get_model():
+    """
+    Return the shared model client: set_backend's model, the fake with
+    PRICING_BACKEND=fake, or Gemini otherwise (which needs API_KEY).
+    """
+    global _model
+    if _model is None:
+        if PRICING_BACKEND == 'fake':
+            from fake_gemini import FakeGeminiModel
+            _model = FakeGeminiModel()
+            logger.info("Using the offline fake Gemini backend")
+        elif PRICING_BACKEND != 'gemini':
+            raise ValueError(f"Unknown PRICING_BACKEND '{PRICING_BACKEND}'")
+        elif not api_key:
+            raise ValueError("API_KEY not found in .env file")
+        else:
+            _model = genai.GenerativeModel(model_name=MODEL_NAME)
+    return _model
+
+def set_backend(model):
+    """
+    Send every pricing request to model instead of Gemini.
+    
+    model needs an async generate_content_async(contents, generation_config=...)
+    returning an object with a .text attribute, as genai.GenerativeModel has
+    (see fake_gemini.FakeGeminiModel). Errors it raises should carry the HTTP
+    status as .code so classify_error can tell throttling from other failures.
+    """
+    global _model
+    _model = model
+
+def classify_error(error):
+    """Return (retryable, HTTP status or None) for an exception raised by a Gemini request."""
+    status = getattr(error, 'code', None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500, status
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientError)):
+        return True, None
+    return False, None
+
+async def generate(contents, generation_config):
+    """
+    Send one request to Gemini through the breaker and the concurrency limiter.
+    
+    Latency and throttling are reported to the running pipeline's limiter
+    (see current_limiter) so it can adjust how many requests are in flight,
+    and failures to breaker. Non-retryable errors (a
+    bad request, a blocked response) still show Gemini is answering, so they
+    count as a success for the breaker. Raises PricingError if the request
+    fails.
+    """
+    model = get_model()
+    limiter = current_limiter()
+    trial = await breaker.wait()
+    settled = False
+    try:
+        async with limiter:
+            count('usage', 'calls')
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(contents, generation_config=generation_config), REQUEST_TIMEOUT)
+                text = response.text
+            except Exception as e:
+                retryable, status = classify_error(e)
+                count('errors', 'failed')
+                if retryable:
+                    limiter.on_throttle(status=status)
+                    if breaker.on_failure():
+                        logger.warning(f"Gemini is failing ({str(e)}); pausing requests for "
+                                       f"{breaker.open_until - time.monotonic():.0f}s")
+                else:
+                    breaker.on_success()
+                settled = True
+                raise PricingError(str(e) or type(e).__name__, retryable, status) from e
+            limiter.on_success(time.monotonic() - started)
+            breaker.on_success()
+            settled = True
+            return text
+    finally:
+        if trial and not settled:
+            # Cancelled mid-trial: let the next request try instead of leaving the breaker half-open
+            breaker.abandon_trial()
+
+async def with_retries(func, *args):
+    """Await func(*args), retrying retryable PricingErrors up to REQUEST_ATTEMPTS times with backoff."""
+    for attempt in range(1, REQUEST_ATTEMPTS + 1):
+        try:
+            return await func(*args)
+        except PricingError as e:
+            if not e.retryable or attempt == REQUEST_ATTEMPTS:
+                raise
+            count('errors', 'retried')
+            delay = min(30, 2 ** attempt)
+            logger.warning(f"Gemini request failed ({str(e)}), retrying in {delay}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+
+async def run_db(func, *args):
+    """Run a blocking db.py call on the database thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, func, *args)
+
+async def get_image_data(image_url, session=None):
     """
     Get image data from a URL or base64 string.
-    Returns image data in the format required by Gemini API.
+    Returns image data in the format required by Gemini API, downscaled and
+    re-encoded by image_preprocessor and labelled with its real MIME type.
+    Pass an aiohttp session to reuse its connections across downloads.
     """
     try:
         if not image_url:
@@ -51,21 +255,32 @@ def get_image_data(image_url):
             return None
             
         if image_url.startswith('http'):
-            # It's a URL, download the image
+            # It's a URL; use the processed copy from an earlier run if there is one
+            cached = await image_preprocessor.cached(image_url)
+            if cached:
+                return cached
+            
+            # Otherwise download the image
+            if session is None:
+                async with create_http_session() as session:
+                    return await get_image_data(image_url, session)
             logger.info(f"Downloading image from URL: {image_url}")
-            response = requests.get(image_url, timeout=10)
-            if response.status_code != 200:
-                logger.warning(f"Failed to download image: HTTP {response.status_code}")
-                return None
-                
-            image_bytes = BytesIO(response.content).getvalue()
-            return {"mime_type": "image/jpeg", "data": image_bytes}
+            timeout = aiohttp.ClientTimeout(total=IMAGE_TIMEOUT)
+            async with session.get(image_url, timeout=timeout) as response:
+                if response.status != 200:
+                    logger.warning(f"Failed to download image: HTTP {response.status}")
+                    return None
+                image_bytes = await response.read()
+            image_data = await image_preprocessor.prepare(image_bytes, image_url)
+            if image_data is None:
+                logger.warning(f"Downloaded file is not a readable image: {image_url}")
+            return image_data
         else:
             # It's already a base64 string
             try:
                 # Make sure it's proper base64 by decoding and re-encoding
                 image_bytes = base64.b64decode(image_url)
-                return {"mime_type": "image/jpeg", "data": image_bytes}
+                return await image_preprocessor.prepare(image_bytes)
             except Exception as e:
                 logger.warning(f"Invalid base64 image data: {str(e)}")
                 return None
@@ -73,10 +288,13 @@ def get_image_data(image_url):
         logger.error(f"Error processing image: {str(e)}")
         return None
 
-def analyze_item_price(product_name, category_name=None, image_data=None, shipping_price=0):
+async def analyze_item_price(product_name, category_name=None, image_data=None, shipping_price=0):
     """
     Analyze a product's price using Gemini Flash-Lite with multimodal capabilities.
     Uses both product images and text data for more accurate pricing.
+    Raises PricingError if the request fails, the answer holds no price or
+    anything else goes wrong (not retryable); $0.00 is always the model's
+    answer.
     """
     if not product_name or len(product_name.strip()) < 3:
         logger.warning(f"Skipping analysis for invalid product name: '{product_name}'")
@@ -84,7 +302,6 @@ def analyze_item_price(product_name, category_name=None, image_data=None, shippi
     
     try:
         logger.info(f"Analyzing '{product_name}' with {MODEL_NAME}")
-        model = genai.GenerativeModel(model_name=MODEL_NAME)
         
         # Create a more detailed prompt for accurate pricing
         prompt = f"""You are a professional product appraiser specializing in secondhand and resale markets.
@@ -127,19 +344,13 @@ def analyze_item_price(product_name, category_name=None, image_data=None, shippi
         if image_data:
             # Multimodal request with image
             logger.info("Including image data in request")
-            response = model.generate_content(
-                [image_data, prompt],
-                generation_config=generation_config
-            )
+            response_text = await generate([image_data, prompt], generation_config)
         else:
             # Text-only request
             logger.info("Text-only request (no image available)")
-            response = model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
+            response_text = await generate(prompt, generation_config)
         
-        response_text = response.text.strip()
+        response_text = response_text.strip()
         logger.info(f"Response: '{response_text}'")
         
         # Extract dollar amount with improved regex
@@ -153,122 +364,931 @@ def analyze_item_price(product_name, category_name=None, image_data=None, shippi
             return 0.0
         
         logger.warning(f"Invalid response format: '{response_text}'")
-        return 0.0
+        raise PricingError(f"Invalid response format: '{response_text}'")
     
+    except PricingError as e:
+        logger.error(f"Request failed for '{product_name}': {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Request failed for '{product_name}': {str(e)}")
-        return 0.0
+        raise PricingError(str(e) or type(e).__name__) from e
+
+async def analyze_item_text(product_name, category_name=None, shipping_price=0):
+    """
+    Price a product from its text alone and rate the estimate's confidence.
+    
+    This is the cascade's cheap first request: no image is downloaded or sent,
+    and the model answers with JSON. Returns (price, confidence); an
+    unparseable answer returns (0.0, 0.0), so the item goes on to the image
+    request if it has an image. Raises PricingError if the request fails.
+    """
+    if not product_name or len(product_name.strip()) < 3:
+        logger.warning(f"Skipping analysis for invalid product name: '{product_name}'")
+        return 0.0, 1.0
+    
+    try:
+        logger.info(f"Analyzing '{product_name}' from text with {MODEL_NAME}")
+        
+        prompt = f"""You are a professional product appraiser specializing in secondhand and resale markets.
+        
+        ITEM DETAILS:
+        - Product Name: {product_name}
+        - Category: {category_name or 'Unknown'}
+        - Shipping Cost: ${shipping_price:.2f}
+        
+        TASK:
+        Analyze this product from Goodwill and estimate its exact fair market resale value on platforms like eBay.
+        
+        PRICING GUIDELINES:
+        1. Be precise with your price estimate (avoid rounded values like $50.00 or $100.00)
+        2. Consider brand, condition, features, and rarity
+        3. Bulk or wholesale items are generally not worth as much as you think they are.
+        4. Research comparable recent sales when possible
+        5. Factor in the product category: {category_name or 'Unknown'}
+        6. Your estimate determines whether our company will buy the item or not. If the item is not worth purchasing at all, give it a price of 0.
+        
+        RESPONSE FORMAT:
+        Respond ONLY with JSON like {{"price": 12.34, "confidence": 0.8}}.
+        "confidence" is how sure you are of the price from the text alone, from 0 (guess) to 1 (certain).
+        Rate it low when a photo would change the estimate, for example when condition, completeness,
+        authenticity or the exact model matters.
+        """
+        
+        generation_config = genai.types.GenerationConfig(
+            candidate_count=1,
+            max_output_tokens=50,
+            temperature=0.1,
+            response_mime_type='application/json'
+        )
+        price, confidence = parse_price_confidence(await generate(prompt, generation_config))
+        if price is None:
+            return 0.0, 0.0
+        logger.info(f"Text estimate for '{product_name}': ${price:.2f} (confidence {confidence})")
+        return price, confidence if confidence is not None else 0.0
+    
+    except PricingError as e:
+        logger.error(f"Text request failed for '{product_name}': {str(e)}")
+        raise
+
+def needs_image(listing, price, confidence, margin_threshold, min_confidence=CASCADE_MIN_CONFIDENCE,
+                margin_band=CASCADE_MARGIN_BAND):
+    """
+    Decide whether the cascade should re-price a listing with its image.
+    
+    Listings without an image never need one. The rest are re-priced when the
+    text estimate's confidence is below min_confidence, or when its margin
+    (computed as db.update_item_price does) is within margin_band percentage
+    points of margin_threshold, where the image could flip the decision.
+    """
+    if not listing.get('image_url'):
+        return False
+    if confidence is None or confidence < min_confidence:
+        return True
+    if listing['price'] <= 0:
+        return False
+    margin = (price - listing['price'] - listing['shipping_price']) / listing['price'] * 100
+    return abs(margin - margin_threshold) <= margin_band
+
+def parse_confidence(value):
+    """Return a 0-1 confidence from a model's JSON value (percentages are scaled down), or None."""
+    try:
+        confidence = float(str(value).replace('%', ''))
+    except (TypeError, ValueError):
+        return None
+    if confidence > 1:
+        confidence /= 100
+    return min(max(confidence, 0.0), 1.0)
+
+def parse_price_confidence(response_text):
+    """
+    Parse a text-first response like {"price": 12.34, "confidence": 0.8}.
+    Returns (price, confidence), or (None, None) if there is no usable price.
+    """
+    text = response_text.strip()
+    fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        entry = json.loads(text)
+    except ValueError:
+        logger.warning(f"Unparseable text-first response: '{response_text[:200]}'")
+        return None, None
+    if isinstance(entry, list) and entry:
+        entry = entry[0]
+    if not isinstance(entry, dict):
+        return None, None
+    try:
+        price = float(str(entry.get('price')).replace('$', '').replace(',', ''))
+    except (TypeError, ValueError):
+        return None, None
+    if price < 0:
+        return None, None
+    return round(price, 2), parse_confidence(entry.get('confidence'))
 
-async def process_batch(items, semaphore):
-    """Process a batch of items with rate limiting."""
+def parse_batch_estimates(response_text, count):
+    """
+    Parse a grouped pricing response into {index: (price, confidence)} for
+    items 1..count (returned zero-based). confidence is None when the entry
+    has none. Entries that are missing or malformed are left out.
+    """
+    text = response_text.strip()
+    # Tolerate a fenced ```json block around the array
+    fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        logger.warning(f"Unparseable group response: '{response_text[:200]}'")
+        return {}
+    if isinstance(entries, dict):
+        entries = entries.get('items') or entries.get('prices') or []
+    
+    estimates = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = int(entry.get('item')) - 1
+            price = float(str(entry.get('price')).replace('$', '').replace(',', ''))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and price >= 0:
+            estimates[index] = (round(price, 2), parse_confidence(entry.get('confidence')))
+    return estimates
+
+async def analyze_items_batch(listings):
+    """
+    Price several listings with a single Gemini request.
+    
+    Each listing (see prepare_listing) is numbered in the prompt, followed by
+    its image if it has one, and the model answers with a JSON array of
+    {"item": n, "price": x}. Returns {index: price} for the listings the
+    response priced; callers price the rest individually. Raises PricingError
+    if the request fails.
+    """
+    estimates = await request_group_estimates(listings)
+    return {index: price for index, (price, _) in estimates.items()}
+
+async def analyze_items_text(listings):
+    """
+    Price several listings from their text alone with a single Gemini request.
+    
+    Images are neither sent nor needed. The model also rates its confidence
+    in each estimate, so the cascade can decide which items deserve a look at
+    their image. Returns {index: (price, confidence)} for the listings the
+    response priced.
+    """
+    return await request_group_estimates(listings, text_first=True)
+
+async def request_group_estimates(listings, text_first=False):
+    """
+    Send one grouped pricing request; returns {index: (price, confidence)}
+    (see parse_batch_estimates). Raises PricingError if the request fails.
+    """
+    try:
+        logger.info(f"Analyzing {len(listings)} items in one {'text-only ' if text_first else ''}request "
+                    f"with {MODEL_NAME}")
+        
+        parts = [f"""You are a professional product appraiser specializing in secondhand and resale markets.
+        
+        TASK:
+        Below are {len(listings)} products from Goodwill. Estimate each one's exact fair market resale value
+        on platforms like eBay.
+        
+        PRICING GUIDELINES:
+        1. Be precise with your price estimates (avoid rounded values like $50.00 or $100.00)
+        2. Consider brand, condition, features, and rarity
+        3. Bulk or wholesale items are generally not worth as much as you think they are.
+        4. Research comparable recent sales when possible
+        5. Factor in each product's category
+        6. Your estimates determine whether our company will buy each item or not. If an item is not worth
+           purchasing at all, give it a price of 0.
+        7. Where an image follows an item, use it to judge condition, authenticity, features, materials and defects.
+           Each image belongs only to the item directly before it.
+        """]
+        for index, listing in enumerate(listings, start=1):
+            image_data = None if text_first else listing['image_data']
+            parts.append(f"""ITEM {index}:
+        - Product Name: {listing['product_name']}
+        - Category: {listing['category_name'] or 'Unknown'}
+        - Shipping Cost: ${listing['shipping_price']:.2f}
+        - Image: {'attached below' if image_data else 'none'}
+        """)
+            if image_data:
+                parts.append(image_data)
+        if text_first:
+            parts.append(f"""RESPONSE FORMAT:
+        Respond ONLY with a JSON array containing one object per item, in order, like
+        [{{"item": 1, "price": 12.34, "confidence": 0.9}}, {{"item": 2, "price": 0, "confidence": 0.3}}].
+        "confidence" is how sure you are of the price from the text alone, from 0 (guess) to 1 (certain).
+        Rate it low when a photo would change the estimate, for example when condition, completeness,
+        authenticity or the exact model matters.
+        """)
+        else:
+            parts.append(f"""RESPONSE FORMAT:
+        Respond ONLY with a JSON array containing one object per item, in order, like
+        [{{"item": 1, "price": 12.34}}, {{"item": 2, "price": 0}}].
+        Use a price of 0 for any item you cannot price with confidence.
+        """)
+        
+        generation_config = genai.types.GenerationConfig(
+            candidate_count=1,
+            max_output_tokens=(45 if text_first else 30) * len(listings) + 50,
+            temperature=0.1,
+            response_mime_type='application/json'
+        )
+        estimates = parse_batch_estimates(await generate(parts, generation_config), len(listings))
+        count('batch', 'requests')
+        count('batch', 'items', len(estimates))
+        logger.info(f"Group response priced {len(estimates)} of {len(listings)} items")
+        return estimates
+    
+    except PricingError as e:
+        logger.error(f"Group request for {len(listings)} items failed: {str(e)}")
+        raise
+
+async def prepare_listing(item, session=None, with_image=True):
+    """
+    Collect what the model needs for an item, downloading its image unless
+    with_image is False (see attach_image). Returns None if it has no name.
+    """
+    item_id = item.get('id', 'unknown')
+    product_name = item.get('product_name', '')
+    if not product_name:
+        logger.warning(f"Skipping item {item_id}: No product name")
+        return None
+    
+    logger.info(f"Processing item {item_id}: {product_name}")
+    listing = {
+        'id': item_id,
+        'product_name': product_name,
+        'category_name': item.get('category_name', ''),
+        'price': float(item.get('price', 0) or 0),
+        'shipping_price': float(item.get('shipping_price', 0) or 0),
+        'image_url': item.get('image_url', '') or '',
+        'image_data': None
+    }
+    if with_image:
+        await attach_image(listing, session)
+    return listing
+
+async def attach_image(listing, session=None):
+    """Download and process a prepared listing's image, if it has one, into listing['image_data']."""
+    if listing['image_url']:
+        logger.info(f"Item has an image URL, processing...")
+        listing['image_data'] = await get_image_data(listing['image_url'], session)
+        if listing['image_data']:
+            logger.info("Successfully processed image")
+        else:
+            logger.warning("Failed to process image, continuing with text-only analysis")
+
+async def save_price(listing, ebay_price, writer):
+    """Queue an estimate for a prepared listing on a PriceWriter. Returns True if the item got a non-zero price."""
+    update_time = datetime.now(pacific).strftime('%Y-%m-%dT%H:%M:%S')
+    await writer.add(listing['id'], ebay_price, update_time, listing['price'], listing['shipping_price'])
+    if ebay_price > 0:
+        logger.info(f"Updated item {listing['id']} with price ${ebay_price:.2f}")
+        return True
+    logger.info(f"Marked item {listing['id']} as attempted (price $0.00)")
+    return False
+
+class PricingPipeline:
+    """
+    Streams items through claim -> prepare -> price -> save without batch barriers.
+    
+    claim(limit) is an async callable returning up to limit more items (an
+    empty list once there are none), and estimates are queued on writer, a
+    started PriceWriter the caller closes. Claimed rows and prepared listings (image
+    downloaded, cache checked) are kept up to prefetch deep ahead of the model,
+    and max_concurrent pricing tasks each take the next items_per_prompt
+    listings as soon as their previous request returns, so a slow Gemini call
+    only holds up its own slot. Identical listings in flight share one
+    estimate. With call_budget, no more items are claimed than the remaining
+    requests can price; only this pipeline's own requests count against it.
+    
+    Requests go through the pipeline's own limiter, whose ceiling is
+    max_concurrent, so the number actually in flight adapts to Gemini's
+    latency and throttling.
+    Failed requests are retried (with_retries); items whose requests still
+    fail are left unpriced for a later run rather than written as $0.00.
+    
+    With cascade, listings are prepared without their images and priced from
+    text first; only those needs_image picks out (judged against
+    margin_threshold) have their image downloaded and are priced again with
+    it.
+    
+    renew(item_ids), if given, is an async callable that extends the
+    leases of claimed items; it is called for listings that have waited
+    RENEW_AFTER seconds since their claim when they are handed to a pricing
+    task, so a breaker pause or backoff can't let their leases run out.
+    
+    With clusters (a ListingClusters), a listing that is a near-duplicate
+    of one already priced or in flight this run takes that estimate instead
+    of a request of its own, apart from the members clusters picks to audit.
+    """
+    
+    # Seconds a pricing task waits for a group to fill before sending what it has
+    GROUP_LINGER = 0.2
+    # Listings claimed longer ago than this have their leases renewed when a pricing task takes them
+    RENEW_AFTER = LEASE_SECONDS / 4
+    
+    def __init__(self, claim, session, writer, max_concurrent=60, items_per_prompt=1, call_budget=None,
+                 prefetch=None, progress_every=None, total_pending=None, cascade=False, margin_threshold=50,
+                 clusters=None, renew=None):
+        self.claim = claim
+        self.session = session
+        self.writer = writer
+        self.max_concurrent = max(1, max_concurrent)
+        self.items_per_prompt = max(1, items_per_prompt)
+        self.call_budget = call_budget
+        self.prefetch = prefetch or self.max_concurrent * self.items_per_prompt
+        self.progress_every = progress_every or self.prefetch
+        self.remaining = total_pending
+        self.cascade = cascade
+        self.margin_threshold = margin_threshold
+        self.clusters = clusters
+        self.renew = renew
+        # The kind of prompt a listing's estimate is looked up under in price_cache. Estimates are stored
+        # under the kind that produced them (listing['prompt']), so a cascade only finds text estimates
+        # it accepted, and a fallback to a single-item request is cached as one
+        self.prompt = 'text' if cascade else 'grouped' if self.items_per_prompt > 1 else 'single'
+        self.candidates = asyncio.Queue(maxsize=self.prefetch)
+        self.ready = asyncio.Queue(maxsize=self.prefetch)
+        # Groups are filled one at a time, so slow preparation yields a few full groups rather than many small ones
+        self.assembling = asyncio.Lock()
+        self.in_flight = {}
+        self.outstanding = 0
+        self.stats = {'claimed': 0, 'processed': 0, 'succeeded': 0, 'failed': 0, 'cached': 0, 'shared': 0,
+                      'clustered': 0, 'unpriced': 0, 'rejected': 0}
+        # This run's share of the process-wide STATS counters, Gemini calls included
+        self.counters = {name: dict.fromkeys(totals, 0) for name, totals in STATS.items()}
+        self.limiter = AdaptiveConcurrencyLimiter('gemini', max_limit=self.max_concurrent)
+    
+    def _finish(self, success):
+        """Count an item as done and log progress now and then."""
+        self.outstanding -= 1
+        self.stats['processed'] += 1
+        self.stats['succeeded' if success else 'failed'] += 1
+        if self.remaining is not None:
+            self.remaining = max(0, self.remaining - 1)
+        if self.stats['processed'] % self.progress_every == 0:
+            remaining = f", {self.remaining} remaining" if self.remaining is not None else ""
+            logger.info(f"Progress: {self.stats['processed']} processed{remaining}")
+    
+    def _claim_limit(self):
+        if not self.call_budget:
+            return self.prefetch
+        calls_left = self.call_budget - self.counters['usage']['calls']
+        queued_calls = -(-self.outstanding // self.items_per_prompt)
+        return min(self.prefetch, (calls_left - queued_calls) * self.items_per_prompt)
+    
+    async def _claim_loop(self):
+        try:
+            while True:
+                limit = self._claim_limit()
+                if limit <= 0:
+                    if self.outstanding == 0:
+                        logger.info(f"Call budget of {self.call_budget} Gemini requests spent")
+                        break
+                    await asyncio.sleep(0.1)  # Claimed items may still need fewer calls than reserved
+                    continue
+                items = await self.claim(limit)
+                if not items:
+                    logger.info("No more items to process")
+                    break
+                self.stats['claimed'] += len(items)
+                self.outstanding += len(items)
+                claimed_at = time.monotonic()
+                for item in items:
+                    item['claimed_at'] = claimed_at
+                    await self.candidates.put(item)
+        except Exception as e:
+            logger.error(f"Error claiming items: {str(e)}")
+        finally:
+            for _ in range(self.max_concurrent):
+                await self.candidates.put(None)
+    
+    async def _prepare_loop(self):
+        while True:
+            item = await self.candidates.get()
+            if item is None:
+                return
+            try:
+                await self._prepare(item)
+            except Exception as e:
+                logger.error(f"Error processing item {item.get('id', 'unknown')}: {str(e)}")
+                self._finish(False)
+    
+    async def _prepare(self, item):
+        listing = await prepare_listing(item, self.session, with_image=not self.cascade)
+        if listing is None:
+            self._finish(False)
+            return
+        listing['claimed_at'] = item.get('claimed_at', time.monotonic())
+        listing['key'] = price_cache.key(listing['product_name'], listing['category_name'], listing['image_data'],
+                                         self.prompt)
+        
+        price = None
+        if listing['key'] not in self.in_flight:
+            price = await run_db(price_cache.get, listing['key'])
+            if price is not None:
+                logger.info(f"Cache hit for '{listing['product_name']}': ${price:.2f}")
+                self.stats['cached'] += 1
+            elif self.clusters is not None:
+                price = await self._cluster_estimate(listing)
+            if price is None and listing['key'] not in self.in_flight:
+                # Checked again: a twin may have started while the cache was read
+                future = asyncio.get_running_loop().create_future()
+                self.in_flight[listing['key']] = future
+                signature = listing.pop('new_cluster', None)
+                if signature is not None:
+                    self.clusters.add(listing['product_name'], signature, future)
+                await self.ready.put(listing)
+                return
+        if price is None:
+            # Identical listings priced at the same time share one estimate
+            price_cache.shared += 1
+            self.stats['shared'] += 1
+            price = await asyncio.shield(self.in_flight[listing['key']])
+            if price is None:
+                # The shared estimate failed; leave this item unpriced too
+                self.stats['unpriced'] += 1
+                self._finish(False)
+                return
+        self._finish(await save_price(listing, price, self.writer))
+    
+    async def _cluster_estimate(self, listing):
+        """
+        Return the estimate listing shares with its cluster, or None if it is
+        priced itself: as the representative of a new cluster (its signature
+        is left in listing['new_cluster']), as an audit of its cluster
+        (listing['audit']), or because the cluster's estimate can't be shared.
+        """
+        signature = await asyncio.get_running_loop().run_in_executor(
+            None, self.clusters.signature, listing['product_name'], listing['category_name'], listing['image_data'])
+        cluster = self.clusters.find(signature)
+        if cluster is None:
+            listing['new_cluster'] = signature
+            return None
+        await asyncio.shield(cluster.future)
+        decision = self.clusters.assign(cluster)
+        if decision == 'audit':
+            listing['audit'] = cluster
+            return None
+        if decision == 'alone':
+            return None
+        price = cluster.future.result()
+        logger.info(f"Cluster estimate for '{listing['product_name']}': ${price:.2f} "
+                    f"(from '{cluster.representative}')")
+        self.stats['clustered'] += 1
+        return price
+    
+    async def _renew_leases(self, group):
+        if self.renew is None:
+            return
+        now = time.monotonic()
+        stale = [listing for listing in group if now - listing['claimed_at'] > self.RENEW_AFTER]
+        if not stale:
+            return
+        try:
+            await self.renew([listing['id'] for listing in stale])
+        except Exception as e:
+            logger.warning(f"Error renewing leases of {len(stale)} items: {str(e)}")
+            return
+        for listing in stale:
+            listing['claimed_at'] = now
+    
+    async def _take_group(self):
+        """Wait for the next listing, then briefly for more to fill a group. Returns (group, finished)."""
+        if self.items_per_prompt == 1:
+            first = await self.ready.get()
+            return ([first], False) if first is not None else ([], True)
+        async with self.assembling:
+            return await self._fill_group()
+    
+    async def _fill_group(self):
+        first = await self.ready.get()
+        if first is None:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + self.GROUP_LINGER
+        while len(group) < self.items_per_prompt:
+            try:
+                listing = self.ready.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    listing = await asyncio.wait_for(self.ready.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if listing is None:
+                return group, True
+            group.append(listing)
+        return group, False
+    
+    async def _price_group(self, group):
+        """
+        Return {index in group: price}, retrying alone any listing a group
+        response leaves out. Each priced listing's 'prompt' records whether
+        its estimate came from a 'grouped' or 'single' request. Listings whose
+        requests failed are missing from the result (flagged
+        'permanent_failure' if the error was not retryable); a group request
+        that still fails after its retries raises PricingError.
+        """
+        prices = await self._group_request(analyze_items_batch, group)
+        for index in prices:
+            group[index]['prompt'] = 'grouped'
+        missing = [index for index in range(len(group)) if index not in prices]
+        if missing and len(group) > 1:
+            count('batch', 'fallbacks', len(missing))
+            logger.warning(f"Group response priced {len(group) - len(missing)} of {len(group)} items, "
+                           f"pricing {len(missing)} individually")
+        
+        single_prices = await asyncio.gather(*[
+            with_retries(analyze_item_price, group[index]['product_name'], group[index]['category_name'],
+                         group[index]['image_data'], group[index]['shipping_price'])
+            for index in missing
+        ], return_exceptions=True)
+        for index, price in zip(missing, single_prices):
+            if isinstance(price, Exception):
+                self._note_failure(group[index], price)
+                if len(group) == 1:
+                    raise price
+            else:
+                prices[index] = price
+                group[index]['prompt'] = 'single'
+        return prices
+    
+    async def _group_request(self, request, group):
+        """
+        Await request(group) with retries, or return {} for a single listing.
+        A non-retryable failure may be down to one bad listing, so it also
+        returns {} and the listings are tried one by one.
+        """
+        if len(group) == 1:
+            return {}
+        try:
+            return await with_retries(request, group)
+        except PricingError as e:
+            if e.retryable:
+                raise
+            logger.warning(f"Group request for {len(group)} items failed ({str(e)}), pricing them individually")
+            return {}
+    
+    def _note_failure(self, listing, error):
+        if isinstance(error, PricingError) and not error.retryable:
+            listing['permanent_failure'] = True
+    
+    async def _price_cascade(self, group):
+        """
+        Price group from text, then again with images for the listings
+        needs_image picks out. Failures are reported as in _price_group; a
+        failed image request leaves its listings with their text estimates.
+        """
+        estimates = await self._group_request(analyze_items_text, group)
+        
+        missing = [index for index in range(len(group)) if index not in estimates]
+        text_estimates = await asyncio.gather(*[
+            with_retries(analyze_item_text, group[index]['product_name'], group[index]['category_name'],
+                         group[index]['shipping_price'])
+            for index in missing
+        ], return_exceptions=True)
+        for index, estimate in zip(missing, text_estimates):
+            if isinstance(estimate, Exception):
+                self._note_failure(group[index], estimate)
+                if len(group) == 1:
+                    raise estimate
+            else:
+                estimates[index] = estimate
+        
+        prices = {index: price for index, (price, _) in estimates.items()}
+        escalate = [index for index, (price, confidence) in estimates.items()
+                    if needs_image(group[index], price, confidence, self.margin_threshold)]
+        for index in estimates:
+            # Only text estimates the cascade accepts, or of listings without a photo, are cached; other
+            # escalated listings are cached under their image estimate, or not at all if that fails
+            group[index]['prompt'] = 'text' if index not in escalate or not group[index]['image_url'] else None
+        count('cascade', 'text', len(group) - len(escalate))
+        count('cascade', 'escalated', len(escalate))
+        if not escalate:
+            return prices
+        
+        await asyncio.gather(*[attach_image(group[index], self.session) for index in escalate])
+        # A listing whose image could not be downloaded keeps its text estimate
+        with_images = [index for index in escalate if group[index]['image_data']]
+        try:
+            image_prices = await self._price_group([group[index] for index in with_images]) if with_images else {}
+        except PricingError as e:
+            logger.warning(f"Image request for {len(with_images)} items failed, keeping text estimates: {str(e)}")
+            image_prices = {}
+        for position, index in enumerate(with_images):
+            if position in image_prices:
+                prices[index] = image_prices[position]
+        return prices
+    
+    async def _price_loop(self):
+        finished = False
+        while not finished:
+            group, finished = await self._take_group()
+            if not group:
+                continue
+            await self._renew_leases(group)
+            try:
+                prices = await (self._price_cascade(group) if self.cascade else self._price_group(group))
+            except Exception as e:
+                logger.error(f"Error pricing group of {len(group)} items: {str(e)}")
+                prices = {}
+            
+            for index, listing in enumerate(group):
+                future = self.in_flight.pop(listing['key'])
+                price = prices.get(index)
+                future.set_result(price)
+                if price is not None and 'audit' in listing:
+                    cluster = listing['audit']
+                    if self.clusters.check_drift(cluster, price):
+                        logger.warning(f"Cluster of '{cluster.representative}' drifted: "
+                                       f"${cluster.future.result():.2f} shared, but '{listing['product_name']}' "
+                                       f"priced ${price:.2f}; pricing its members individually")
+                if price is None:
+                    # The request failed; the item stays unpriced and is claimed again by a later run,
+                    # unless Gemini rejected it outright too many times (see MAX_PRICE_FAILURES)
+                    self.stats['unpriced'] += 1
+                    if listing.get('permanent_failure'):
+                        self.stats['rejected'] += 1
+                        try:
+                            await run_db(record_price_failure, listing['id'])
+                        except Exception as e:
+                            logger.error(f"Error recording failure of item {listing['id']}: {str(e)}")
+                    self._finish(False)
+                    continue
+                try:
+                    # $0.00 is also what an unusable answer gives, so only real estimates are cached
+                    if price > 0 and listing.get('prompt'):
+                        key = price_cache.key(listing['product_name'], listing['category_name'],
+                                              listing['image_data'], listing['prompt'])
+                        await run_db(price_cache.put, key, price)
+                    self._finish(await save_price(listing, price, self.writer))
+                except Exception as e:
+                    logger.error(f"Error processing item {listing['id']}: {str(e)}")
+                    self._finish(False)
+    
+    async def run(self):
+        """
+        Price items until claim runs dry (or the call budget is spent). Returns
+        stats; the Gemini calls and other counters of the run are in counters.
+        """
+        # Tasks copy the context when created, so everything they call counts towards this run
+        token = _current_run.set(self)
+        try:
+            claimer = asyncio.create_task(self._claim_loop())
+            preparers = [asyncio.create_task(self._prepare_loop()) for _ in range(self.max_concurrent)]
+            pricers = [asyncio.create_task(self._price_loop()) for _ in range(self.max_concurrent)]
+        finally:
+            _current_run.reset(token)
+        try:
+            await claimer
+            await asyncio.gather(*preparers)
+            for _ in pricers:
+                await self.ready.put(None)
+            await asyncio.gather(*pricers)
+        finally:
+            for task in [claimer, *preparers, *pricers]:
+                task.cancel()
+        return self.stats
+
+async def process_batch(items, session=None, max_concurrent=60, items_per_prompt=1):
+    """
+    Price a given list of items, at most max_concurrent Gemini requests at a time.
+    With items_per_prompt > 1, items are priced several per Gemini request.
+    Every estimate is written before it returns. Returns (successful, failed) counts.
+    """
     if not items:
         logger.warning("Empty batch received")
         return 0, 0
     
     logger.info(f"Processing batch of {len(items)} items")
-    item_ids = [item.get('id', 'unknown') for item in items]
-    print(f"Items to process: {item_ids}")
+    queue = list(items)
     
-    tasks = [process_item(item, semaphore) for item in items]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    async def claim(limit):
+        taken = queue[:limit]
+        del queue[:limit]
+        return taken
     
-    success_count = sum(1 for r in results if not isinstance(r, Exception) and r)
-    fail_count = len(results) - success_count
+    async def run(session):
+        pipeline = PricingPipeline(claim, session, writer, max_concurrent, items_per_prompt)
+        return await pipeline.run()
     
-    logger.info(f"Batch completed: {success_count} successful, {fail_count} failed")
-    return success_count, fail_count
+    # Results go through this batch's own writer; write them all before returning
+    writer = PriceWriter(db_executor)
+    writer.start()
+    try:
+        if session is None:
+            async with create_http_session() as session:
+                stats = await run(session)
+        else:
+            stats = await run(session)
+    finally:
+        await writer.close()
+    
+    logger.info(f"Batch completed: {stats['succeeded']} successful, {stats['failed']} failed")
+    return stats['succeeded'], stats['failed']
 
-async def process_item(item, semaphore):
-    """Process a single item with rate limiting."""
-    async with semaphore:
-        try:
-            item_id = item.get('id', 'unknown')
-            product_name = item.get('product_name', '')
-            price = float(item.get('price', 0) or 0)
-            shipping_price = float(item.get('shipping_price', 0) or 0)
-            category_name = item.get('category_name', '')
-            image_url = item.get('image_url', '')
-            
-            if not product_name:
-                logger.warning(f"Skipping item {item_id}: No product name")
-                return False
-            
-            logger.info(f"Processing item {item_id}: {product_name}")
-            
-            # Process image if available
-            image_data = None
-            if image_url:
-                logger.info(f"Item has an image URL, processing...")
-                image_data = get_image_data(image_url)
-                if image_data:
-                    logger.info("Successfully processed image")
-                else:
-                    logger.warning("Failed to process image, continuing with text-only analysis")
-            
-            # Add a small delay for rate limiting
-            await asyncio.sleep(0.02)  # Rate limiting: ~3000 req/min with 60 concurrent (leaving headroom)
-            
-            # Get price estimate with all available data
-            ebay_price = analyze_item_price(
-                product_name=product_name,
-                category_name=category_name,
-                image_data=image_data,
-                shipping_price=shipping_price
-            )
-            
-            update_time = datetime.now(pacific).strftime('%Y-%m-%dT%H:%M:%S')
-            
-            update_item_price(item_id, ebay_price, update_time, price, shipping_price)
-            if ebay_price > 0:
-                logger.info(f"Updated item {item_id} with price ${ebay_price:.2f}")
-                return True
-            logger.info(f"Marked item {item_id} as attempted (price $0.00)")
-            return False
-        
-        except Exception as e:
-            logger.error(f"Error processing item {item_id}: {str(e)}")
-            return False
+def load_price_filter(margin_threshold):
+    """Return the saved PriceFilter if it suits margin_threshold, otherwise None (logging why)."""
+    try:
+        price_filter = PriceFilter.load()
+    except Exception as e:
+        logger.warning(f"Could not load the pre-filter model, pricing every item: {str(e)}")
+        return None
+    if price_filter is None:
+        logger.warning("No pre-filter model; run price_filter.py --retrain. Pricing every item")
+        return None
+    if price_filter.margin_threshold != margin_threshold:
+        logger.warning(f"Pre-filter was trained for a {price_filter.margin_threshold}% margin threshold but "
+                       f"settings use {margin_threshold}%; retrain it. Pricing every item")
+        return None
+    return price_filter
 
-async def update_prices(batch_size=30, test_mode=False, max_concurrent=60):
-    """Update prices for items without estimated prices."""
+async def filter_claimed(items, price_filter, shadow=False):
+    """
+    Write claimed items price_filter skips as filtered $0.00 estimates and
+    return the rest. In shadow mode nothing is skipped, only counted.
+    """
+    skip = price_filter.should_skip(items)
+    skipped = [item for item, skip_item in zip(items, skip) if skip_item]
+    if shadow or not skipped:
+        return items
+    update_time = datetime.now(pacific).strftime('%Y-%m-%dT%H:%M:%S')
+    await run_db(mark_items_filtered, skipped, update_time)
+    logger.info(f"Pre-filter skipped {len(skipped)} of {len(items)} claimed items")
+    return [item for item, skip_item in zip(items, skip) if not skip_item]
+
+async def update_prices(batch_size=30, test_mode=False, max_concurrent=60, items_per_prompt=ITEMS_PER_PROMPT,
+                        call_budget=None, worker_id=None, cascade=CASCADE, cluster=CLUSTERING, prefilter=PREFILTER):
+    """
+    Update prices for items without estimated prices.
+    
+    Items stream through a PricingPipeline that keeps max_concurrent Gemini
+    requests in flight: image downloads share one pooled aiohttp session,
+    Gemini is called through its async client and database work runs on
+    db_executor, so nothing blocks the event loop. Candidates are claimed
+    batch_size at a time (at least max_concurrent outside test mode) and
+    prepared ahead of the model. Items are packed up to items_per_prompt
+    (never more than batch_size) per Gemini request; 1 sends one request per
+    item. Test mode prices a single batch.
+    
+    Items are taken in price_scheduler priority order (closing soon, cheap,
+    bid on, valuable category), and items closing too soon to act on are
+    skipped. With call_budget, no more items are claimed than the remaining
+    Gemini requests can price, so a limited budget goes to the best candidates.
+    
+    With cascade, items are priced from text first and only re-priced with
+    their image when the text estimate is unsure or its margin is close to
+    the settings' margin threshold (see needs_image).
+    
+    With cluster, near-duplicate listings share one estimate: only one
+    representative per cluster (plus periodic audits) is sent to Gemini.
+    
+    With prefilter 'on', claimed items the saved PriceFilter predicts will
+    not clear the margin threshold are written as $0.00 (flagged
+    price_filtered) without a Gemini request; 'shadow' only counts them.
+    
+    Items are leased to worker_id (a fresh ID by default) when claimed, so any
+    number of update_prices runs, in this or other processes, can share the
+    database without pricing the same item twice.
+    
+    Estimates are written behind by the run's own PriceWriter, many per
+    transaction, and anything still buffered is written before the leases
+    are released and update_prices returns.
+    
+    Returns the PricingPipeline that ran, for its stats, counters and limiter,
+    or None if nothing needed pricing.
+    """
+    worker_id = worker_id or new_worker_id()
+    writer = PriceWriter(db_executor)
+    writer.start()
     try:
         batch_size = max(1, min(batch_size, 100))  # Allow larger batches
-        max_concurrent = max(1, min(max_concurrent, 60))  # Allow up to 60 concurrent requests
+        max_concurrent = max(1, min(max_concurrent, 60))  # Ceiling for the adaptive limiter, up to 60
+        fetch_size = batch_size if test_mode else max(batch_size, max_concurrent)
+        items_per_prompt = max(1, min(items_per_prompt, batch_size))
         
-        total_pending = get_pending_price_updates_count()
+        total_pending = await run_db(get_pending_priority_count)
+        too_late = await run_db(get_too_late_count)
+        if too_late:
+            logger.info(f"Skipping {too_late} unpriced items that close too soon to act on")
         if total_pending == 0:
             logger.info("No items need price updates")
             return
         
-        logger.info(f"Found {total_pending} items needing price updates")
-        logger.info(f"Config: batch_size={batch_size}, test_mode={test_mode}, max_concurrent={max_concurrent}")
+        logger.info(f"Found {total_pending} items needing price updates (worker {worker_id})")
+        logger.info(f"Config: batch_size={batch_size}, test_mode={test_mode}, max_concurrent={max_concurrent}, "
+                    f"items_per_prompt={items_per_prompt}, call_budget={call_budget}, cascade={cascade}, "
+                    f"cluster={cluster}, prefilter={prefilter}")
+        margin_threshold = await run_db(get_margin_threshold) if cascade or prefilter != 'off' else None
+        price_filter = load_price_filter(margin_threshold) if prefilter != 'off' else None
+        clusters = ListingClusters() if cluster else None
         
-        semaphore = asyncio.Semaphore(max_concurrent)
-        total_processed = 0
+        claims = {'count': 0}
         
-        while True:
-            items = get_items_for_price_update(batch_size, test_mode)
-            if not items:
-                logger.info("No more items to process")
-                break
-            
-            success_count, fail_count = await process_batch(items, semaphore)
-            total_processed += len(items)
-            
-            if test_mode:
-                logger.info(f"Test mode completed. Processed {total_processed} items")
-                break
-            
-            remaining = get_pending_price_updates_count()
-            logger.info(f"Progress: {total_processed} processed, {remaining} remaining")
-            if remaining == 0:
-                break
+        async def claim(limit):
+            if test_mode and claims['count']:
+                return []
+            while True:
+                claims['count'] += 1
+                items = await run_db(claim_priority_items, worker_id, min(limit, fetch_size), test_mode)
+                if price_filter is None or not items:
+                    return items
+                kept = await filter_claimed(items, price_filter, prefilter == 'shadow')
+                # An empty claim ends the run, so keep claiming while the filter takes everything
+                if kept or test_mode:
+                    return kept
+        
+        async def renew(item_ids):
+            await run_db(renew_leases, worker_id, item_ids)
         
-        logger.info(f"Price update completed. Total items processed: {total_processed}")
+        started = time.monotonic()
+        try:
+            async with create_http_session() as session:
+                pipeline = PricingPipeline(claim, session, writer, max_concurrent, items_per_prompt, call_budget,
+                                           prefetch=max(fetch_size, max_concurrent * items_per_prompt),
+                                           progress_every=fetch_size, total_pending=total_pending,
+                                           cascade=cascade, margin_threshold=margin_threshold,
+                                           clusters=clusters, renew=renew)
+                stats = await pipeline.run()
+                counters = pipeline.counters
+        finally:
+            # Write every estimate before giving up the leases, or another worker could claim the items again.
+            # Items that failed go back to the queue with them
+            await writer.flush()
+            await run_db(release_items, worker_id)
+        total_processed = stats['processed']
+        if test_mode:
+            logger.info(f"Test mode completed. Processed {total_processed} items")
+        
+        elapsed = time.monotonic() - started
+        rate = total_processed / elapsed * 60 if elapsed else 0
+        logger.info(f"Price update completed. Total items processed: {total_processed} "
+                    f"({stats['succeeded']} successful, {stats['failed']} failed) "
+                    f"in {elapsed:.1f}s ({rate:.0f} items/min, {counters['usage']['calls']} Gemini requests)")
+        errors = counters['errors']
+        if errors['failed']:
+            logger.warning(f"{errors['failed']} Gemini requests failed ({errors['retried']} retried); "
+                           f"{stats['unpriced']} items were left unpriced for a later run, {stats['rejected']} "
+                           f"of them rejected by Gemini (given up after {MAX_PRICE_FAILURES} rejections)")
+        logger.info(f"Concurrency: {pipeline.limiter.summary()}; circuit breaker {breaker.summary()}")
+        grouped = counters['batch']
+        if grouped['requests']:
+            logger.info(f"Grouped requests: {grouped['requests']} requests priced {grouped['items']} items "
+                        f"({grouped['items'] / grouped['requests']:.1f} per request), "
+                        f"{grouped['fallbacks']} retried individually")
+        if cascade:
+            text, escalated = counters['cascade']['text'], counters['cascade']['escalated']
+            logger.info(f"Cascade: {text} priced from text alone, {escalated} "
+                        f"needed their image ({escalated / (text + escalated) if text + escalated else 0:.0%})")
+        if clusters is not None:
+            for key, value in clusters.stats.items():
+                cluster_stats[key] = cluster_stats.get(key, 0) + value
+            logger.info(f"Clusters: {clusters.summary()}")
+        if price_filter is not None:
+            logger.info(f"Pre-filter{' (shadow)' if prefilter == 'shadow' else ''}: {price_filter.summary()}")
+        logger.info(f"Images: {image_preprocessor.summary()}")
+        logger.info(f"Writes: {writer.summary()}")
+        await run_db(price_cache.prune)
+        entries, lifetime_hits = await run_db(cache_totals, price_cache.version)
+        logger.info(f"Price cache: {price_cache.summary()}; {entries} entries, {lifetime_hits} hits all time")
+        return pipeline
         
     except Exception as e:
         logger.error(f"Error in update_prices: {str(e)}")
         raise
+    finally:
+        await writer.close()
+
+def run_worker(kwargs):
+    """Entry point of a --workers child process."""
+    asyncio.run(update_prices(**kwargs))
+
+def run_workers(workers, **kwargs):
+    """
+    Run update_prices in several processes at once. Leases keep them on
+    separate items. Returns the number of workers that failed.
+    """
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker, args=(kwargs,), name=f"gemini-worker-{n}")
+                 for n in range(1, workers + 1)]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {workers} pricing workers")
+    for process in processes:
+        process.join()
+    failed = sum(1 for process in processes if process.exitcode != 0)
+    logger.info(f"All pricing workers finished ({failed} failed)")
+    return failed
 
 if __name__ == "__main__":
     import argparse
@@ -276,14 +1296,34 @@ if __name__ == "__main__":
     parser.add_argument('--test', action='store_true', help='Run in test mode')
     parser.add_argument('--batch-size', type=int, default=30, help='Batch size (1-100)')
     parser.add_argument('--max-concurrent', type=int, default=60, help='Max concurrent calls (1-60)')
+    parser.add_argument('--items-per-prompt', type=int, default=ITEMS_PER_PROMPT,
+                        help='Items priced per Gemini request, capped at the batch size (1 disables grouping)')
+    parser.add_argument('--call-budget', type=int, help='Stop starting new batches after this many Gemini requests')
+    parser.add_argument('--cascade', action='store_true', default=CASCADE,
+                        help='Price from text first and send images only when the estimate is unsure')
+    parser.add_argument('--cluster', action='store_true', default=CLUSTERING,
+                        help='Price one listing per cluster of near-duplicates and share its estimate')
+    parser.add_argument('--prefilter', choices=['off', 'shadow', 'on'], default=PREFILTER,
+                        help='Skip items the local model (price_filter.py) predicts are not worth pricing')
+    parser.add_argument('--workers', type=int, default=1, help='Pricing worker processes to run in parallel')
     args = parser.parse_args()
     
+    options = dict(
+        batch_size=args.batch_size,
+        test_mode=args.test,
+        max_concurrent=args.max_concurrent,
+        items_per_prompt=args.items_per_prompt,
+        call_budget=args.call_budget,
+        cascade=args.cascade,
+        cluster=args.cluster,
+        prefilter=args.prefilter
+    )
     try:
-        asyncio.run(update_prices(
-            batch_size=args.batch_size,
-            test_mode=args.test,
-            max_concurrent=args.max_concurrent
-        ))
+        if args.workers > 1:
+            if run_workers(args.workers, **options):
+                sys.exit(1)
+        else:
+            asyncio.run(update_prices(**options))
     except Exception as e:
         logger.error(f"Main execution error: {str(e)}")
         sys.exit(1)
\ No newline at end of file
@@ -3,12 +3,18 @@ import asyncio
 import sqlite3
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
-from map import get_seller_name
+from map import get_seller_name, get_all_seller_ids, get_category_id, get_category_name, category_names
+from crawl_session import CrawlSession, create_http_session
+from rate_limiter import AdaptiveRateLimiter, parse_retry_after
+from api_recorder import record_response
 from dotenv import load_dotenv
 import base64
 import time
+import math
+import hashlib
+import concurrent.futures
 
 # Load environment variables
 load_dotenv()
@@ -16,47 +22,148 @@ load_dotenv()
 # Database path - update this to your actual path
 DB_PATH = r'/Users/brodybagnall/Documents/goodwill/Goodwill-app/backend/data/gw_data.db'
 
-# API endpoint
-API_URL = "https://buyerapi.shopgoodwill.com/api/Search/ItemListing"
+# API endpoint; point GOODWILL_API_URL at fake_api.py to crawl offline
+API_URL = os.getenv("GOODWILL_API_URL", "https://buyerapi.shopgoodwill.com/api/Search/ItemListing")
+# When set, every successful ItemListing response is saved here as a replayable fixture
+RECORD_DIR = os.getenv("CRAWL_RECORD_DIR")
 
-async def fetch_data(session, url, seller_ids, page=1, search_term=""):
-    """Fetch data from Goodwill API for specific sellers and page."""
-    # Ensure seller_ids is a comma-separated string
-    if isinstance(seller_ids, list):
-        seller_ids_str = ",".join(str(sid) for sid in seller_ids)
-    else:
-        seller_ids_str = str(seller_ids)
-        
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Accept-Encoding": "gzip, deflate, br, zstd",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
-        "Origin": "https://shopgoodwill.com",
-        "Referer": "https://shopgoodwill.com/"
-    }
-    
-    payload = {
+# Crawl limits
+PAGE_SIZE = 40
+MAX_PAGES = 500  # Safety cap per seller/search combination
+MAX_RETRIES = 3
+# Number of pages fetched at once; 1 walks pages sequentially like the original crawler
+PAGE_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))
+# Every ItemListing request goes through this limiter; its rate is kept between runs
+api_limiter = AdaptiveRateLimiter('shopgoodwill_api')
+
+# Sharded crawls: small sellers are grouped into shards of up to this many items
+SHARD_TARGET_ITEMS = 4000
+# Number of shards crawled at once
+SHARD_CONCURRENCY = int(os.getenv("CRAWL_SHARD_CONCURRENCY", "4"))
+# get_data shards automatically once this many sellers are requested
+SHARD_AUTO_MIN_SELLERS = 5
+
+# Minimum hours between crawls of a category partition, keyed by category_ids.json name.
+# High-value categories are left out so they are refreshed on every run.
+CATEGORY_REFRESH_HOURS = {
+    'bulk': 24,
+    'books': 12,
+    'clothing': 12,
+    'movies & music': 12,
+    'religious items': 24,
+    'seasonal & holiday': 24,
+    'wedding': 24
+}
+
+# Results are sorted by end time, soonest first, so a crawl can stop at a horizon
+SORT_COLUMN_END_TIME = "1"
+# Routine (scheduled and command-line) crawls stop paging once listings end more than this many hours out
+# (0 crawls everything); get_data only applies a horizon when one is passed
+CRAWL_HORIZON_HOURS = float(os.getenv("CRAWL_HORIZON_HOURS", "48"))
+# Hours between deep crawls that page past the horizon to pick up the long tail
+DEEP_CRAWL_HOURS = float(os.getenv("CRAWL_DEEP_HOURS", "24"))
+# Pages in flight at once for a horizon-bounded partition
+HORIZON_WINDOW_PAGES = 8
+
+# A resumed crawl only continues from a checkpoint started within this many hours
+CHECKPOINT_MAX_AGE_HOURS = 2
+
+# Rows buffered before they are written as one bulk upsert
+INGEST_CHUNK_SIZE = 200
+# Parsed pages waiting for the writer thread before fetchers are held back
+INGEST_QUEUE_PAGES = int(os.getenv("CRAWL_INGEST_QUEUE", "64"))
+# Skip writing items whose fingerprint has not changed since the last crawl
+DELTA_INGEST = os.getenv("CRAWL_DELTA", "1") != "0"
+
+ITEM_COLUMNS = [
+    'id', 'seller_name', 'product_name', 'price', 'auction_end_time', 'image_url',
+    'shipping_price', 'bids', 'seller_id', 'search_term', 'category_name',
+    'fingerprint', 'changed_at'
+]
+
+# Listing fields that change between crawls and make up an item's fingerprint. category_name is
+# included so a category partition re-labels items an earlier crawl stored under another category
+FINGERPRINT_FIELDS = ['price', 'bids', 'auction_end_time', 'image_url', 'shipping_price', 'category_name']
+
+# changed_at only moves forward when the fingerprint actually changes.
+# search_term is only set on insert; term membership lives in item_search_terms.
+ITEM_SEARCH_TERMS_SQL = """
+CREATE TABLE IF NOT EXISTS item_search_terms (
+    item_id TEXT NOT NULL,
+    search_term TEXT NOT NULL,
+    PRIMARY KEY (item_id, search_term)
+)
+"""
+
+# Items crawled before item_search_terms existed only have items.search_term; copied over
+# once, while the membership table is still empty
+ITEM_SEARCH_TERMS_BACKFILL_SQL = """
+INSERT OR IGNORE INTO item_search_terms (item_id, search_term)
+SELECT id, search_term FROM items WHERE search_term IS NOT NULL AND search_term != ''
+"""
+
+CRAWL_CHECKPOINTS_SQL = """
+CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+    seller_key TEXT NOT NULL,
+    search_term TEXT NOT NULL,
+    category_id INTEGER NOT NULL,
+    last_page INTEGER,
+    total_items INTEGER,
+    started_at TEXT,
+    updated_at TEXT,
+    completed INTEGER DEFAULT 0,
+    PRIMARY KEY (seller_key, search_term, category_id)
+)
+"""
+
+CRAWL_LOG_SQL = """
+CREATE TABLE IF NOT EXISTS crawl_log (
+    crawl_key TEXT PRIMARY KEY,
+    last_crawled TEXT
+)
+"""
+
+UPSERT_ITEM_SQL = """
+INSERT INTO items ({columns}) VALUES ({values})
+ON CONFLICT(id) DO UPDATE SET {updates},
+    changed_at = CASE WHEN items.fingerprint IS excluded.fingerprint
+                      THEN items.changed_at ELSE excluded.changed_at END
+""".format(
+    columns=', '.join(ITEM_COLUMNS),
+    values=', '.join(f':{col}' for col in ITEM_COLUMNS),
+    updates=', '.join(
+        f'{col} = excluded.{col}' for col in ITEM_COLUMNS if col not in ('id', 'changed_at', 'search_term')
+    )
+)
+
+API_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
+    "Origin": "https://shopgoodwill.com",
+    "Referer": "https://shopgoodwill.com/"
+}
+
+def build_payload(seller_ids_str, page=1, search_term="", category_id=0):
+    """Build the ItemListing search payload for a page of results."""
+    return {
         "isSize": False,
         "isWeddingCatagory": "false",
         "isMultipleCategoryIds": False,
         "isFromHeaderMenuTab": False,
         "catIds": "",
-        "categoryId": 0,
+        "categoryId": category_id,
         "categoryLevel": 1,
         "categoryLevelNo": "1",
         "closedAuctionDaysBack": "7",
         "closedAuctionEndingDate": "3/7/2025",
         "highPrice": "999999",
-        "isFromHeaderMenuTab": False,
         "isFromHomePage": False,
-        "isMultipleCategoryIds": False,
-        "isSize": False,
-        "isWeddingCatagory": "false",
         "layout": "",
         "lowPrice": "0",
         "page": str(page),
-        "pageSize": "40",
+        "pageSize": str(PAGE_SIZE),
         "partNumber": "",
         "savedSearchId": 0,
         "searchBuyNowOnly": "",
@@ -67,21 +174,43 @@ async def fetch_data(session, url, seller_ids, page=1, search_term=""):
         "searchNoPickupOnly": "false",
         "searchOneCentShippingOnly": "false",
         "searchPickupOnly": "false",
-        "searchText": "",
+        "searchText": search_term,
         "searchUSOnlyShipping": "true",
         "selectedCategoryIds": "",
         "selectedGroup": "",
         "selectedSellerIds": seller_ids_str,
-        "sortColumn": "1",
+        "sortColumn": SORT_COLUMN_END_TIME,
         "sortDescending": "false",
         "useBuyerPrefs": "true"
     }
 
-    print(f"Fetching page {page} for sellers: {seller_ids_str}" + (f" with search term '{search_term}'" if search_term else ""))
+async def fetch_data(session, url, seller_ids, page=1, search_term="", limiter=None, category_id=0):
+    """
+    Fetch data from Goodwill API for specific sellers and page.
+    
+    Requests are paced by the adaptive limiter (api_limiter by default), which
+    is told about every response so it can speed up or back off.
+    """
+    limiter = limiter or api_limiter
+    # Ensure seller_ids is a comma-separated string
+    if isinstance(seller_ids, list):
+        seller_ids_str = ",".join(str(sid) for sid in seller_ids)
+    else:
+        seller_ids_str = str(seller_ids)
+        
+    payload = build_payload(seller_ids_str, page, search_term, category_id)
+
+    print(f"Fetching page {page} for sellers: {seller_ids_str}"
+          + (f" with search term '{search_term}'" if search_term else "")
+          + (f" in category {category_id}" if category_id else ""))
+    await limiter.acquire()
     try:
-        async with session.post(url, json=payload, headers=headers, timeout=30) as response:
+        async with session.post(url, json=payload, headers=API_HEADERS, timeout=30) as response:
             if response.status == 200:
                 data = await response.json()
+                limiter.on_success()
+                if RECORD_DIR:
+                    record_response(RECORD_DIR, payload, data)
                 if 'searchResults' in data and 'items' in data['searchResults']:
                     total_items = data['searchResults'].get('totalItems', 0)
                     items_count = len(data['searchResults']['items'])
@@ -90,19 +219,44 @@ async def fetch_data(session, url, seller_ids, page=1, search_term=""):
                 print(f"No items found for sellers {seller_ids_str}, page {page}")
                 return None, 0
             else:
+                if response.status == 429 or response.status >= 500:
+                    limiter.on_throttle(parse_retry_after(response.headers.get('Retry-After')), response.status)
                 error_text = await response.text()
                 print(f"Error fetching data for sellers {seller_ids_str}, page {page}: HTTP {response.status}")
                 print(f"Response: {error_text[:200]}...")
                 return None, 0
     except asyncio.TimeoutError:
+        limiter.on_throttle()
         print(f"Timeout fetching data for sellers {seller_ids_str}, page {page}")
         return None, 0
+    except aiohttp.ClientError as e:
+        limiter.on_throttle()
+        print(f"Connection error fetching data for sellers {seller_ids_str}, page {page}: {str(e)}")
+        return None, 0
     except Exception as e:
         print(f"Exception fetching data for sellers {seller_ids_str}, page {page}: {str(e)}")
         return None, 0
 
-async def get_data(seller_ids=None, search_term=""):
-    """Fetch data for specified seller IDs or from settings."""
+async def get_data(seller_ids=None, search_terms="", max_concurrent=PAGE_CONCURRENCY, delta=DELTA_INGEST,
+                   session=None, shard=None, shard_concurrency=SHARD_CONCURRENCY, max_pages=MAX_PAGES,
+                   categories=None, resume=False, horizon_hours=0):
+    """
+    Fetch data for specified seller IDs or from settings.
+    
+    seller_ids may be "all" to crawl every location in seller_map.json.
+    search_terms may be a single term or a list of terms; all of them are
+    crawled in one run and an empty term fetches every item from the sellers.
+    Pass the http session of a CrawlSession to share connections across calls.
+    shard=None shards the crawl per seller once SHARD_AUTO_MIN_SELLERS or more
+    sellers are requested, and categories partitions each seller's catalogue by
+    category (see process_all_pages). resume=True continues interrupted crawls
+    from their checkpoints. horizon_hours stops paging once listings end that
+    far out, with a periodic deep crawl for the rest; the default, 0, crawls
+    every page, and routine crawls pass CRAWL_HORIZON_HOURS.
+    Returns the crawl's ingest stats (new/changed/unchanged counts and changed item IDs).
+    """
+    search_terms = normalize_search_terms(search_terms)
+
     if not seller_ids:
         seller_ids = get_settings()
     
@@ -110,142 +264,1024 @@ async def get_data(seller_ids=None, search_term=""):
         print("No seller IDs provided and none found in settings")
         return
         
-    if isinstance(seller_ids, str):
+    if seller_ids == 'all':
+        seller_ids = get_all_seller_ids()
+    elif isinstance(seller_ids, str):
         try:
             seller_ids = json.loads(seller_ids)
         except:
             seller_ids = [seller_ids]
     
-    print(f"Fetching all items from sellers: {seller_ids}" + (f" with search term '{search_term}'" if search_term else ""))
+    if shard is None:
+        shard = len(seller_ids) >= SHARD_AUTO_MIN_SELLERS
+    
+    print(f"Fetching items from sellers: {seller_ids}" + (f" with search terms {search_terms}" if any(search_terms) else ""))
     
     # Connect to database
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
-    # Process all sellers together
-    await process_all_pages(c, seller_ids, search_term)
+    # Start from the request rate the last run settled on
+    api_limiter.load(DB_PATH)
     
-    # Update search term for items if provided
-    if search_term:
-        c.execute("UPDATE items SET search_term = ? WHERE search_term IS NULL AND seller_id IN ({})".format(
-            ','.join(['?'] * len(seller_ids))
-        ), [search_term] + seller_ids)
+    # Process all sellers together
+    try:
+        stats = await process_all_pages(c, seller_ids, search_terms, max_concurrent, delta, session,
+                                        shard, shard_concurrency, max_pages, categories, resume, horizon_hours)
+    finally:
+        api_limiter.save(DB_PATH)
+        print(f"API rate limiter: {api_limiter.summary()}")
     
     conn.commit()
     conn.close()
     print("Data collection completed and database updated")
+    return stats
 
-async def process_all_pages(c, seller_ids, search_term=""):
-    """Process all pages for the given seller IDs."""
-    # Add category_name column if it doesn't exist
-    try:
-        c.execute('ALTER TABLE items ADD COLUMN category_name TEXT')
-    except sqlite3.OperationalError:
-        # Column already exists, continue
-        pass
-    
-    page = 1
-    total_processed = 0
-    max_retries = 3
-    max_pages = 500 # Limit to 10 pages per seller/search combination for safety
-    
-    async with aiohttp.ClientSession() as session:
-        while page <= max_pages:
-            # Try up to max_retries times for each page
-            data = None
-            for retry in range(max_retries):
-                data, total_items = await fetch_data(session, API_URL, seller_ids, page, search_term)
-                if data:
-                    break
-                
-                if retry < max_retries - 1:
-                    retry_delay = (retry + 1) * 2  # Exponential backoff
-                    print(f"Retrying page {page} in {retry_delay} seconds (attempt {retry+1}/{max_retries})")
-                    await asyncio.sleep(retry_delay)
+async def fetch_page(session, seller_ids, page, search_term="", semaphore=None, max_retries=MAX_RETRIES,
+                     category_id=0):
+    """
+    Fetch one page, retrying up to max_retries times.
+    
+    Retries are paced by the rate limiter inside fetch_data rather than a fixed
+    delay. The semaphore is only held while a request is in flight, so a page
+    waiting to retry does not take a slot away from other pages.
+    """
+    for retry in range(max_retries):
+        if semaphore:
+            async with semaphore:
+                data, total_items = await fetch_data(session, API_URL, seller_ids, page, search_term,
+                                                     category_id=category_id)
+        else:
+            data, total_items = await fetch_data(session, API_URL, seller_ids, page, search_term,
+                                                 category_id=category_id)
+        if data:
+            return data, total_items
+        
+        if retry < max_retries - 1:
+            print(f"Retrying page {page} (attempt {retry+1}/{max_retries})")
+        else:
+            print(f"Failed to fetch page {page} after {max_retries} attempts")
+    return None, 0
+
+def normalize_search_terms(search_terms):
+    """Return a de-duplicated list of stripped terms; [''] means no term filter."""
+    if isinstance(search_terms, str):
+        search_terms = [search_terms]
+    terms = []
+    for term in search_terms or []:
+        term = (term or '').strip()
+        if term not in terms:
+            terms.append(term)
+    # A crawl without a term already returns every item the terms would
+    if not terms or '' in terms:
+        return ['']
+    return terms
+
+def ensure_crawl_schema(c):
+    """Add the columns and tables the crawler writes that older databases may be missing."""
+    for column in ('category_name', 'fingerprint', 'changed_at'):
+        try:
+            c.execute(f'ALTER TABLE items ADD COLUMN {column} TEXT')
+        except sqlite3.OperationalError:
+            # Column already exists, continue
+            pass
+    c.execute(ITEM_SEARCH_TERMS_SQL)
+    c.execute("SELECT 1 FROM item_search_terms LIMIT 1")
+    if c.fetchone() is None:
+        c.execute(ITEM_SEARCH_TERMS_BACKFILL_SQL)
+    c.execute(CRAWL_LOG_SQL)
+    c.execute(CRAWL_CHECKPOINTS_SQL)
+
+def item_to_row(item, search_term="", category_name=None):
+    """
+    Convert an API item into a row for the items table.
+    category_name, when given (e.g. from a category partition), overrides the item's categoryName.
+    """
+    seller_id = str(item['sellerId'])
+    
+    if not category_name:
+        # Get and transform category name - map "Size" categories to "Clothing"
+        category_name = item.get('categoryName', '')
+        if category_name and category_name.startswith('Size'):
+            category_name = 'Clothing'
+    
+    row = {
+        'id': str(item['itemId']),
+        'seller_name': get_seller_name(seller_id),
+        'product_name': item['title'],
+        'price': item['currentPrice'],
+        'auction_end_time': item['endTime'],
+        'image_url': item['imageURL'],
+        'shipping_price': item.get('shippingPrice', 0),
+        'bids': item.get('numBids', 0),
+        'seller_id': seller_id,
+        'search_term': search_term,
+        'category_name': category_name,
+        'changed_at': None
+    }
+    row['fingerprint'] = item_fingerprint(row)
+    return row
+
+def item_fingerprint(row):
+    """Return a short hash of the fields that change between crawls."""
+    values = '|'.join(str(row.get(field)) for field in FINGERPRINT_FIELDS)
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=8).hexdigest()
+
+def existing_fingerprints(c, item_ids):
+    """Return {item_id: fingerprint} for the item_ids already in the items table."""
+    existing = {}
+    item_ids = list(item_ids)
+    # Stay well under SQLite's bound-parameter limit
+    for i in range(0, len(item_ids), 500):
+        chunk = item_ids[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        c.execute(f"SELECT id, fingerprint FROM items WHERE id IN ({placeholders})", chunk)
+        existing.update((row[0], row[1]) for row in c.fetchall())
+    return existing
+
+def upsert_items(c, rows, delta=False):
+    """
+    Write rows to the items table in a single INSERT ... ON CONFLICT batch.
+    
+    With delta=True, rows whose fingerprint matches the stored one are not
+    written at all. Returns a dict with the new, changed and unchanged item IDs.
+    """
+    result = {'new': [], 'changed': [], 'unchanged': []}
+    if not rows:
+        return result
+    
+    # Keep the last copy of an item that appears more than once in the batch
+    rows = list({row['id']: row for row in rows}.values())
+    existing = existing_fingerprints(c, [row['id'] for row in rows])
+    changed_at = datetime.now(pytz.timezone('US/Pacific')).strftime('%Y-%m-%dT%H:%M:%S')
+    
+    to_write = []
+    for row in rows:
+        if row['id'] not in existing:
+            result['new'].append(row['id'])
+        elif existing[row['id']] != row['fingerprint']:
+            result['changed'].append(row['id'])
+        else:
+            result['unchanged'].append(row['id'])
+            if delta:
+                continue
+        to_write.append(dict(row, changed_at=changed_at))
+    
+    if to_write:
+        c.executemany(UPSERT_ITEM_SQL, to_write)
+    return result
+
+def parse_items(items, search_term="", category_name=None):
+    """Convert a page of API items to rows, skipping (and logging) items that fail to parse."""
+    rows = []
+    for item in items:
+        try:
+            rows.append(item_to_row(item, search_term, category_name))
+        except Exception as e:
+            print(f"Error processing item {item.get('itemId', 'unknown')}: {str(e)}")
+    return rows
+
+class ItemWriter:
+    """
+    Buffers crawled rows and writes them with upsert_items once a chunk is full.
+    
+    IDs of new and changed items are collected in changed_ids so later stages
+    (pricing, notifications) can work from just the rows this crawl touched.
+    """
+    
+    def __init__(self, c, chunk_size=INGEST_CHUNK_SIZE, delta=DELTA_INGEST):
+        self.c = c
+        self.chunk_size = chunk_size
+        self.delta = delta
+        self.pending = []
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.changed_ids = set()
+        self.duplicates = 0
+        self.seen_ids = set()
+        self.pending_terms = set()
+        self.pending_pages = []
+        # Checkpoint progress from before the open transaction, restored by discard
+        self.checkpoint_states = {}
+    
+    def add(self, items, search_term="", category_name=None, checkpoint=None, page=None):
+        """
+        Queue a page of API items. Returns the number of items that parsed.
+        
+        An item already written by this writer (e.g. matched by an earlier
+        term) is not upserted again; only its term membership is recorded.
+        If a checkpoint is given, the page is marked done in it once the
+        page's rows have been flushed.
+        """
+        rows = parse_items(items, search_term, category_name)
+        self.add_rows(rows, search_term, checkpoint, page)
+        return len(rows)
+    
+    def add_rows(self, rows, search_term="", checkpoint=None, page=None):
+        """Queue a page of rows already converted with item_to_row (see add)."""
+        if checkpoint is not None:
+            self.pending_pages.append((checkpoint, page))
+        for row in rows:
+            if search_term:
+                self.pending_terms.add((row['id'], search_term))
+            if row['id'] in self.seen_ids:
+                self.duplicates += 1
+                continue
+            self.seen_ids.add(row['id'])
+            self.pending.append(row)
+        
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+    
+    def flush(self):
+        """Write and commit everything buffered so far."""
+        if not self.pending and not self.pending_terms and not self.pending_pages:
+            return
+        result = upsert_items(self.c, self.pending, self.delta)
+        if self.pending_terms:
+            self.c.executemany(
+                "INSERT OR IGNORE INTO item_search_terms (item_id, search_term) VALUES (?, ?)",
+                sorted(self.pending_terms)
+            )
+        # Checkpoints only move past pages whose rows are in this transaction
+        checkpoints = {}
+        for checkpoint, page in self.pending_pages:
+            self.checkpoint_states.setdefault(id(checkpoint), (checkpoint, checkpoint.state()))
+            checkpoint.page_done(page)
+            checkpoints[id(checkpoint)] = checkpoint
+        for checkpoint in checkpoints.values():
+            checkpoint.save(self.c)
+        self.pending_pages = []
+        self.c.connection.commit()
+        self.checkpoint_states = {}
+        print(f"Ingested {len(self.pending)} rows: {len(result['new'])} new, "
+              f"{len(result['changed'])} changed, {len(result['unchanged'])} unchanged")
+        self.pending_terms = set()
+        self.new += len(result['new'])
+        self.changed += len(result['changed'])
+        self.unchanged += len(result['unchanged'])
+        self.changed_ids.update(result['new'])
+        self.changed_ids.update(result['changed'])
+        self.pending = []
+    
+    def discard(self):
+        """Roll back and drop everything buffered since the last flush."""
+        self.c.connection.rollback()
+        # A flush that failed before its commit may already have advanced checkpoints
+        for checkpoint, state in self.checkpoint_states.values():
+            checkpoint.restore(state)
+        self.checkpoint_states = {}
+        for row in self.pending:
+            self.seen_ids.discard(row['id'])
+        self.pending = []
+        self.pending_terms = set()
+        self.pending_pages = []
+    
+    def stats(self):
+        """Return the ingest counts for everything written so far."""
+        return {
+            'new': self.new,
+            'changed': self.changed,
+            'unchanged': self.unchanged,
+            'duplicates': self.duplicates,
+            'changed_ids': sorted(self.changed_ids)
+        }
+
+class IngestPipeline:
+    """
+    Bounded producer/consumer queue between the page fetchers and SQLite.
+    
+    Fetchers parse each page on the event loop and put it on an asyncio.Queue
+    holding at most queue_size pages. A single writer thread owns an
+    ItemWriter on its own connection and drains the queue, writing every page
+    that is waiting in one go, so the network keeps fetching while the disk
+    writes. When the writer falls behind the queue fills up and add() blocks,
+    which holds the fetchers back instead of buffering without limit.
+    
+    Call start() before adding pages and close() to write what is left and
+    stop the thread. stats() reports queue depth, time fetchers spent blocked
+    on a full queue and writer lag (enqueue to commit).
+    
+    Pages lost to a failed write are remembered by partition (see
+    partition_key), so a call that marks partitions as crawled can be
+    skipped when one of them is missing pages.
+    """
+    
+    def __init__(self, c, delta=DELTA_INGEST, queue_size=INGEST_QUEUE_PAGES):
+        # Cursor for reads on the event loop thread (checkpoints, crawl_log)
+        self.c = c
+        self.db_path = database_path(c)
+        self.delta = delta
+        self.queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest-writer')
+        self.writer = None
+        self.consumer = None
+        self.pages = 0
+        self.puts = 0
+        self.batches = 0
+        self.write_errors = 0
+        # Partition keys with at least one page discarded by a failed write
+        self.discarded = set()
+        self.max_depth = 0
+        self.total_depth = 0
+        self.blocked = 0.0
+        self.write_time = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+    
+    def _open_writer(self):
+        conn = sqlite3.connect(self.db_path)
+        # WAL lets the event loop's connection read while this thread writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self.writer = ItemWriter(conn.cursor(), delta=self.delta)
+    
+    def _close_writer(self):
+        self.writer.c.connection.close()
+    
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._open_writer)
+        self.consumer = asyncio.create_task(self._consume())
+    
+    async def add(self, items, search_term="", category_name=None, checkpoint=None, page=None):
+        """Parse a page of API items and queue it for writing. Returns the number of items that parsed."""
+        rows = parse_items(items, search_term, category_name)
+        await self._put(('page', rows, search_term, checkpoint, page))
+        return len(rows)
+    
+    async def call(self, func, *args, partitions=()):
+        """
+        Queue func(cursor, *args) to run on the writer thread after everything
+        already queued. It is skipped if any page of the given partitions (keys
+        from partition_key) was discarded by a failed write.
+        """
+        await self._put(('call', func, args, frozenset(partitions)))
+    
+    async def _put(self, entry):
+        depth = self.queue.qsize()
+        self.puts += 1
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        started = time.monotonic()
+        await self.queue.put((started, entry))
+        self.blocked += time.monotonic() - started
+    
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            entries = [entry for entry in batch if entry is not None]
+            if entries:
+                await loop.run_in_executor(self.executor, self._write, entries)
+            if len(entries) < len(batch):
+                return
+    
+    def _write(self, entries):
+        """Write a batch of queued pages and calls; runs on the writer thread."""
+        started = time.monotonic()
+        try:
+            for _, entry in entries:
+                if entry[0] == 'page':
+                    _, rows, search_term, checkpoint, page = entry
+                    self.writer.add_rows(rows, search_term, checkpoint, page)
+                    self.pages += 1
                 else:
-                    print(f"Failed to fetch page {page} after {max_retries} attempts")
-            
-            # If we still don't have data after all retries, break the loop
-            if not data or 'searchResults' not in data or 'items' not in data['searchResults']:
-                print(f"End of results reached or error fetching data")
-                break
-                
-            items = data['searchResults']['items']
-            if not items:
-                print(f"No more items")
+                    _, func, args, partitions = entry
+                    # Calls follow the pages queued before them, so flush those first
+                    self.writer.flush()
+                    if partitions & self.discarded:
+                        print(f"Skipping {func.__name__} for {', '.join(map(str, args))}: "
+                              f"pages of the crawl were lost to a write error")
+                        continue
+                    func(self.writer.c, *args)
+            self.writer.flush()
+        except Exception as e:
+            self.write_errors += 1
+            print(f"Error writing {len(entries)} queued pages: {str(e)}")
+            self.writer.discard()
+            self.discarded.update(entry[3].key for _, entry in entries
+                                  if entry[0] == 'page' and entry[3] is not None)
+        finished = time.monotonic()
+        self.batches += 1
+        self.write_time += finished - started
+        for enqueued, _ in entries:
+            self.max_lag = max(self.max_lag, finished - enqueued)
+            self.total_lag += finished - enqueued
+    
+    async def close(self):
+        """Write everything still queued, then stop the writer thread."""
+        loop = asyncio.get_running_loop()
+        if self.consumer is not None:
+            await self.queue.put(None)
+            await self.consumer
+        if self.writer is not None:
+            await loop.run_in_executor(self.executor, self._close_writer)
+        self.executor.shutdown(wait=True)
+    
+    def stats(self):
+        """Return the writer's ingest counts plus pipeline metrics under 'ingest'."""
+        stats = self.writer.stats()
+        entries = max(1, self.puts)
+        stats['ingest'] = {
+            'pages': self.pages,
+            'batches': self.batches,
+            'write_errors': self.write_errors,
+            'discarded_partitions': len(self.discarded),
+            'max_queue_depth': self.max_depth,
+            'avg_queue_depth': round(self.total_depth / entries, 1),
+            'producer_blocked_s': round(self.blocked, 2),
+            'writer_busy_s': round(self.write_time, 2),
+            'avg_writer_lag_s': round(self.total_lag / entries, 3),
+            'max_writer_lag_s': round(self.max_lag, 3)
+        }
+        return stats
+    
+    def summary(self):
+        """Return a one-line summary of the pipeline metrics."""
+        ingest = self.stats()['ingest']
+        return (f"{ingest['pages']} pages in {ingest['batches']} write batches, queue depth "
+                f"{ingest['avg_queue_depth']} avg / {ingest['max_queue_depth']} max, fetchers blocked "
+                f"{ingest['producer_blocked_s']}s, writer busy {ingest['writer_busy_s']}s, lag "
+                f"{ingest['avg_writer_lag_s']}s avg / {ingest['max_writer_lag_s']}s max")
+
+def partition_key(seller_ids, search_term="", category_id=0):
+    """Identify a (seller set, search term, category) crawl partition, as CrawlCheckpoint.key does."""
+    return (','.join(sorted(str(sid) for sid in seller_ids)), search_term or '', category_id or 0)
+
+def database_path(c):
+    """Return the file path of the main database behind a cursor."""
+    return c.connection.execute('PRAGMA database_list').fetchone()[2]
+
+class CrawlCheckpoint:
+    """
+    Progress of one (seller set, search term, category) crawl partition.
+    
+    Pages can finish out of order when they are fetched concurrently, so
+    last_page is the highest page with every page before it written. It is
+    saved to crawl_checkpoints in the same transaction as the page's rows.
+    """
+    
+    def __init__(self, seller_ids, search_term="", category_id=0):
+        self.seller_key = ','.join(sorted(str(sid) for sid in seller_ids))
+        self.search_term = search_term or ''
+        self.category_id = category_id or 0
+        self.started_at = datetime.now(pytz.timezone('US/Pacific')).strftime('%Y-%m-%dT%H:%M:%S')
+        self.total_items = 0
+        self.last_page = 0
+        self.last_planned_page = None
+        self.done_pages = set()
+    
+    @property
+    def key(self):
+        return (self.seller_key, self.search_term, self.category_id)
+    
+    def resume(self, c, max_age_hours=CHECKPOINT_MAX_AGE_HOURS):
+        """
+        Load an unfinished checkpoint started less than max_age_hours ago.
+        Returns True if the crawl can continue from it.
+        """
+        c.execute('''
+        SELECT last_page, total_items, started_at, completed FROM crawl_checkpoints
+        WHERE seller_key = ? AND search_term = ? AND category_id = ?
+        ''', (self.seller_key, self.search_term, self.category_id))
+        row = c.fetchone()
+        if not row or row[3] or not row[0] or not row[1]:
+            return False
+        
+        pacific = pytz.timezone('US/Pacific')
+        started = pacific.localize(datetime.strptime(row[2], '%Y-%m-%dT%H:%M:%S'))
+        age_hours = (datetime.now(pacific) - started).total_seconds() / 3600
+        if age_hours > max_age_hours:
+            print(f"Checkpoint for sellers {self.seller_key} started {row[2]} is stale, starting over")
+            return False
+        
+        self.last_page, self.total_items, self.started_at = row[0], row[1], row[2]
+        return True
+    
+    def page_done(self, page):
+        """Mark a page as written and advance last_page past every contiguous finished page."""
+        self.done_pages.add(page)
+        while self.last_page + 1 in self.done_pages:
+            self.last_page += 1
+            self.done_pages.discard(self.last_page)
+    
+    def state(self):
+        """Return the in-memory page progress, for restore."""
+        return self.last_page, set(self.done_pages)
+    
+    def restore(self, state):
+        """Go back to progress returned by state(), e.g. after a rolled-back write."""
+        self.last_page, self.done_pages = state[0], set(state[1])
+    
+    @property
+    def completed(self):
+        return self.last_planned_page is not None and self.last_page >= self.last_planned_page
+    
+    def save(self, c):
+        """Write the checkpoint; the caller commits."""
+        updated_at = datetime.now(pytz.timezone('US/Pacific')).strftime('%Y-%m-%dT%H:%M:%S')
+        c.execute('''
+        INSERT INTO crawl_checkpoints (
+            seller_key, search_term, category_id, last_page, total_items, started_at, updated_at, completed
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(seller_key, search_term, category_id) DO UPDATE SET
+            last_page = excluded.last_page,
+            total_items = excluded.total_items,
+            started_at = excluded.started_at,
+            updated_at = excluded.updated_at,
+            completed = excluded.completed
+        ''', (self.seller_key, self.search_term, self.category_id, self.last_page, self.total_items,
+              self.started_at, updated_at, int(self.completed)))
+
+def page_items(data):
+    """Return the list of items in an API response, or None if the response has none."""
+    if not data or 'searchResults' not in data or 'items' not in data['searchResults']:
+        return None
+    return data['searchResults']['items']
+
+async def process_all_pages(c, seller_ids, search_terms="", max_concurrent=PAGE_CONCURRENCY, delta=DELTA_INGEST,
+                            session=None, shard=False, shard_concurrency=SHARD_CONCURRENCY, max_pages=MAX_PAGES,
+                            categories=None, resume=False, horizon_hours=None):
+    """
+    Process all pages for the given seller IDs and search terms.
+    
+    With shard=True, the sellers are first split into shards by plan_shards
+    (one per large seller, small sellers grouped) so no single result stream
+    runs into the page cap; otherwise all sellers form a single shard. Up to
+    shard_concurrency shards run at once, each capped at max_pages pages, and
+    a shard that fails is reported without stopping the others.
+    
+    With categories (names or IDs from category_ids.json, or "all"), each
+    shard is further partitioned by category. Partitions are fetched
+    concurrently, each with its own page cap, and items take their category
+    from the partition. A partition is skipped until its refresh interval in
+    CATEGORY_REFRESH_HOURS has passed since it last completed.
+    
+    Every partition saves its progress to crawl_checkpoints. With resume=True,
+    a partition whose checkpoint is unfinished and less than
+    CHECKPOINT_MAX_AGE_HOURS old continues from its last written page.
+    
+    With horizon_hours, results come sorted by end time and a partition stops
+    paging at the first page whose last listing ends more than horizon_hours
+    from now. Once every DEEP_CRAWL_HOURS, a shard and term is crawled in full
+    instead (a deep crawl, recorded in crawl_log) so listings further out are
+    still picked up.
+    
+    For each shard and term, page 1 is fetched first to learn totalItems; the
+    remaining pages are then planned up front and fetched concurrently. All
+    shards and terms share one session and one concurrency limit of
+    max_concurrent requests. A page that fails is retried on its own without
+    holding up the others. With max_concurrent=1, or when the API does not
+    report totalItems, pages are walked one after another instead.
+    
+    Pages go through an IngestPipeline, so a writer thread commits them while
+    the next pages are being fetched. Items matched by several terms are
+    written once, with a membership row in item_search_terms for each term.
+    Returns the ingest stats from IngestPipeline.stats(), plus a per-shard
+    summary under 'shards'.
+    
+    Without a session, a pooled session is opened just for this call.
+    """
+    if session is None:
+        async with create_http_session() as session:
+            return await process_all_pages(c, seller_ids, search_terms, max_concurrent, delta, session,
+                                           shard, shard_concurrency, max_pages, categories, resume, horizon_hours)
+    
+    search_terms = normalize_search_terms(search_terms)
+    ensure_crawl_schema(c)
+    c.connection.commit()
+    pipeline = IngestPipeline(c, delta=delta)
+    await pipeline.start()
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(max(1, max_concurrent))
+    
+    if shard:
+        probe_pages = {}
+        seller_totals = await probe_seller_totals(session, seller_ids, semaphore, probe_pages)
+        shards = plan_shards(seller_totals)
+        # A seller's probe is page 1 of its own shard's unfiltered partition, so that partition reuses it
+        for shard_plan in shards:
+            if len(shard_plan['seller_ids']) == 1 and shard_plan['total_items']:
+                shard_plan['page_one'] = probe_pages.get(shard_plan['seller_ids'][0])
+        print(f"Planned {len(shards)} shards for {len(seller_ids)} sellers")
+    else:
+        shards = [{'seller_ids': list(seller_ids), 'total_items': None}]
+    
+    shard_semaphore = asyncio.Semaphore(max(1, shard_concurrency))
+    
+    category_ids = resolve_categories(categories)
+    horizon = horizon_cutoff(horizon_hours)
+    
+    async def run_partition(shard_plan, term, category_id, label, horizon):
+        page_one = shard_plan.get('page_one') if not term and not category_id else None
+        if max_concurrent <= 1:
+            result = await process_pages_sequential(session, pipeline, shard_plan['seller_ids'], term,
+                                                    max_pages=max_pages, category_id=category_id, resume=resume,
+                                                    horizon=horizon, page_one=page_one)
+        else:
+            result = await process_pages_concurrent(session, pipeline, shard_plan['seller_ids'], term, semaphore,
+                                                    max_pages=max_pages, label=label, category_id=category_id,
+                                                    resume=resume, horizon=horizon, page_one=page_one)
+        if category_id and not result['failed_pages']:
+            await pipeline.call(record_crawl, category_crawl_key(shard_plan['seller_ids'], term, category_id),
+                                partitions=[partition_key(shard_plan['seller_ids'], term, category_id)])
+        return result
+    
+    async def run_shard(index, shard_plan):
+        label = f"shard {index}/{len(shards)}" if len(shards) > 1 else ""
+        summary = {'seller_ids': shard_plan['seller_ids'], 'pages': 0, 'items': 0, 'failed_pages': 0, 'error': None}
+        async with shard_semaphore:
+            try:
+                # Category partitions that are not yet due for a refresh are skipped
+                term_categories = {
+                    term: due_categories(c, shard_plan['seller_ids'], term, category_ids) if category_ids else [0]
+                    for term in search_terms
+                }
+                # Terms due a deep crawl page past the horizon this time
+                deep_terms = due_deep_crawls(c, shard_plan['seller_ids'], search_terms) if horizon else search_terms
+                if deep_terms and horizon:
+                    print(f"[{label or 'crawl'}] Deep crawl for sellers {','.join(shard_plan['seller_ids'])}")
+                partitions = [(term, category_id) for term in search_terms for category_id in term_categories[term]]
+                if max_concurrent <= 1:
+                    results = []
+                    for term, category_id in partitions:
+                        results.append(await run_partition(shard_plan, term, category_id, label,
+                                                           None if term in deep_terms else horizon))
+                else:
+                    results = await asyncio.gather(*[
+                        run_partition(shard_plan, term, category_id, label, None if term in deep_terms else horizon)
+                        for term, category_id in partitions
+                    ])
+                if horizon:
+                    for term in deep_terms:
+                        term_results = [result for (t, _), result in zip(partitions, results) if t == term]
+                        if not any(result['failed_pages'] for result in term_results):
+                            await pipeline.call(record_crawl, deep_crawl_key(shard_plan['seller_ids'], term),
+                                                partitions=[partition_key(shard_plan['seller_ids'], term, category_id)
+                                                            for category_id in term_categories[term]])
+                for result in results:
+                    summary['pages'] += result['pages']
+                    summary['items'] += result['items']
+                    summary['failed_pages'] += len(result['failed_pages'])
+            except Exception as e:
+                summary['error'] = str(e)
+                print(f"[{label or 'crawl'}] Failed: {str(e)}")
+        if label:
+            print(f"[{label}] Finished sellers {','.join(shard_plan['seller_ids'])}: "
+                  f"{summary['pages']} pages, {summary['items']} items, {summary['failed_pages']} failed pages")
+        return summary
+    
+    try:
+        shard_summaries = await asyncio.gather(*[
+            run_shard(index, shard_plan) for index, shard_plan in enumerate(shards, start=1)
+        ])
+    finally:
+        await pipeline.close()
+    
+    stats = pipeline.stats()
+    stats['shards'] = shard_summaries
+    elapsed = time.monotonic() - started
+    failed_shards = [s for s in shard_summaries if s['error']]
+    items_written = stats['new'] + stats['changed'] + stats['unchanged']
+    print(f"Crawl finished in {elapsed:.1f}s: {stats['new']} new, {stats['changed']} changed, "
+          f"{stats['unchanged']} unchanged, {stats['duplicates']} duplicates across terms "
+          f"({items_written / elapsed if elapsed else 0:.0f} items/s)")
+    print(f"Ingest pipeline: {pipeline.summary()}")
+    if failed_shards:
+        print(f"{len(failed_shards)} of {len(shards)} shards failed: "
+              + '; '.join(f"{','.join(s['seller_ids'])} ({s['error']})" for s in failed_shards))
+    return stats
+
+def resolve_categories(categories):
+    """Turn category names/IDs (or "all") into a list of category IDs, skipping unknown ones."""
+    if not categories:
+        return []
+    if categories == 'all' or categories == ['all']:
+        return sorted(category_names)
+    if isinstance(categories, (str, int)):
+        categories = [categories]
+    
+    category_ids = []
+    for category in categories:
+        category_id = get_category_id(category)
+        if category_id is None:
+            print(f"Unknown category '{category}', skipping")
+        elif category_id not in category_ids:
+            category_ids.append(category_id)
+    return category_ids
+
+def category_crawl_key(seller_ids, search_term, category_id):
+    """Key for a (seller set, search term, category) partition in the crawl_log table."""
+    return f"category:{','.join(sorted(str(sid) for sid in seller_ids))}:{search_term or ''}:{category_id}"
+
+def record_crawl(c, crawl_key):
+    """Record that the crawl identified by crawl_key just completed."""
+    crawled_at = datetime.now(pytz.timezone('US/Pacific')).strftime('%Y-%m-%dT%H:%M:%S')
+    c.execute('''
+    INSERT INTO crawl_log (crawl_key, last_crawled) VALUES (?, ?)
+    ON CONFLICT(crawl_key) DO UPDATE SET last_crawled = excluded.last_crawled
+    ''', (crawl_key, crawled_at))
+    c.connection.commit()
+
+def last_crawled(c, crawl_key):
+    """Return when the crawl identified by crawl_key last completed, or None."""
+    c.execute("SELECT last_crawled FROM crawl_log WHERE crawl_key = ?", (crawl_key,))
+    row = c.fetchone()
+    if not row or not row[0]:
+        return None
+    return pytz.timezone('US/Pacific').localize(datetime.strptime(row[0], '%Y-%m-%dT%H:%M:%S'))
+
+def due_categories(c, seller_ids, search_term, category_ids):
+    """Return the category IDs whose refresh interval has passed for these sellers and search term."""
+    now = datetime.now(pytz.timezone('US/Pacific'))
+    due = []
+    for category_id in category_ids:
+        refresh_hours = CATEGORY_REFRESH_HOURS.get(category_names.get(category_id), 0)
+        crawled = last_crawled(c, category_crawl_key(seller_ids, search_term, category_id)) if refresh_hours else None
+        if crawled and (now - crawled).total_seconds() < refresh_hours * 3600:
+            term = f" matching '{search_term}'" if search_term else ""
+            print(f"Skipping {get_category_name(category_id)} for sellers {','.join(seller_ids)}{term}: "
+                  f"refreshed {crawled.strftime('%Y-%m-%d %H:%M')}")
+            continue
+        due.append(category_id)
+    return due
+
+def horizon_cutoff(horizon_hours):
+    """Return the latest end time (naive Pacific time, like endTime) a horizon crawl pages up to, or None."""
+    if not horizon_hours:
+        return None
+    now = datetime.now(pytz.timezone('US/Pacific')).replace(tzinfo=None)
+    return now + timedelta(hours=horizon_hours)
+
+def beyond_horizon(items, horizon):
+    """True if the last listing on an end-time sorted page ends after the horizon."""
+    if horizon is None or not items:
+        return False
+    try:
+        return datetime.fromisoformat(str(items[-1]['endTime'])[:19]) > horizon
+    except (KeyError, ValueError):
+        return False
+
+def deep_crawl_key(seller_ids, search_term=""):
+    """Key for the last full (past the horizon) crawl of a seller set and term in crawl_log."""
+    return f"deep:{','.join(sorted(str(sid) for sid in seller_ids))}:{search_term or ''}"
+
+def due_deep_crawls(c, seller_ids, search_terms):
+    """Return the search terms whose deep crawl is older than DEEP_CRAWL_HOURS for these sellers."""
+    now = datetime.now(pytz.timezone('US/Pacific'))
+    due = []
+    for term in search_terms:
+        crawled = last_crawled(c, deep_crawl_key(seller_ids, term))
+        if not crawled or (now - crawled).total_seconds() >= DEEP_CRAWL_HOURS * 3600:
+            due.append(term)
+    return due
+
+async def probe_seller_totals(session, seller_ids, semaphore, pages=None):
+    """
+    Fetch page 1 for each seller to learn how many items it lists.
+    Returns {seller_id: total_items}, with None for sellers whose probe failed.
+    If a pages dict is given, each successful probe's (data, total_items)
+    is stored in it by seller ID so the crawl does not fetch it again.
+    """
+    async def probe(seller_id):
+        data, total_items = await fetch_page(session, [seller_id], 1, "", semaphore)
+        items = page_items(data)
+        if items is None:
+            return seller_id, None
+        if pages is not None:
+            pages[seller_id] = (data, total_items)
+        return seller_id, total_items or len(items)
+    
+    return dict(await asyncio.gather(*[probe(str(seller_id)) for seller_id in seller_ids]))
+
+def plan_shards(seller_totals, target_items=SHARD_TARGET_ITEMS):
+    """
+    Group sellers into crawl shards.
+    
+    Sellers listing at least target_items get a shard of their own. Smaller
+    sellers are packed, largest first, into shared shards of up to
+    target_items. Sellers whose size is unknown get their own shard so a
+    failure there stays isolated, and sellers with no items are dropped.
+    """
+    shards = []
+    groups = []
+    known = sorted(
+        ((seller_id, total) for seller_id, total in seller_totals.items() if total),
+        key=lambda pair: pair[1],
+        reverse=True
+    )
+    for seller_id, total in known:
+        if total >= target_items:
+            shards.append({'seller_ids': [seller_id], 'total_items': total})
+            continue
+        for group in groups:
+            if group['total_items'] + total <= target_items:
+                group['seller_ids'].append(seller_id)
+                group['total_items'] += total
                 break
-                
-            saved_count = 0
-            print(f"Processing {len(items)} items from page {page}")
-            
-            for item in items:
-                try:
-                    item_id = str(item['itemId'])
-                    seller_id = str(item['sellerId'])
-                    seller_name = get_seller_name(seller_id)
-                    
-                    # Get and transform category name - map "Size" categories to "Clothing"
-                    category_name = item.get('categoryName', '')
-                    if category_name and category_name.startswith('Size'):
-                        category_name = 'Clothing'
-                    
-                    # Prepare item data
-                    item_data = {
-                        'id': item_id,
-                        'seller_name': seller_name,
-                        'product_name': item['title'],
-                        'price': item['currentPrice'],
-                        'auction_end_time': item['endTime'],
-                        'image_url': item['imageURL'],
-                        'shipping_price': item.get('shippingPrice', 0),
-                        'bids': item.get('numBids', 0),
-                        'seller_id': seller_id,
-                        'search_term': search_term,
-                        'category_name': category_name
-                    }
-                    
-                    # Check if item exists and update or insert
-                    c.execute('SELECT id FROM items WHERE id = ?', (item_id,))
-                    if c.fetchone():
-                        # Update existing item
-                        placeholders = ', '.join([f"{k} = ?" for k in item_data.keys() if k != 'id'])
-                        values = [item_data[k] for k in item_data.keys() if k != 'id']
-                        values.append(item_id)  # For the WHERE clause
-                        
-                        c.execute(f"UPDATE items SET {placeholders} WHERE id = ?", values)
-                    else:
-                        # Insert new item
-                        placeholders = ', '.join(['?'] * len(item_data))
-                        columns = ', '.join(item_data.keys())
-                        values = list(item_data.values())
-                        
-                        c.execute(f"INSERT INTO items ({columns}) VALUES ({placeholders})", values)
-                    
-                    saved_count += 1
-                    
-                except Exception as e:
-                    print(f"Error processing item {item.get('itemId', 'unknown')}: {str(e)}")
+        else:
+            groups.append({'seller_ids': [seller_id], 'total_items': total})
+    
+    shards.extend(groups)
+    shards.extend(
+        {'seller_ids': [seller_id], 'total_items': None}
+        for seller_id, total in seller_totals.items() if total is None
+    )
+    return shards
+
+async def process_pages_concurrent(session, pipeline, seller_ids, search_term, semaphore, max_pages=MAX_PAGES, label="",
+                                   category_id=0, resume=False, horizon=None, page_one=None):
+    """
+    Fetch page 1, plan the remaining pages from totalItems and fetch them concurrently.
+    
+    With a category_id, only that category partition is fetched and its items
+    are stored under the partition's category name. Progress is saved to
+    crawl_checkpoints as pages are written; with resume=True, a fresh,
+    unfinished checkpoint is picked up where it stopped instead of starting
+    from page 1. With a horizon (see horizon_cutoff), pages are fetched a
+    window at a time and paging stops at the first page whose last listing
+    ends after it; pages past that one still in flight are cancelled.
+    page_one, a (data, total_items) pair from fetch_page, stands in for
+    fetching page 1 (e.g. a seller's probe from probe_seller_totals).
+    Returns a dict with the pages planned, items saved and the pages that failed.
+    """
+    prefix = f"[{label}] " if label else ""
+    result = {'pages': 0, 'items': 0, 'total_items': 0, 'failed_pages': []}
+    category_name = get_category_name(category_id) if category_id else None
+    checkpoint = CrawlCheckpoint(seller_ids, search_term, category_id)
+    
+    if resume and checkpoint.resume(pipeline.c):
+        total_items = checkpoint.total_items
+        first_page = checkpoint.last_page + 1
+        print(f"{prefix}Resuming at page {first_page} from checkpoint started {checkpoint.started_at}")
+    else:
+        data, total_items = page_one or await fetch_page(session, seller_ids, 1, search_term, semaphore,
+                                                         category_id=category_id)
+        items = page_items(data)
+        if items is None:
+            print(f"{prefix}End of results reached or error fetching data")
+            result['failed_pages'].append(1)
+            return result
+        if not items:
+            print(f"{prefix}No items found")
+            return result
+        
+        checkpoint.total_items = total_items
+        if len(items) < PAGE_SIZE or beyond_horizon(items, horizon):
+            checkpoint.last_planned_page = 1
+        result['pages'] = 1
+        result['items'] = await pipeline.add(items, search_term, category_name, checkpoint, 1)
+        
+        if len(items) < PAGE_SIZE:
+            print(f"{prefix}Reached end of items (found {len(items)} on first page)")
+            return result
+        if checkpoint.last_planned_page == 1:
+            print(f"{prefix}Reached the crawl horizon on the first page ({total_items} items reported)")
+            return result
+        if not total_items:
+            print(f"{prefix}API did not report totalItems, falling back to sequential crawl")
+            rest = await process_pages_sequential(session, pipeline, seller_ids, search_term, start_page=2,
+                                                  max_pages=max_pages, category_id=category_id, checkpoint=checkpoint,
+                                                  horizon=horizon)
+            result['pages'] += rest['pages']
+            result['items'] += rest['items']
+            result['failed_pages'] = rest['failed_pages']
+            return result
+        first_page = 2
+    
+    result['total_items'] = total_items
+    last_page = min(math.ceil(total_items / PAGE_SIZE), max_pages)
+    if last_page < math.ceil(total_items / PAGE_SIZE):
+        print(f"{prefix}Limiting crawl to {max_pages} pages ({total_items} items reported)")
+    print(f"{prefix}Planned {last_page} pages for {total_items} items"
+          + (f" matching '{search_term}'" if search_term else "")
+          + (f" in {category_name}" if category_name else ""))
+    result['pages'] = last_page
+    checkpoint.last_planned_page = last_page
+    
+    async def run_page(page):
+        data, _ = await fetch_page(session, seller_ids, page, search_term, semaphore, category_id=category_id)
+        return page, data
+    
+    async def save_page(page, data):
+        items = page_items(data)
+        if items is None:
+            result['failed_pages'].append(page)
+            return
+        
+        saved_count = await pipeline.add(items, search_term, category_name, checkpoint, page)
+        result['items'] += saved_count
+        print(f"{prefix}Page {page}/{last_page}: Processed {len(items)} items, saved {saved_count} items")
+        print(f"{prefix}Total processed: {result['items']} / {total_items}")
+    
+    if horizon is None:
+        tasks = [asyncio.create_task(run_page(page)) for page in range(first_page, last_page + 1)]
+        for task in asyncio.as_completed(tasks):
+            await save_page(*(await task))
+    else:
+        # Results are sorted by end time, so once a page ends past the horizon every later page does too
+        in_flight = {}
+        next_page = first_page
+        while in_flight or next_page <= checkpoint.last_planned_page:
+            while next_page <= checkpoint.last_planned_page and len(in_flight) < HORIZON_WINDOW_PAGES:
+                in_flight[asyncio.create_task(run_page(next_page))] = next_page
+                next_page += 1
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del in_flight[task]
+                page, data = task.result()
+                if page > checkpoint.last_planned_page:
                     continue
+                if beyond_horizon(page_items(data), horizon):
+                    checkpoint.last_planned_page = page
+                    for pending, pending_page in list(in_flight.items()):
+                        if pending_page > page:
+                            pending.cancel()
+                            del in_flight[pending]
+                await save_page(page, data)
+        if checkpoint.last_planned_page < last_page:
+            print(f"{prefix}Reached the crawl horizon at page {checkpoint.last_planned_page}, "
+                  f"skipped {last_page - checkpoint.last_planned_page} pages")
+            result['pages'] = checkpoint.last_planned_page
+    
+    if result['failed_pages']:
+        result['failed_pages'].sort()
+        print(f"{prefix}Failed to fetch {len(result['failed_pages'])} pages: {result['failed_pages']}")
+    return result
+
+async def process_pages_sequential(session, pipeline, seller_ids, search_term="", start_page=1, max_pages=MAX_PAGES,
+                                   category_id=0, checkpoint=None, resume=False, horizon=None, page_one=None):
+    """
+    Walk pages one at a time until a short page, or with a horizon a page
+    ending past it, is returned, saving progress to a checkpoint. page_one
+    is used for page 1 instead of fetching it, as in process_pages_concurrent.
+    Returns a dict with the pages fetched, items saved and the pages that
+    failed, like process_pages_concurrent.
+    """
+    result = {'pages': 0, 'items': 0, 'total_items': 0, 'failed_pages': []}
+    total_items = 0
+    category_name = get_category_name(category_id) if category_id else None
+    if checkpoint is None:
+        checkpoint = CrawlCheckpoint(seller_ids, search_term, category_id)
+        if resume and checkpoint.resume(pipeline.c):
+            start_page = checkpoint.last_page + 1
+            total_items = checkpoint.total_items
+            print(f"Resuming at page {start_page} from checkpoint started {checkpoint.started_at}")
+    page = start_page
+    
+    while page <= max_pages:
+        if page == 1 and page_one:
+            data, page_total = page_one
+        else:
+            data, page_total = await fetch_page(session, seller_ids, page, search_term, category_id=category_id)
+        total_items = page_total or total_items
+        checkpoint.total_items = total_items
+        result['total_items'] = total_items
+        
+        # If we still don't have data after all retries, break the loop
+        items = page_items(data)
+        if items is None:
+            print(f"End of results reached or error fetching data")
+            result['failed_pages'].append(page)
+            break
+        if not items:
+            print(f"No more items")
+            checkpoint.last_planned_page = page - 1
+            # Nothing left to write, so queue an empty page to save the checkpoint as completed
+            await pipeline.add([], search_term, category_name, checkpoint, page - 1)
+            break
+        
+        reached_horizon = beyond_horizon(items, horizon)
+        reached_total = bool(total_items) and page * PAGE_SIZE >= total_items
+        if len(items) < PAGE_SIZE or page == max_pages or reached_horizon or reached_total:
+            checkpoint.last_planned_page = page
+        print(f"Processing {len(items)} items from page {page}")
+        saved_count = await pipeline.add(items, search_term, category_name, checkpoint, page)
+        result['pages'] += 1
+        result['items'] += saved_count
+        print(f"Page {page}: Processed {len(items)} items, saved {saved_count} items")
+        print(f"Total processed: {result['items']} / {total_items if total_items else 'unknown'}")
+        
+        if len(items) < PAGE_SIZE:  # Less than page size means we've reached the end
+            print(f"Reached end of items (found {len(items)} on last page)")
+            break
+        if reached_horizon:
+            print(f"Reached the crawl horizon at page {page}")
+            break
+        if reached_total:
+            print(f"Reached end of items ({total_items} reported)")
+            break
             
-            # Commit after each page to avoid data loss
-            c.connection.commit()
-            
-            total_processed += saved_count
-            print(f"Page {page}: Processed {len(items)} items, saved {saved_count} items")
-            print(f"Total processed: {total_processed} / {total_items if total_items else 'unknown'}")
-            
-            if len(items) < 40:  # Less than page size means we've reached the end
-                print(f"Reached end of items (found {len(items)} on last page)")
-                break
-                
-            page += 1
-            if page > max_pages:
-                print(f"Reached maximum page limit ({max_pages})")
-                break
-                
-            # Rate limiting to avoid overloading the API
-            await asyncio.sleep(1.5)
+        page += 1
+        if page > max_pages:
+            print(f"Reached maximum page limit ({max_pages})")
+            break
+    return result
 
 def get_settings():
     """Get seller IDs from settings."""
@@ -267,95 +1303,82 @@ def get_settings():
         print(f"Error getting settings: {str(e)}")
         return ['19', '198']  # Default
 
-async def test_api():
+async def test_api(session=None):
     """Test the API call directly with seller ID 19."""
-    print("Testing API call with seller ID 19...")
+    if session is None:
+        async with create_http_session() as session:
+            return await test_api(session)
     
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Accept-Encoding": "gzip, deflate, br, zstd",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
-        "Origin": "https://shopgoodwill.com",
-        "Referer": "https://shopgoodwill.com/"
-    }
+    print("Testing API call with seller ID 19...")
     
-    payload = {
-        "isSize": False,
-        "isWeddingCatagory": "false",
-        "isMultipleCategoryIds": False,
-        "isFromHeaderMenuTab": False,
-        "catIds": "",
-        "categoryId": 0,
-        "categoryLevel": 1,
-        "categoryLevelNo": "1",
-        "closedAuctionDaysBack": "7",
-        "closedAuctionEndingDate": "3/7/2025",
-        "highPrice": "999999",
-        "isFromHeaderMenuTab": False,
-        "isFromHomePage": False,
-        "isMultipleCategoryIds": False,
-        "isSize": False,
-        "isWeddingCatagory": "false",
-        "layout": "",
-        "lowPrice": "0",
-        "page": "1",
-        "pageSize": "40",
-        "partNumber": "",
-        "savedSearchId": 0,
-        "searchBuyNowOnly": "",
-        "searchCanadaShipping": "false",
-        "searchClosedAuctions": "false",
-        "searchDescriptions": "false",
-        "searchInternationalShippingOnly": "false",
-        "searchNoPickupOnly": "false",
-        "searchOneCentShippingOnly": "false",
-        "searchPickupOnly": "false",
-        "searchText": "",
-        "searchUSOnlyShipping": "true",
-        "selectedCategoryIds": "",
-        "selectedGroup": "",
-        "selectedSellerIds": "19",
-        "sortColumn": "1",
-        "sortDescending": "false",
-        "useBuyerPrefs": "true"
-    }
+    payload = build_payload("19")
     
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(API_URL, json=payload, headers=headers, timeout=30) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'searchResults' in data and 'items' in data['searchResults']:
-                        items = data['searchResults']['items']
-                        print(f"Success! Found {len(items)} items")
-                        if items:
-                            print("\nFirst item details:")
-                            print(f"Title: {items[0]['title']}")
-                            print(f"Price: ${items[0]['currentPrice']}")
-                            print(f"End Time: {items[0]['endTime']}")
-                            print(f"Seller ID: {items[0]['sellerId']}")
-                    else:
-                        print("No items found in response")
+    try:
+        async with session.post(API_URL, json=payload, headers=API_HEADERS, timeout=30) as response:
+            if response.status == 200:
+                data = await response.json()
+                if 'searchResults' in data and 'items' in data['searchResults']:
+                    items = data['searchResults']['items']
+                    print(f"Success! Found {len(items)} items")
+                    if items:
+                        print("\nFirst item details:")
+                        print(f"Title: {items[0]['title']}")
+                        print(f"Price: ${items[0]['currentPrice']}")
+                        print(f"End Time: {items[0]['endTime']}")
+                        print(f"Seller ID: {items[0]['sellerId']}")
                 else:
-                    error_text = await response.text()
-                    print(f"Error: HTTP {response.status}")
-                    print(f"Response: {error_text[:200]}...")
-        except Exception as e:
-            print(f"Exception: {str(e)}")
+                    print("No items found in response")
+            else:
+                error_text = await response.text()
+                print(f"Error: HTTP {response.status}")
+                print(f"Response: {error_text[:200]}...")
+    except Exception as e:
+        print(f"Exception: {str(e)}")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Crawl shopgoodwill listings into the database')
+    parser.add_argument('--sellers', help='Comma-separated seller IDs, or "all" for every location (default: settings)')
+    parser.add_argument('--terms', default='', help='Comma-separated search terms (default: all items)')
+    parser.add_argument('--concurrency', type=int, default=PAGE_CONCURRENCY, help='Max requests in flight')
+    parser.add_argument('--shard', action='store_true', default=None, help='Shard the crawl per seller')
+    parser.add_argument('--shard-concurrency', type=int, default=SHARD_CONCURRENCY, help='Shards crawled at once')
+    parser.add_argument('--max-pages', type=int, default=MAX_PAGES, help='Page cap per shard, term and category')
+    parser.add_argument('--categories', help='Comma-separated category names or IDs to partition by, or "all"')
+    parser.add_argument('--resume', action='store_true', help='Continue interrupted crawls from their checkpoints')
+    parser.add_argument('--api-url', help='ItemListing endpoint to crawl, e.g. a local fake_api.py')
+    parser.add_argument('--record', metavar='DIR', help='Save every API response to DIR as a replayable fixture')
+    parser.add_argument('--horizon', type=float, default=CRAWL_HORIZON_HOURS,
+                        help='Stop paging once listings end this many hours out (0 crawls every page)')
+    parser.add_argument('--deep', action='store_true', help='Run the deep crawl now instead of when it is due')
+    args = parser.parse_args()
+    
+    if args.api_url:
+        API_URL = args.api_url
+    if args.record:
+        RECORD_DIR = args.record
+    if args.deep:
+        DEEP_CRAWL_HOURS = 0
+    
+    seller_ids = None
+    if args.sellers:
+        seller_ids = 'all' if args.sellers == 'all' else [s.strip() for s in args.sellers.split(',') if s.strip()]
+    search_terms = [t.strip() for t in args.terms.split(',')]
+    categories = [c.strip() for c in args.categories.split(',') if c.strip()] if args.categories else None
+    
     try:
-        print("Testing API call...")
-        asyncio.run(test_api())
-        
-        print("\nRunning product search for default sellers...")
-        asyncio.run(get_data())
+        with CrawlSession() as crawl:
+            print("Testing API call...")
+            crawl.run(test_api(crawl.http))
+            
+            print("\nRunning product search...")
+            crawl.run(get_data(seller_ids, search_terms, max_concurrent=args.concurrency, session=crawl.http,
+                               shard=args.shard, shard_concurrency=args.shard_concurrency,
+                               max_pages=args.max_pages, categories=categories, resume=args.resume,
+                               horizon_hours=args.horizon))
+            print(f"Connections: {crawl.summary()}")
     except KeyboardInterrupt:
         print("\nProcess interrupted by user")
     except Exception as e:
         print(f"Error in main: {str(e)}")
         exit(1)
-
-
-
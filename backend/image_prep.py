@@ -0,0 +1,151 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import threading
+from io import BytesIO
+from PIL import Image, UnidentifiedImageError
+
+# Longest edge, in pixels, of images sent to Gemini
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "768"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Processes used to decode and re-encode images
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 2)))
+# Processed images are kept here, named by a hash of their URL and the settings above
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'data', 'image_cache'))
+
+# Formats Gemini accepts as-is, by Pillow format name
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'HEIF': 'image/heif'
+}
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/heif': '.heif'}
+
+def process_image_bytes(data, max_edge=IMAGE_MAX_EDGE, quality=JPEG_QUALITY):
+    """
+    Downscale and re-encode an image. Runs in a worker process.
+
+    The real format is detected from the bytes. Images are shrunk so their
+    longest edge is at most max_edge and re-encoded as JPEG (transparency is
+    flattened onto white, animations keep their first frame). If the original
+    is already small, in a format Gemini accepts and no larger than the
+    re-encoded version, it is kept as it is. Returns (mime_type, bytes,
+    detected format), or None if the bytes are not a readable image.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    detected = image.format or 'unknown'
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    resized = max(image.size) > max_edge
+    if resized:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    encoded = output.getvalue()
+
+    if not resized and detected in MIME_TYPES and len(data) <= len(encoded):
+        return MIME_TYPES[detected], data, detected
+    return 'image/jpeg', encoded, detected
+
+class ImagePreprocessor:
+    """
+    Turns downloaded listing images into small, correctly labelled Gemini parts.
+
+    Decoding and re-encoding run in a process pool so they use every core and
+    never block the event loop. Results are cached on disk by URL hash, so an
+    image that has been processed once is neither downloaded nor decoded
+    again. The pool is started on first use and may be shared by event loops
+    on several threads; call close() when none of them needs it any more.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_edge=IMAGE_MAX_EDGE, quality=JPEG_QUALITY,
+                 workers=IMAGE_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_edge = max_edge
+        self.quality = quality
+        self.workers = max(1, workers)
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.stats = {'processed': 0, 'cache_hits': 0, 'unreadable': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def _cache_path(self, url, mime_type):
+        digest = hashlib.sha1(f"{url}|{self.max_edge}|{self.quality}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + EXTENSIONS[mime_type])
+
+    def _read_cached(self, url):
+        for mime_type in EXTENSIONS:
+            path = self._cache_path(url, mime_type)
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    return {"mime_type": mime_type, "data": file.read()}
+        return None
+
+    def _write_cached(self, url, image_data):
+        path = self._cache_path(url, image_data['mime_type'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so a concurrent reader never sees a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(image_data['data'])
+        os.replace(temp_path, path)
+
+    async def cached(self, url):
+        """Return the processed image for url from the disk cache, or None."""
+        if not url:
+            return None
+        loop = asyncio.get_running_loop()
+        image_data = await loop.run_in_executor(None, self._read_cached, url)
+        if image_data:
+            self.stats['cache_hits'] += 1
+        return image_data
+
+    async def prepare(self, data, url=None):
+        """Process raw image bytes; with a url the result is cached on disk. Returns None for unreadable images."""
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, process_image_bytes, data, self.max_edge, self.quality)
+        if result is None:
+            self.stats['unreadable'] += 1
+            return None
+
+        mime_type, processed, _ = result
+        image_data = {"mime_type": mime_type, "data": processed}
+        self.stats['processed'] += 1
+        self.stats['bytes_in'] += len(data)
+        self.stats['bytes_out'] += len(processed)
+        if url:
+            try:
+                await loop.run_in_executor(None, self._write_cached, url, image_data)
+            except OSError:
+                pass  # The cache is only an optimisation
+        return image_data
+
+    def summary(self):
+        """Return a one-line summary of the images processed so far."""
+        saved = 1 - self.stats['bytes_out'] / self.stats['bytes_in'] if self.stats['bytes_in'] else 0
+        return (f"{self.stats['processed']} processed ({self.stats['bytes_in'] / 1024:.0f} KB -> "
+                f"{self.stats['bytes_out'] / 1024:.0f} KB, {saved:.0%} smaller), "
+                f"{self.stats['cache_hits']} from disk cache, {self.stats['unreadable']} unreadable")
+
+    def close(self):
+        """Stop the worker processes."""
+        with self.executor_lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
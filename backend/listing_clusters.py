@@ -0,0 +1,187 @@
+import hashlib
+import os
+import re
+import struct
+from io import BytesIO
+from PIL import Image, UnidentifiedImageError
+from price_cache import normalize_title
+
+# Listings whose title shingles overlap at least this much (estimated Jaccard, 0-1) share a cluster
+CLUSTER_SIMILARITY = float(os.getenv("CLUSTER_SIMILARITY", "0.7"))
+# ...unless both have images whose difference hashes differ in more than this many of 64 bits
+CLUSTER_IMAGE_DISTANCE = int(os.getenv("CLUSTER_IMAGE_DISTANCE", "12"))
+# Every this many members of a cluster, one is priced itself to check the cluster's estimate (0 disables)
+CLUSTER_AUDIT_EVERY = int(os.getenv("CLUSTER_AUDIT_EVERY", "10"))
+# An audit further than this fraction from the cluster's estimate stops the cluster sharing it
+CLUSTER_DRIFT_TOLERANCE = float(os.getenv("CLUSTER_DRIFT_TOLERANCE", "0.35"))
+
+SHINGLE_SIZE = 4
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 4 rows per band: pairs above ~0.5 similarity become candidates
+
+def title_shingles(title):
+    """Return the set of character shingles of a normalized title."""
+    text = f" {normalize_title(title)} "
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def title_numbers(title):
+    """Return the words of a title that contain digits (model numbers, sizes, lot counts)."""
+    return frozenset(word for word in normalize_title(title).split() if re.search(r'\d', word))
+
+def image_dhash(image_data):
+    """Return the 64-bit difference hash of Gemini image data ({'mime_type', 'data'}), or None."""
+    if not image_data or not image_data.get('data'):
+        return None
+    try:
+        image = Image.open(BytesIO(image_data['data']))
+        image.draft('L', (32, 32))  # Lets JPEG decode at a fraction of full size
+        pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+class Cluster:
+    """A representative listing and the estimate its near-duplicates share."""
+
+    def __init__(self, cluster_id, representative, signature, future):
+        self.id = cluster_id
+        self.representative = representative
+        self.signature = signature
+        self.future = future  # Resolves to the representative's price, or None if pricing it failed
+        self.members = 0
+        self.audits = 0
+        self.drifted = False
+
+class ListingClusters:
+    """
+    Groups near-duplicate listings so one Gemini estimate prices them all.
+
+    A listing's signature is a MinHash of its normalized title's character
+    shingles, plus its category, the words of its title that contain digits
+    and, when it has an image, a difference hash (dHash) of the image.
+    Clusters are found through LSH buckets over the MinHash bands. A listing
+    joins a cluster when it has the same category and number words, its
+    estimated title similarity is at least similarity, and its image (if
+    both have one) is within image_distance bits of the representative's.
+
+    Every audit_every-th member of a cluster is priced itself, and if that
+    estimate is more than drift_tolerance (relative) away from the
+    representative's, the cluster drifted: its later members are priced
+    individually. Representatives that failed or were priced $0.00 are not
+    shared either.
+
+    Clusters last as long as the object, normally one pricing run; counts
+    go to stats (a dict, which may be shared between runs). Methods do not
+    block except signature(), which decodes the image.
+    """
+
+    def __init__(self, similarity=CLUSTER_SIMILARITY, image_distance=CLUSTER_IMAGE_DISTANCE,
+                 audit_every=CLUSTER_AUDIT_EVERY, drift_tolerance=CLUSTER_DRIFT_TOLERANCE,
+                 permutations=MINHASH_PERMUTATIONS, bands=LSH_BANDS, stats=None):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        self.similarity = similarity
+        self.image_distance = image_distance
+        self.audit_every = audit_every
+        self.drift_tolerance = drift_tolerance
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.buckets = {}
+        self.clusters = []
+        self.stats = stats if stats is not None else {}
+        for counter in ('clusters', 'propagated', 'audits', 'drifted', 'unshared'):
+            self.stats.setdefault(counter, 0)
+
+    def minhash(self, shingles):
+        """Return the MinHash signature (a tuple of permutations ints) of a set of shingles."""
+        # Each 32-bit slice of a shingle's SHAKE-128 output serves as one hash function
+        layout = f'<{self.permutations}I'
+        hashes = [struct.unpack(layout, hashlib.shake_128(shingle.encode('utf-8')).digest(4 * self.permutations))
+                  for shingle in shingles]
+        return tuple(map(min, zip(*hashes)))
+
+    def signature(self, product_name, category_name=None, image_data=None):
+        """Return a listing's signature for find() and add()."""
+        return {
+            'minhash': self.minhash(title_shingles(product_name)),
+            'category': (category_name or '').strip().lower(),
+            'numbers': title_numbers(product_name),
+            'dhash': image_dhash(image_data)
+        }
+
+    def _band_keys(self, signature):
+        minhash = signature['minhash']
+        return [(signature['category'], band, minhash[band * self.rows:(band + 1) * self.rows])
+                for band in range(self.bands)]
+
+    def estimated_similarity(self, first, second):
+        """Return the fraction of MinHash values two signatures share (an estimate of title Jaccard)."""
+        return sum(a == b for a, b in zip(first['minhash'], second['minhash'])) / len(first['minhash'])
+
+    def find(self, signature):
+        """Return the most similar cluster this signature may join, or None."""
+        candidates = {}
+        for key in self._band_keys(signature):
+            for cluster in self.buckets.get(key, ()):
+                candidates[cluster.id] = cluster
+        best, best_similarity = None, 0.0
+        for cluster in candidates.values():
+            if cluster.signature['numbers'] != signature['numbers']:
+                continue
+            first, second = cluster.signature['dhash'], signature['dhash']
+            if first is not None and second is not None and bin(first ^ second).count('1') > self.image_distance:
+                continue
+            similarity = self.estimated_similarity(cluster.signature, signature)
+            if similarity >= self.similarity and similarity > best_similarity:
+                best, best_similarity = cluster, similarity
+        return best
+
+    def add(self, representative, signature, future):
+        """Start a cluster whose estimate is future's result (a price, or None on failure)."""
+        cluster = Cluster(len(self.clusters), representative, signature, future)
+        self.clusters.append(cluster)
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(cluster)
+        self.stats['clusters'] += 1
+        return cluster
+
+    def assign(self, cluster):
+        """
+        Decide how a member of a cluster whose estimate has resolved is priced:
+        'share' the cluster's estimate, 'audit' it by pricing the member, or
+        price it 'alone'.
+        """
+        price = cluster.future.result()
+        if cluster.drifted or not price:
+            self.stats['unshared'] += 1
+            return 'alone'
+        cluster.members += 1
+        if self.audit_every and cluster.members % self.audit_every == 0:
+            self.stats['audits'] += 1
+            return 'audit'
+        self.stats['propagated'] += 1
+        return 'share'
+
+    def check_drift(self, cluster, price):
+        """Record an audit's estimate. Returns True if it shows the cluster drifted."""
+        cluster.audits += 1
+        shared = cluster.future.result()
+        drift = abs(price - shared) / max(price, shared)
+        if drift > self.drift_tolerance and not cluster.drifted:
+            cluster.drifted = True
+            self.stats['drifted'] += 1
+            return True
+        return False
+
+    def summary(self):
+        """Return a one-line summary of the clusters so far."""
+        return (f"{self.stats['clusters']} clusters, {self.stats['propagated']} estimates shared, "
+                f"{self.stats['audits']} audits, {self.stats['drifted']} clusters drifted, "
+                f"{self.stats['unshared']} members priced alone")
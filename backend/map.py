@@ -11,3 +11,32 @@ with open(os.path.join(current_dir, 'seller_map.json')) as file:
 # Function to map seller ID to seller name
 def get_seller_name(seller_id):
     return seller_map.get(str(seller_id), "Unknown Seller")
+
+# Function to list every known seller ID
+def get_all_seller_ids():
+    return sorted(seller_map.keys(), key=int)
+
+# Load the category map (lowercase category name -> shopgoodwill category ID)
+with open(os.path.join(current_dir, 'category_ids.json')) as file:
+    category_map = json.load(file)
+
+category_names = {category_id: name for name, category_id in category_map.items()}
+
+# Function to map a category name or ID to a shopgoodwill category ID
+def get_category_id(category):
+    if str(category).isdigit():
+        return int(category) if int(category) in category_names else None
+    return category_map.get(str(category).strip().lower())
+
+# Function to map a category ID to a display name, e.g. 9 -> "Toys/Dolls/Games"
+def get_category_name(category_id):
+    name = category_names.get(int(category_id))
+    if not name:
+        return None
+    words = []
+    for index, word in enumerate(name.split(' ')):
+        if index > 0 and word in ('and', 'the'):
+            words.append(word)
+        else:
+            words.append('/'.join(part.capitalize() for part in word.split('/')))
+    return ' '.join(words)
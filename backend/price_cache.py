@@ -0,0 +1,157 @@
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+import pytz
+from db import get_db_cursor
+
+# Cached estimates older than this are ignored and eventually pruned
+CACHE_TTL_DAYS = float(os.getenv("PRICE_CACHE_TTL_DAYS", "14"))
+# Least recently used entries beyond this many are evicted
+CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "50000"))
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def normalize_title(title):
+    """Lowercase a listing title and reduce it to words, so relists with different punctuation match."""
+    return ' '.join(re.sub(r'[^a-z0-9$.]+', ' ', (title or '').lower()).split())
+
+def image_hash(image_data):
+    """Return a content hash of Gemini image data ({'mime_type', 'data'}), or '' without an image."""
+    if not image_data or not image_data.get('data'):
+        return ''
+    return hashlib.sha1(image_data['data']).hexdigest()
+
+def create_price_cache_table(cursor):
+    """Create the table that stores price estimates by listing content."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS price_cache (
+        cache_key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        price REAL NOT NULL,
+        created_at TEXT NOT NULL,
+        last_used_at TEXT NOT NULL,
+        hits INTEGER DEFAULT 0
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_price_cache_last_used ON price_cache (last_used_at)')
+
+class PriceCache:
+    """
+    Durable cache of price estimates keyed on listing content.
+
+    The key is a hash of the normalized title, the category, the image's
+    content hash and the kind of prompt that produced the estimate, so a
+    relisted item with the same photo and title is priced without another
+    model call, and estimates from different prompts are kept apart. Entries are tagged with version (the model
+    and prompt version); entries from any other version are dropped when the
+    cache is opened. Entries expire after ttl_days, and once more than
+    max_entries are stored the least recently used are evicted.
+
+    Methods use db.get_db_cursor and block, so async callers should run them
+    on a database thread. Hit/miss counts for this process are kept in
+    hits/misses; summary() reports them.
+    """
+
+    def __init__(self, version, ttl_days=CACHE_TTL_DAYS, max_entries=CACHE_MAX_ENTRIES):
+        self.version = version
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self.shared = 0  # Lookups that waited on an identical in-flight estimate (counted by the caller)
+
+    def key(self, product_name, category_name=None, image_data=None, prompt=''):
+        """Return the cache key for a listing priced by the given kind of prompt (e.g. 'single', 'text')."""
+        parts = [self.version, normalize_title(product_name), (category_name or '').strip().lower(),
+                 image_hash(image_data), prompt]
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def _open(self, cursor):
+        if self.ready:
+            return
+        create_price_cache_table(cursor)
+        # A model or prompt change invalidates every earlier estimate
+        cursor.execute("DELETE FROM price_cache WHERE version != ?", (self.version,))
+        self.ready = True
+
+    def _now(self):
+        return datetime.now(pytz.timezone('US/Pacific'))
+
+    def get(self, key):
+        """Return the cached price for key, or None on a miss."""
+        with get_db_cursor() as cursor:
+            self._open(cursor)
+            cutoff = (self._now() - timedelta(days=self.ttl_days)).strftime(TIME_FORMAT)
+            cursor.execute(
+                "SELECT price FROM price_cache WHERE cache_key = ? AND version = ? AND created_at > ?",
+                (key, self.version, cutoff)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            cursor.execute(
+                "UPDATE price_cache SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?",
+                (self._now().strftime(TIME_FORMAT), key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, price):
+        """Store an estimate, evicting the least recently used entries if the cache is full."""
+        with get_db_cursor() as cursor:
+            self._open(cursor)
+            now = self._now().strftime(TIME_FORMAT)
+            cursor.execute('''
+            INSERT INTO price_cache (cache_key, version, price, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                version = excluded.version,
+                price = excluded.price,
+                created_at = excluded.created_at,
+                last_used_at = excluded.last_used_at
+            ''', (key, self.version, price, now, now))
+            self.stores += 1
+            # Evict in chunks rather than on every insert once the cache is full
+            if self.stores % 100 == 0:
+                self._prune(cursor)
+
+    def prune(self):
+        """Drop expired entries and evict down to max_entries."""
+        with get_db_cursor() as cursor:
+            self._open(cursor)
+            self._prune(cursor)
+
+    def _prune(self, cursor):
+        cutoff = (self._now() - timedelta(days=self.ttl_days)).strftime(TIME_FORMAT)
+        cursor.execute("DELETE FROM price_cache WHERE created_at <= ?", (cutoff,))
+        self.evicted += cursor.rowcount
+        cursor.execute('''
+        DELETE FROM price_cache WHERE cache_key IN (
+            SELECT cache_key FROM price_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+        ''', (self.max_entries,))
+        self.evicted += cursor.rowcount
+
+    def summary(self):
+        """Return a one-line summary of this process's cache activity."""
+        saved = self.hits + self.shared
+        lookups = saved + self.misses
+        hit_ratio = saved / lookups if lookups else 0
+        return (f"{self.hits} hits + {self.shared} shared in flight / {self.misses} misses "
+                f"({hit_ratio:.0%} hit ratio, {saved} model calls saved), "
+                f"{self.stores} stored, {self.evicted} evicted")
+
+def cache_totals(version=None):
+    """Return (entries, lifetime hits) for the cache, optionally for one version only."""
+    with get_db_cursor() as cursor:
+        create_price_cache_table(cursor)
+        if version:
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM price_cache WHERE version = ?", (version,))
+        else:
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM price_cache")
+        entries, hits = cursor.fetchone()
+        return entries, hits
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Local pre-filter that skips the Gemini call for items that are very
+unlikely to be worth buying.
+
+A logistic model over hashed TF-IDF features (title words and word pairs,
+category, price and shipping buckets) is trained on items Gemini already
+priced and predicts whether an item will be a hit: a non-zero estimate with
+a margin at or above the settings' margin threshold. Its skip threshold is
+chosen on held-out items so that at least --min-recall of the hits there
+would still have been priced.
+
+    python price_filter.py --retrain             # train, report and save the model
+    python price_filter.py --evaluate            # score the saved model on items priced since it was trained
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import zlib
+from datetime import datetime
+import numpy as np
+import pytz
+import db
+from db import get_db_cursor, get_margin_threshold, ensure_price_filtered_column
+from price_cache import normalize_title
+
+# Saved model; defaults to price_filter.npz next to the database
+PRICE_FILTER_PATH = os.getenv("PRICE_FILTER_PATH")
+# Fraction of held-out hits the filter must keep when its threshold is chosen
+PREFILTER_MIN_RECALL = float(os.getenv("PREFILTER_MIN_RECALL", "0.98"))
+# Fewer priced items (or hits) than this is not enough to train on
+MIN_TRAINING_ITEMS = 200
+MIN_TRAINING_HITS = 20
+
+FEATURE_BITS = 18
+EPOCHS = 60
+LEARNING_RATE = 0.5
+L2 = 1e-6
+HOLDOUT_BUCKETS = 5  # One in this many items (by a hash of the ID) is held out
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def default_model_path():
+    return PRICE_FILTER_PATH or os.path.join(os.path.dirname(db.DB_PATH), 'price_filter.npz')
+
+def item_features(item):
+    """Return the feature names of an item (a dict with product_name, category_name, price, shipping_price)."""
+    words = normalize_title(item.get('product_name')).split()
+    category = (item.get('category_name') or '').strip().lower()
+    price_bucket = int(math.log2(1 + float(item.get('price') or 0)))
+    shipping_bucket = int(math.log2(1 + float(item.get('shipping_price') or 0)))
+    features = {f"w:{word}" for word in words}
+    features.update(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    features.update((f"c:{category}", f"p:{price_bucket}", f"s:{shipping_bucket}", f"cp:{category}:{price_bucket}"))
+    return features
+
+def hash_features(features, bits=FEATURE_BITS):
+    """Return the sorted, de-duplicated column indices of a set of feature names."""
+    mask = (1 << bits) - 1
+    return sorted({zlib.crc32(feature.encode('utf-8')) & mask for feature in features})
+
+def is_hit(item, margin_threshold):
+    """Whether a priced item (with ebay_price) clears margin_threshold, using db.update_item_price's margin."""
+    ebay_price = item.get('ebay_price') or 0
+    price = float(item.get('price') or 0)
+    if ebay_price <= 0 or price <= 0:
+        return False
+    margin = (ebay_price - price - float(item.get('shipping_price') or 0)) / price * 100
+    return margin >= margin_threshold
+
+def is_holdout(item_id):
+    return zlib.crc32(str(item_id).encode('utf-8')) % HOLDOUT_BUCKETS == 0
+
+def load_training_items(since=None):
+    """Return items Gemini priced (not the filter), optionally only those priced after since."""
+    query = '''
+    SELECT id, product_name, category_name, price, shipping_price, ebay_price, last_price_update
+    FROM items
+    WHERE price_update_attempted = 1 AND ebay_price IS NOT NULL AND COALESCE(price_filtered, 0) = 0
+    '''
+    params = []
+    if since:
+        query += ' AND last_price_update > ?'
+        params.append(since)
+    with get_db_cursor() as cursor:
+        ensure_price_filtered_column(cursor)
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+class PriceFilter:
+    """
+    A trained hit classifier and the skip threshold chosen for it.
+
+    Rows are binary bags of hashed features weighted by idf and scaled to
+    unit length; the model is logistic regression trained by full-batch
+    AdaGrad with hits up-weighted to balance the classes, so it needs
+    nothing beyond NumPy. Items whose hit probability is below threshold
+    are skipped. metrics holds the held-out precision/recall measured when
+    the threshold was chosen.
+    """
+
+    def __init__(self, weights, bias, idf, threshold, margin_threshold, metrics=None, trained_at=None):
+        self.weights = weights
+        self.bias = bias
+        self.idf = idf
+        self.threshold = threshold
+        self.margin_threshold = margin_threshold
+        self.metrics = metrics or {}
+        self.trained_at = trained_at
+        self.stats = {'checked': 0, 'skipped': 0}
+
+    def _rows(self, items):
+        """Return (row ids, column indices, values) of items' normalized feature rows."""
+        rows, columns = [], []
+        for row, item in enumerate(items):
+            indices = hash_features(item_features(item))
+            rows.extend([row] * len(indices))
+            columns.extend(indices)
+        rows, columns = np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)
+        values = self.idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(items)))
+        values = values / np.where(norms > 0, norms, 1.0)[rows]
+        return rows, columns, values
+
+    def hit_probability(self, items):
+        """Return each item's predicted probability of being a hit."""
+        if not items:
+            return np.zeros(0)
+        rows, columns, values = self._rows(items)
+        scores = np.bincount(rows, weights=self.weights[columns] * values, minlength=len(items)) + self.bias
+        return 1 / (1 + np.exp(-scores))
+
+    def should_skip(self, items):
+        """Return, for each item, whether pricing it can be skipped."""
+        skip = self.hit_probability(items) < self.threshold
+        self.stats['checked'] += len(items)
+        self.stats['skipped'] += int(skip.sum())
+        return skip.tolist()
+
+    @classmethod
+    def train(cls, items, margin_threshold, min_recall=PREFILTER_MIN_RECALL, epochs=EPOCHS):
+        """
+        Fit a filter on priced items. A stable fifth of them (by ID) is held
+        out to pick the threshold and measure precision/recall. Raises
+        ValueError if there are too few items or hits to learn from.
+        """
+        labels = np.array([is_hit(item, margin_threshold) for item in items], dtype=float)
+        holdout = np.array([is_holdout(item['id']) for item in items])
+        if (len(items) < MIN_TRAINING_ITEMS or labels[~holdout].sum() < MIN_TRAINING_HITS
+                or labels[~holdout].all() or not labels[holdout].any()):
+            raise ValueError(f"Need at least {MIN_TRAINING_ITEMS} priced items and {MIN_TRAINING_HITS} hits to "
+                             f"train; have {len(items)} items and {int(labels.sum())} hits")
+
+        train_items = [item for item, held in zip(items, holdout) if not held]
+        train_labels = labels[~holdout]
+        size = 1 << FEATURE_BITS
+        document_frequency = np.zeros(size)
+        for item in train_items:
+            document_frequency[hash_features(item_features(item))] += 1
+        idf = np.log((1 + len(train_items)) / (1 + document_frequency)) + 1
+
+        model = cls(np.zeros(size), 0.0, idf, 0.5, margin_threshold)
+        rows, columns, values = model._rows(train_items)
+        hits = train_labels.sum()
+        sample_weight = np.where(train_labels == 1, len(train_labels) / (2 * hits),
+                                 len(train_labels) / (2 * (len(train_labels) - hits)))
+        squared_gradients = np.full(size, 1e-8)
+        squared_bias_gradient = 1e-8
+        for _ in range(epochs):
+            scores = np.bincount(rows, weights=model.weights[columns] * values, minlength=len(train_items))
+            errors = (1 / (1 + np.exp(-(scores + model.bias))) - train_labels) * sample_weight / len(train_labels)
+            gradient = np.bincount(columns, weights=values * errors[rows], minlength=size) + L2 * model.weights
+            squared_gradients += gradient ** 2
+            model.weights -= LEARNING_RATE * gradient / np.sqrt(squared_gradients)
+            bias_gradient = errors.sum()
+            squared_bias_gradient += bias_gradient ** 2
+            model.bias -= LEARNING_RATE * bias_gradient / math.sqrt(squared_bias_gradient)
+
+        holdout_items = [item for item, held in zip(items, holdout) if held]
+        probabilities = model.hit_probability(holdout_items)
+        model.threshold = choose_threshold(probabilities, labels[holdout], min_recall)
+        model.metrics = evaluate(probabilities, labels[holdout], model.threshold)
+        model.metrics['training_items'] = len(train_items)
+        model.metrics['training_hits'] = int(hits)
+        model.trained_at = datetime.now(pytz.timezone('US/Pacific')).strftime(TIME_FORMAT)
+        return model
+
+    def save(self, path=None):
+        path = path or default_model_path()
+        meta = {'threshold': self.threshold, 'margin_threshold': self.margin_threshold, 'metrics': self.metrics,
+                'trained_at': self.trained_at, 'feature_bits': FEATURE_BITS}
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, idf=self.idf, meta=json.dumps(meta))
+        return path
+
+    @classmethod
+    def load(cls, path=None):
+        """Return the saved filter, or None if there is none (or it used other feature settings)."""
+        path = path or default_model_path()
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('feature_bits') != FEATURE_BITS:
+                return None
+            return cls(data['weights'], float(data['bias']), data['idf'], meta['threshold'],
+                       meta['margin_threshold'], meta['metrics'], meta['trained_at'])
+
+    def summary(self):
+        """Return a one-line summary of this process's filtering."""
+        checked = self.stats['checked']
+        return (f"{self.stats['skipped']} of {checked} items skipped "
+                f"({self.stats['skipped'] / checked if checked else 0:.0%}); model trained {self.trained_at}, "
+                f"held-out hit recall {self.metrics.get('hit_recall', 0):.1%}")
+
+def choose_threshold(probabilities, labels, min_recall):
+    """Return the highest threshold that keeps at least min_recall of the hits (probability >= threshold)."""
+    hit_probabilities = np.sort(probabilities[labels == 1])
+    if not len(hit_probabilities):
+        return 0.0
+    # Every hit at or above index is kept; allow losing the lowest floor((1 - min_recall) * hits)
+    index = int(math.floor((1 - min_recall) * len(hit_probabilities)))
+    return float(hit_probabilities[index])
+
+def evaluate(probabilities, labels, threshold):
+    """Return precision/recall figures for skipping items below threshold."""
+    labels = np.asarray(labels, dtype=bool)
+    skipped = probabilities < threshold
+    hits = int(labels.sum())
+    kept_hits = int((labels & ~skipped).sum())
+    skipped_count = int(skipped.sum())
+    return {
+        'items': len(labels),
+        'hits': hits,
+        'skipped': skipped_count,
+        'skip_rate': skipped_count / len(labels) if len(labels) else 0.0,
+        'hits_lost': hits - kept_hits,
+        'hit_recall': kept_hits / hits if hits else 1.0,
+        'hit_precision': kept_hits / (len(labels) - skipped_count) if len(labels) > skipped_count else 0.0,
+        'skip_precision': int((~labels & skipped).sum()) / skipped_count if skipped_count else 1.0
+    }
+
+def print_metrics(title, metrics):
+    print(title)
+    print(f"  Items: {metrics['items']} ({metrics['hits']} hits)")
+    print(f"  Skipped: {metrics['skipped']} ({metrics['skip_rate']:.1%}), "
+          f"of which {metrics['skip_precision']:.1%} were not hits")
+    print(f"  Hit recall: {metrics['hit_recall']:.1%} ({metrics['hits_lost']} hits lost)")
+    print(f"  Hit precision of priced items: {metrics['hit_precision']:.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train or evaluate the local Gemini pre-filter')
+    parser.add_argument('--retrain', action='store_true', help='Train on every priced item and save the model')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='Score the saved model on items Gemini priced after it was trained')
+    parser.add_argument('--min-recall', type=float, default=PREFILTER_MIN_RECALL,
+                        help='Fraction of held-out hits the chosen threshold must keep')
+    parser.add_argument('--model', help='Model file (default: price_filter.npz next to the database)')
+    args = parser.parse_args()
+    if not args.retrain and not args.evaluate:
+        parser.error('choose --retrain and/or --evaluate')
+
+    margin_threshold = get_margin_threshold()
+    if args.retrain:
+        items = load_training_items()
+        try:
+            model = PriceFilter.train(items, margin_threshold, args.min_recall)
+        except ValueError as e:
+            sys.exit(str(e))
+        path = model.save(args.model)
+        print(f"Trained on {model.metrics['training_items']} items ({model.metrics['training_hits']} hits) "
+              f"at a {margin_threshold}% margin threshold; saved to {path}")
+        print(f"Skip threshold: hit probability below {model.threshold:.4f}")
+        print_metrics("Held-out items:", model.metrics)
+
+    if args.evaluate:
+        model = PriceFilter.load(args.model)
+        if model is None:
+            sys.exit("No saved model; run with --retrain first")
+        if model.margin_threshold != margin_threshold:
+            print(f"Warning: model was trained for a {model.margin_threshold}% margin threshold, "
+                  f"settings now use {margin_threshold}%")
+        items = load_training_items(since=model.trained_at)
+        if not items:
+            sys.exit(f"No items priced since the model was trained ({model.trained_at})")
+        labels = np.array([is_hit(item, model.margin_threshold) for item in items])
+        print_metrics(f"Items priced since {model.trained_at}:",
+                      evaluate(model.hit_probability(items), labels, model.threshold))
@@ -0,0 +1,216 @@
+import math
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+import pytz
+from db import get_db_cursor
+
+# Items closing sooner than this can't be priced and acted on in time, so they are skipped
+MIN_LEAD_MINUTES = float(os.getenv("PRICING_MIN_LEAD_MINUTES", "10"))
+# Hours until close at which an item's urgency has halved
+URGENCY_HALF_LIFE_HOURS = 12
+# Cost (price + shipping) at which the price factor has halved; cheaper items leave more room for margin
+PRICE_SCALE = 50.0
+
+# How likely a category is to turn up a profitable resale, by category_ids.json name.
+# Categories not listed count as 1.0.
+CATEGORY_VALUE = {
+    'cameras & camcorders': 1.5,
+    'computers & electronics': 1.5,
+    'gaming systems & games': 1.4,
+    'jewelry & gemstones': 1.4,
+    'musical instruments': 1.4,
+    'tools': 1.3,
+    'collectibles': 1.2,
+    'antiques': 1.2,
+    'sports': 1.1,
+    'art': 1.0,
+    'clothing': 0.8,
+    'for the home': 0.8,
+    'office supplies': 0.7,
+    'books': 0.6,
+    'movies & music': 0.6,
+    'seasonal & holiday': 0.6,
+    'religious items': 0.5,
+    'bulk': 0.5,
+    'wedding': 0.5
+}
+
+# Seconds a worker's claim on an item lasts; items held by a crashed worker become claimable after this
+LEASE_SECONDS = int(os.getenv("PRICING_LEASE_SECONDS", "600"))
+# Soonest-closing unleased items read per claim; only these are scored, so ranking stays cheap
+# however many items are pending
+CLAIM_WINDOW = int(os.getenv("PRICING_CLAIM_WINDOW", "2000"))
+# Items Gemini rejected (a non-retryable error) this many times are no longer claimed
+MAX_PRICE_FAILURES = int(os.getenv("PRICING_MAX_FAILURES", "3"))
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_lease_columns_ready = False
+
+def score_item(item, now):
+    """
+    Return the pricing priority of an item (higher is priced first).
+
+    The score multiplies an urgency term that grows as the auction end
+    approaches, a price term favouring cheap items, a bid term (bidding is a
+    sign of demand) and the category's CATEGORY_VALUE.
+    """
+    end_time = datetime.strptime(item['auction_end_time'][:19], TIME_FORMAT)
+    hours_left = max(0.0, (end_time - now).total_seconds() / 3600)
+    urgency = 1 / (1 + hours_left / URGENCY_HALF_LIFE_HOURS)
+
+    cost = float(item.get('price') or 0) + float(item.get('shipping_price') or 0)
+    price_factor = 1 / (1 + cost / PRICE_SCALE)
+
+    bid_factor = 1 + 0.3 * math.log1p(int(item.get('bids') or 0))
+    category_value = CATEGORY_VALUE.get((item.get('category_name') or '').strip().lower(), 1.0)
+    return urgency * price_factor * bid_factor * category_value
+
+def _now():
+    return datetime.now(pytz.timezone('US/Pacific')).replace(tzinfo=None)
+
+def new_worker_id():
+    """Return an ID that is unique to this pricing worker across processes and machines."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def ensure_lease_columns(cursor):
+    """Add the lease and failure count columns to items if this database predates them."""
+    global _lease_columns_ready
+    if _lease_columns_ready:
+        return
+    cursor.execute("PRAGMA table_info(items)")
+    columns = {row[1] for row in cursor.fetchall()}
+    for column in ('price_lease_owner', 'price_lease_expires'):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE items ADD COLUMN {column} TEXT")
+    if 'price_failures' not in columns:
+        cursor.execute("ALTER TABLE items ADD COLUMN price_failures INTEGER DEFAULT 0")
+    _lease_columns_ready = True
+
+def _rank_candidates(cursor, now, min_lead_minutes, limit, window=CLAIM_WINDOW):
+    """
+    Return up to limit unleased, unpriced items that close after the lead
+    time, best first. Only the window soonest-closing candidates are scored.
+    """
+    cutoff = (now + timedelta(minutes=min_lead_minutes)).strftime(TIME_FORMAT)
+    cursor.execute('''
+    SELECT id, product_name, image_url, price, shipping_price, category_name, bids, auction_end_time
+    FROM items
+    WHERE (ebay_price IS NULL OR price_update_attempted = 0)
+    AND auction_end_time > ?
+    AND (price_lease_expires IS NULL OR price_lease_expires <= ?)
+    AND COALESCE(price_failures, 0) < ?
+    ORDER BY auction_end_time
+    LIMIT ?
+    ''', [cutoff, now.strftime(TIME_FORMAT), MAX_PRICE_FAILURES, max(window, limit or 0)])
+    items = [dict(row) for row in cursor.fetchall()]
+
+    for item in items:
+        try:
+            item['priority'] = score_item(item, now)
+        except (TypeError, ValueError):
+            item['priority'] = 0.0
+    items.sort(key=lambda item: item['priority'], reverse=True)
+    return items[:limit] if limit else items
+
+def claim_priority_items(worker_id, batch_size=None, test_mode=False, lease_seconds=LEASE_SECONDS,
+                         min_lead_minutes=MIN_LEAD_MINUTES):
+    """
+    Lease the best unclaimed items to worker_id and return them.
+
+    Candidates are ranked without holding the write lock; then, in one short
+    IMMEDIATE transaction, each is leased only if it is still unleased and
+    unpriced, so workers in other processes (or on other machines sharing
+    the database) never claim the same item. Items another worker took in
+    between are dropped, and the ranking is retried if that leaves nothing.
+    A lease lasts lease_seconds (see renew_leases); items whose worker died
+    are claimable again once it runs out.
+    """
+    limit = (batch_size or 5) if test_mode else batch_size
+    with get_db_cursor() as cursor:
+        ensure_lease_columns(cursor)
+        for _ in range(3):
+            items = _rank_candidates(cursor, _now(), min_lead_minutes, limit)
+            cursor.connection.commit()
+            if not items:
+                return []
+
+            cursor.execute("BEGIN IMMEDIATE")
+            now = _now()
+            expires = (now + timedelta(seconds=lease_seconds)).strftime(TIME_FORMAT)
+            claimed = []
+            for item in items:
+                cursor.execute('''
+                UPDATE items SET price_lease_owner = ?, price_lease_expires = ?
+                WHERE id = ? AND (ebay_price IS NULL OR price_update_attempted = 0)
+                AND (price_lease_expires IS NULL OR price_lease_expires <= ?)
+                ''', (worker_id, expires, item['id'], now.strftime(TIME_FORMAT)))
+                if cursor.rowcount:
+                    claimed.append(item)
+            cursor.connection.commit()
+            if claimed:
+                return claimed
+        return []
+
+def renew_leases(worker_id, item_ids, lease_seconds=LEASE_SECONDS):
+    """Extend worker_id's leases on item_ids to lease_seconds from now."""
+    expires = (_now() + timedelta(seconds=lease_seconds)).strftime(TIME_FORMAT)
+    with get_db_cursor() as cursor:
+        ensure_lease_columns(cursor)
+        cursor.executemany(
+            "UPDATE items SET price_lease_expires = ? WHERE id = ? AND price_lease_owner = ?",
+            [(expires, item_id, worker_id) for item_id in item_ids]
+        )
+
+def release_items(worker_id, item_ids=None):
+    """Drop worker_id's leases on item_ids (all of its leases if None) so other workers can take them."""
+    with get_db_cursor() as cursor:
+        ensure_lease_columns(cursor)
+        if item_ids is None:
+            cursor.execute(
+                "UPDATE items SET price_lease_owner = NULL, price_lease_expires = NULL WHERE price_lease_owner = ?",
+                (worker_id,)
+            )
+            return
+        cursor.executemany(
+            "UPDATE items SET price_lease_owner = NULL, price_lease_expires = NULL "
+            "WHERE id = ? AND price_lease_owner = ?",
+            [(item_id, worker_id) for item_id in item_ids]
+        )
+
+def record_price_failure(item_id):
+    """Count a rejected pricing request against an item; see MAX_PRICE_FAILURES."""
+    with get_db_cursor() as cursor:
+        ensure_lease_columns(cursor)
+        cursor.execute("UPDATE items SET price_failures = COALESCE(price_failures, 0) + 1 WHERE id = ?", (item_id,))
+
+def get_pending_priority_count(min_lead_minutes=MIN_LEAD_MINUTES):
+    """Count unpriced items that can still be priced before they close."""
+    cutoff = (_now() + timedelta(minutes=min_lead_minutes)).strftime(TIME_FORMAT)
+    with get_db_cursor() as cursor:
+        ensure_lease_columns(cursor)
+        cursor.execute('''
+        SELECT COUNT(*) AS count
+        FROM items
+        WHERE (ebay_price IS NULL OR price_update_attempted = 0)
+        AND auction_end_time > ?
+        AND COALESCE(price_failures, 0) < ?
+        ''', [cutoff, MAX_PRICE_FAILURES])
+        result = cursor.fetchone()
+        return result['count'] if result else 0
+
+def get_too_late_count(min_lead_minutes=MIN_LEAD_MINUTES):
+    """Count unpriced items skipped because they close within min_lead_minutes."""
+    now = _now()
+    cutoff = (now + timedelta(minutes=min_lead_minutes)).strftime(TIME_FORMAT)
+    with get_db_cursor() as cursor:
+        cursor.execute('''
+        SELECT COUNT(*) AS count
+        FROM items
+        WHERE (ebay_price IS NULL OR price_update_attempted = 0)
+        AND auction_end_time > ? AND auction_end_time <= ?
+        ''', [now.strftime(TIME_FORMAT), cutoff])
+        result = cursor.fetchone()
+        return result['count'] if result else 0
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import time
+from db import update_item_prices
+
+# Buffered results are written once this many are waiting...
+PRICE_WRITE_BATCH = int(os.getenv("PRICE_WRITE_BATCH", "50"))
+# ...or once the oldest has waited this many seconds
+PRICE_WRITE_INTERVAL = float(os.getenv("PRICE_WRITE_INTERVAL", "1.0"))
+
+logger = logging.getLogger("gemini")
+
+class PriceWriter:
+    """
+    Write-behind sink for price estimates.
+
+    add() only buffers a result; the buffer is written with a single
+    executemany transaction (db.update_item_prices) once max_pending results
+    are waiting or the oldest has waited interval seconds, so pricing never
+    waits on a commit and the database sees one fsync per flush rather than
+    one per item. Writes run on executor, the caller's database thread.
+
+    Call start() inside the event loop and close() when done; close() always
+    writes whatever is still buffered. Rows from a failed write stay buffered
+    and are retried on the next flush.
+    """
+
+    def __init__(self, executor, max_pending=PRICE_WRITE_BATCH, interval=PRICE_WRITE_INTERVAL):
+        self.executor = executor
+        self.max_pending = max(1, max_pending)
+        self.interval = interval
+        self.pending = []
+        self.oldest = None
+        self.lock = None
+        self.task = None
+        self.stats = {'rows': 0, 'flushes': 0, 'failed': 0, 'flush_seconds': 0.0, 'max_flush_seconds': 0.0,
+                      'max_wait_seconds': 0.0}
+
+    def start(self):
+        """Start the background task that flushes on the interval."""
+        self.lock = asyncio.Lock()
+        if self.task is None:
+            self.task = asyncio.create_task(self._flush_periodically())
+
+    async def add(self, item_id, ebay_price, update_time, price=0, shipping_price=0):
+        """Buffer a result, flushing if the buffer is full."""
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.append((item_id, ebay_price, update_time, price, shipping_price))
+        if len(self.pending) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self):
+        """Write every buffered result now."""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.pending:
+                return
+            rows, oldest = self.pending, self.oldest
+            self.pending, self.oldest = [], None
+
+            loop = asyncio.get_running_loop()
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(self.executor, update_item_prices, rows)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Error writing {len(rows)} prices, will retry: {str(e)}")
+                self.pending = rows + self.pending
+                self.oldest = oldest
+                raise
+            finished = time.monotonic()
+
+            elapsed = finished - started
+            self.stats['rows'] += len(rows)
+            self.stats['flushes'] += 1
+            self.stats['flush_seconds'] += elapsed
+            self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], finished - oldest)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval / 2)
+            if self.oldest is not None and time.monotonic() - self.oldest >= self.interval:
+                try:
+                    await self.flush()
+                except Exception:
+                    pass  # Logged by flush; the rows are retried next time
+
+    async def close(self):
+        """Stop the background task and write anything still buffered."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.error(f"Lost {len(self.pending)} unsaved prices for items "
+                         f"{', '.join(str(row[0]) for row in self.pending)}")
+            raise
+
+    def summary(self):
+        """Return a one-line summary of the writes so far."""
+        flushes = self.stats['flushes']
+        average = self.stats['flush_seconds'] / flushes * 1000 if flushes else 0
+        return (f"{self.stats['rows']} prices in {flushes} transactions "
+                f"({self.stats['rows'] / flushes if flushes else 0:.1f} per commit), "
+                f"flush latency {average:.1f} ms avg / {self.stats['max_flush_seconds'] * 1000:.1f} ms max, "
+                f"results waited up to {self.stats['max_wait_seconds']:.2f}s, {self.stats['failed']} failed writes")
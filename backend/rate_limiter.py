@@ -0,0 +1,339 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import pytz
+
+# Requests per second bounds for the adaptive limiter
+INITIAL_RATE = 2.0
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+ADDITIVE_INCREASE = 0.1  # Added to the rate after each healthy response
+MULTIPLICATIVE_DECREASE = 0.5  # Rate is multiplied by this on 429/5xx/timeouts
+BURST = 4  # Tokens that can build up while idle
+DEFAULT_BACKOFF = 5.0  # Seconds to pause after a 429 without Retry-After
+MAX_RETRY_AFTER = 300.0
+
+def parse_retry_after(value):
+    """Return the number of seconds a Retry-After header asks us to wait, or None."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, min(seconds, MAX_RETRY_AFTER))
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate follows AIMD.
+
+    Every healthy response adds ADDITIVE_INCREASE to the rate; a 429, 5xx or
+    timeout multiplies it by MULTIPLICATIVE_DECREASE (at most once per second,
+    so a burst of failures from concurrent requests only backs off once).
+    A Retry-After header pauses all requests until it has passed. The rate can
+    be saved to and loaded from the database so the next run starts where the
+    last one left off.
+    """
+
+    def __init__(self, name, rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, burst=BURST):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = max(min_rate, min(rate, max_rate))
+        self.burst = burst
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.throttles = 0
+        self.waited = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        """Wait until a request may be sent."""
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.waited += now - started
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """Record a healthy response and ramp the rate up."""
+        self.successes += 1
+        self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+
+    def on_throttle(self, retry_after=None, status=None):
+        """Record a 429/5xx/timeout and back off."""
+        self.throttles += 1
+        now = time.monotonic()
+        if now - self.last_decrease >= 1.0:
+            self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+            self.last_decrease = now
+            # Drop any saved-up burst so the lower rate takes effect immediately
+            self.tokens = min(self.tokens, 0.0)
+        if retry_after is None and status == 429:
+            retry_after = DEFAULT_BACKOFF
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def summary(self):
+        """Return a one-line summary of the limiter's state."""
+        return (f"rate {self.rate:.2f} req/s, {self.successes} ok, {self.throttles} throttled, "
+                f"{self.waited:.1f}s spent waiting")
+
+    def load(self, db_path):
+        """Restore the rate saved by a previous run, if any."""
+        try:
+            conn = sqlite3.connect(db_path)
+            c = conn.cursor()
+            create_rate_limits_table(c)
+            c.execute("SELECT rate FROM rate_limits WHERE name = ?", (self.name,))
+            row = c.fetchone()
+            conn.close()
+            if row and row[0]:
+                self.rate = max(self.min_rate, min(row[0], self.max_rate))
+                print(f"Restored {self.name} rate limit: {self.rate:.2f} req/s")
+        except Exception as e:
+            print(f"Error loading rate limit for {self.name}: {str(e)}")
+
+    def save(self, db_path):
+        """Persist the current rate for the next run."""
+        try:
+            conn = sqlite3.connect(db_path)
+            c = conn.cursor()
+            create_rate_limits_table(c)
+            updated_at = datetime.now(pytz.timezone('US/Pacific')).strftime('%Y-%m-%dT%H:%M:%S')
+            c.execute('''
+            INSERT INTO rate_limits (name, rate, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET rate = excluded.rate, updated_at = excluded.updated_at
+            ''', (self.name, self.rate, updated_at))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"Error saving rate limit for {self.name}: {str(e)}")
+
+# Requests in flight for the adaptive concurrency limiter
+INITIAL_CONCURRENCY = 8
+MIN_CONCURRENCY = 1
+# Recent latency above this multiple of the long-run latency counts as congestion
+LATENCY_TOLERANCE = 2.0
+RECENT_LATENCY_WEIGHT = 0.1  # Weight of each response in the recent latency average
+BASELINE_LATENCY_WEIGHT = 0.01  # ...and in the long-run average
+LATENCY_DECREASE = 0.9  # Limit is multiplied by this when latency climbs past the tolerance
+
+# Consecutive failed requests that open a circuit breaker, and how long it stays open
+BREAKER_FAILURES = 8
+BREAKER_COOLDOWN = 15.0  # Doubles each time a trial request fails
+BREAKER_MAX_COOLDOWN = 300.0
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps the number of requests in flight, with the cap following AIMD.
+
+    Until the first sign of congestion the cap grows by one per healthy
+    response (doubling per round trip); after that it grows by 1/cap, about
+    one per round trip. A 429 or timeout multiplies it by
+    MULTIPLICATIVE_DECREASE, a 5xx by LATENCY_DECREASE, and recent latency (a short moving average)
+    climbing past LATENCY_TOLERANCE times the baseline (a long one) by
+    LATENCY_DECREASE; either happens at most once per second. Averaging keeps
+    ordinary latency jitter from counting as congestion. A Retry-After
+    passed to on_throttle pauses new requests until it has passed.
+
+    Use as "async with limiter:" around each request, reporting the outcome
+    with on_success(latency) or on_throttle(). A limiter wakes its waiters
+    with an asyncio.Event, so it must only be used from one event loop.
+    """
+
+    def __init__(self, name, max_limit, initial=INITIAL_CONCURRENCY, min_limit=MIN_CONCURRENCY):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(max(min_limit, min(initial, self.max_limit)))
+        self.slow_start = True
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.baseline = None
+        self.recent = None
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.released = None
+        self.successes = 0
+        self.throttles = 0
+        self.slowdowns = 0
+        self.waited = 0.0
+
+    def set_max(self, max_limit):
+        """Change the ceiling, lowering the current limit if it is above it."""
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.limit, self.max_limit)
+
+    async def acquire(self):
+        """Wait for a free slot."""
+        if self.released is None:
+            self.released = asyncio.Event()
+        released = self.released
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                self.waited += now - started
+                return
+            released.clear()
+            await released.wait()
+
+    def release(self):
+        """Free the slot taken by acquire()."""
+        self.in_flight -= 1
+        if self.released is not None:
+            self.released.set()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self.last_decrease < 1.0:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.last_decrease = now
+        self.slow_start = False
+
+    def on_success(self, latency):
+        """Record a healthy response that took latency seconds and adjust the limit."""
+        self.successes += 1
+        if self.baseline is None:
+            self.baseline = self.recent = latency
+        else:
+            self.recent += (latency - self.recent) * RECENT_LATENCY_WEIGHT
+            self.baseline += (latency - self.baseline) * BASELINE_LATENCY_WEIGHT
+            # Follow improvements straight away
+            self.baseline = min(self.baseline, self.recent)
+        if self.recent > self.baseline * LATENCY_TOLERANCE:
+            self.slowdowns += 1
+            self._decrease(LATENCY_DECREASE)
+            return
+        self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+
+    def on_throttle(self, retry_after=None, status=None):
+        """Record a 429/5xx/timeout and back off."""
+        self.throttles += 1
+        # Scattered server errors say little about load, so they only trim the limit
+        server_error = status is not None and status >= 500
+        self._decrease(LATENCY_DECREASE if server_error else MULTIPLICATIVE_DECREASE)
+        # Unlike AdaptiveRateLimiter there is no default pause: a smaller limit already sheds load,
+        # and each failed request backs off on its own
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def summary(self):
+        """Return a one-line summary of the limiter's state."""
+        latency = (f"{self.recent * 1000:.0f} ms recent / {self.baseline * 1000:.0f} ms baseline"
+                   if self.baseline is not None else "n/a")
+        return (f"limit {int(self.limit)} in flight (peak {self.peak_in_flight}, max {self.max_limit}), "
+                f"{self.successes} ok, {self.throttles} throttled, {self.slowdowns} slow, "
+                f"latency {latency}, {self.waited:.1f}s spent waiting")
+
+class CircuitBreaker:
+    """
+    Pauses all requests while a backend is failing.
+
+    After failure_threshold consecutive failures the breaker opens and wait()
+    blocks every caller for the cooldown. Then one trial request is let
+    through: if it succeeds the breaker closes, and if it fails the breaker
+    opens again with the cooldown doubled (up to max_cooldown). A trial that
+    ends without an answer either way (cancelled) must be handed back with
+    abandon_trial(), or every caller would keep waiting.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.open_until = 0.0
+        self.opened = 0
+        self.paused = 0.0
+
+    async def wait(self):
+        """Wait until requests may be sent. Returns True if the caller's request is the trial."""
+        started = time.monotonic()
+        trial = False
+        while self.state != 'closed':
+            now = time.monotonic()
+            if self.state == 'open' and now >= self.open_until:
+                self.state = 'half-open'  # This caller sends the trial request
+                trial = True
+                break
+            await asyncio.sleep(min(1.0, max(0.05, self.open_until - now)))
+        self.paused += time.monotonic() - started
+        return trial
+
+    def abandon_trial(self):
+        """Give up the trial without a verdict, so the next caller sends one."""
+        if self.state == 'half-open':
+            self.state = 'open'
+            self.open_until = time.monotonic()
+
+    def on_success(self):
+        """Record a successful request, closing the breaker."""
+        self.failures = 0
+        if self.state != 'closed':
+            self.state = 'closed'
+            self.cooldown = self.base_cooldown
+
+    def on_failure(self):
+        """Record a failed request. Returns True if this opened the breaker."""
+        self.failures += 1
+        if self.state == 'half-open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.open_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self.opened += 1
+            return True
+        return False
+
+    def summary(self):
+        """Return a one-line summary of the breaker's activity."""
+        return f"{self.state}, opened {self.opened} times, {self.paused:.1f}s paused"
+
+def create_rate_limits_table(c):
+    """Create the table that stores limiter rates between runs."""
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        name TEXT PRIMARY KEY,
+        rate REAL,
+        updated_at TEXT
+    )
+    ''')
@@ -26,6 +26,16 @@ c.execute('''
 
 print(f"Removed {c.rowcount} expired items from the database")
 
+# Drop search term memberships for items that no longer exist
+try:
+    c.execute('''
+        DELETE FROM item_search_terms
+        WHERE item_id NOT IN (SELECT id FROM items)
+        ''')
+except sqlite3.OperationalError:
+    # Membership table has not been created yet
+    pass
+
 # Commit the changes and close the connection
 conn.commit()
 conn.close()
@@ -7,7 +7,8 @@ allowing items to be reprocessed through the updated Gemini model.
 import sqlite3
 import logging
 import sys
-from db import DB_PATH, get_db_cursor
+from db import DB_PATH, get_db_cursor, ensure_price_filtered_column
+from price_scheduler import ensure_lease_columns
 from datetime import datetime
 import pytz
 
@@ -40,13 +41,17 @@ def reset_price_estimates():
             before_count = cursor.fetchone()['count']
             
             # Reset all price-related fields for active items
+            ensure_price_filtered_column(cursor)
+            ensure_lease_columns(cursor)
             cursor.execute("""
                 UPDATE items 
                 SET ebay_price = NULL,
                     price_update_attempted = 0,
                     last_price_update = NULL,
                     profit = NULL,
-                    margin = NULL
+                    margin = NULL,
+                    price_filtered = 0,
+                    price_failures = 0
                 WHERE auction_end_time > ?
             """, (current_time,))
             
@@ -46,9 +46,9 @@ def run_scraper():
         # Get the current directory
         current_dir = os.path.dirname(os.path.abspath(__file__))
         
-        # Run the get_products.py script
+        # Run the get_products.py script, picking up any crawl a previous run left unfinished
         result = subprocess.run(
-            ["python", os.path.join(current_dir, "get_products.py")],
+            ["python", os.path.join(current_dir, "get_products.py"), "--resume"],
             capture_output=True,
             text=True
         )
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# image_prep reads this at import, so set it before any test imports gemini
+os.environ.setdefault('IMAGE_CACHE_DIR', tempfile.mkdtemp(prefix='gw-test-images-'))
+
+import db
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Point db.py and get_products.py at a fresh database for one test."""
+    import get_products
+    import price_scheduler
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    monkeypatch.setattr(get_products, 'DB_PATH', path)
+    # Schema checks are remembered per process, but each test has a new database
+    monkeypatch.setattr(db, '_price_filtered_column_ready', False)
+    monkeypatch.setattr(price_scheduler, '_lease_columns_ready', False)
+    if 'gemini' in sys.modules:
+        monkeypatch.setattr(sys.modules['gemini'].price_cache, 'ready', False)
+    db.close_db()
+    db.init_db()
+    yield path
+    db.close_db()
+    # gemini's database thread keeps a connection of its own open
+    if 'gemini' in sys.modules:
+        sys.modules['gemini'].db_executor.submit(db.close_db).result()
+
+@pytest.fixture
+def fake_model():
+    """Price through fake_gemini.FakeGeminiModel instead of Gemini."""
+    import gemini
+    from fake_gemini import FakeGeminiModel
+    model = FakeGeminiModel(5, 'fixed', image_latency_ms=0)
+    gemini.set_backend(model)
+    yield model
+    gemini.set_backend(None)
@@ -0,0 +1,89 @@
+import asyncio
+import sqlite3
+
+from aiohttp import web
+
+import get_products
+from fake_api import FakeItemListingAPI
+from rate_limiter import AdaptiveRateLimiter
+
+SELLER_ID = '198'
+
+class OutageAPI(FakeItemListingAPI):
+    """fake_api that records the pages asked for and answers 404 from down_from_page on."""
+
+    def __init__(self, down_from_page=None, **kwargs):
+        super().__init__(latency_ms=0, jitter_ms=0, **kwargs)
+        self.down_from_page = down_from_page
+        self.requested_pages = []
+
+    async def handle_listing(self, request):
+        page = int((await request.json()).get('page') or 1)
+        self.requested_pages.append(page)
+        if self.down_from_page and page >= self.down_from_page:
+            return web.Response(status=404, text='Not Found')
+        return await super().handle_listing(request)
+
+def crawl(api, monkeypatch, **kwargs):
+    """Run get_products.get_data for SELLER_ID against api, served in-process."""
+    # The local server needs no pacing
+    monkeypatch.setattr(get_products, 'api_limiter', AdaptiveRateLimiter('fake_api', rate=1000, max_rate=1000))
+    async def run():
+        runner = web.AppRunner(api.app())
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(get_products, 'API_URL', f"http://127.0.0.1:{port}/api/Search/ItemListing")
+        try:
+            return await get_products.get_data([SELLER_ID], '', **kwargs)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+def checkpoint(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT last_page, completed FROM crawl_checkpoints WHERE seller_key = ?",
+                            (SELLER_ID,)).fetchone()
+    finally:
+        conn.close()
+
+def item_count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_sequential_crawl_resumes_after_the_last_written_page(database, monkeypatch):
+    interrupted = OutageAPI(down_from_page=3, pages_per_seller=5)
+    crawl(interrupted, monkeypatch, max_concurrent=1)
+    assert checkpoint(database) == (2, 0)
+    assert item_count(database) == 2 * get_products.PAGE_SIZE
+
+    resumed = OutageAPI(pages_per_seller=5)
+    crawl(resumed, monkeypatch, max_concurrent=1, resume=True)
+    assert resumed.requested_pages[0] == 3
+    assert 1 not in resumed.requested_pages and 2 not in resumed.requested_pages
+    assert checkpoint(database) == (5, 1)
+    assert item_count(database) == 5 * get_products.PAGE_SIZE
+
+def test_concurrent_crawl_resumes_after_the_last_written_page(database, monkeypatch):
+    interrupted = OutageAPI(down_from_page=4, pages_per_seller=6)
+    crawl(interrupted, monkeypatch, max_concurrent=4)
+    assert checkpoint(database) == (3, 0)
+
+    resumed = OutageAPI(pages_per_seller=6)
+    crawl(resumed, monkeypatch, max_concurrent=4, resume=True)
+    assert sorted(resumed.requested_pages) == [4, 5, 6]
+    assert checkpoint(database) == (6, 1)
+    assert item_count(database) == 6 * get_products.PAGE_SIZE
+
+def test_crawl_without_resume_starts_over(database, monkeypatch):
+    crawl(OutageAPI(down_from_page=3, pages_per_seller=5), monkeypatch, max_concurrent=1)
+
+    restarted = OutageAPI(pages_per_seller=5)
+    crawl(restarted, monkeypatch, max_concurrent=1)
+    assert restarted.requested_pages[0] == 1
+    assert checkpoint(database) == (5, 1)
@@ -0,0 +1,64 @@
+from db import get_db_cursor
+from benchmark_pricing import create_synthetic_items
+from price_scheduler import claim_priority_items, renew_leases, release_items, get_pending_priority_count
+
+def leases(item_ids):
+    """Return {item_id: (owner, expires)} for item_ids."""
+    placeholders = ','.join('?' * len(item_ids))
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            f"SELECT id, price_lease_owner, price_lease_expires FROM items WHERE id IN ({placeholders})",
+            list(item_ids)
+        )
+        return {row['id']: (row['price_lease_owner'], row['price_lease_expires']) for row in cursor.fetchall()}
+
+def test_claim_leases_each_item_to_one_worker(database):
+    create_synthetic_items(40)
+    pending = get_pending_priority_count()
+
+    first = claim_priority_items('worker-a', 10)
+    second = claim_priority_items('worker-b', 100)
+
+    first_ids = {item['id'] for item in first}
+    second_ids = {item['id'] for item in second}
+    assert len(first_ids) == 10
+    assert not first_ids & second_ids
+    assert len(first_ids | second_ids) == pending
+    assert {owner for owner, _ in leases(first_ids).values()} == {'worker-a'}
+    assert {owner for owner, _ in leases(second_ids).values()} == {'worker-b'}
+    assert claim_priority_items('worker-c', 10) == []
+
+def test_claim_takes_over_expired_leases(database):
+    create_synthetic_items(10)
+    stale = claim_priority_items('worker-a', 5, lease_seconds=-60)
+
+    taken = claim_priority_items('worker-b', 100)
+
+    assert {item['id'] for item in stale} <= {item['id'] for item in taken}
+
+def test_renew_extends_only_the_owners_leases(database):
+    create_synthetic_items(10)
+    item_ids = [item['id'] for item in claim_priority_items('worker-a', 5, lease_seconds=60)]
+    before = leases(item_ids)
+
+    renew_leases('worker-b', item_ids, lease_seconds=3600)
+    assert leases(item_ids) == before
+
+    renew_leases('worker-a', item_ids, lease_seconds=3600)
+    after = leases(item_ids)
+    for item_id in item_ids:
+        assert after[item_id][0] == 'worker-a'
+        assert after[item_id][1] > before[item_id][1]
+
+def test_release_makes_items_claimable_again(database):
+    create_synthetic_items(10)
+    item_ids = [item['id'] for item in claim_priority_items('worker-a', 100)]
+
+    release_items('worker-b')
+    assert claim_priority_items('worker-b', 100) == []
+
+    release_items('worker-a', item_ids[:3])
+    assert {item['id'] for item in claim_priority_items('worker-b', 100)} == set(item_ids[:3])
+
+    release_items('worker-a')
+    assert {owner for owner, _ in leases(item_ids[3:]).values()} == {None}
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from collections import Counter
+
+import gemini
+from db import get_db_cursor
+from benchmark_pricing import create_synthetic_items
+from price_scheduler import claim_priority_items, get_pending_priority_count
+
+def test_concurrent_runs_price_every_item_once(database, fake_model, monkeypatch):
+    create_synthetic_items(300)
+    pending = get_pending_priority_count()
+    claimed = Counter()
+
+    def claim(worker_id, *args, **kwargs):
+        items = claim_priority_items(worker_id, *args, **kwargs)
+        claimed.update(item['id'] for item in items)
+        return items
+    monkeypatch.setattr(gemini, 'claim_priority_items', claim)
+
+    pipelines = []
+    errors = []
+
+    def run():
+        try:
+            pipelines.append(asyncio.run(gemini.update_prices(batch_size=30, max_concurrent=20)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+    assert len(pipelines) == 2 and all(pipelines)
+    assert pipelines[0].writer is not pipelines[1].writer
+    assert pipelines[0].limiter is not pipelines[1].limiter
+    assert len(claimed) == pending
+    assert max(claimed.values()) == 1
+    with get_db_cursor() as cursor:
+        cursor.execute('''
+        SELECT SUM(price_update_attempted = 1) AS priced, SUM(price_lease_owner IS NOT NULL) AS leased
+        FROM items WHERE id IN ({})
+        '''.format(','.join('?' * len(claimed))), list(claimed))
+        row = cursor.fetchone()
+    assert row['priced'] == pending
+    assert row['leased'] == 0
+
+def test_run_reports_its_own_counters(database, fake_model):
+    create_synthetic_items(40)
+
+    pipeline = asyncio.run(gemini.update_prices(batch_size=30, max_concurrent=10))
+
+    assert pipeline.counters['errors']['retried'] == 0
+    assert sum(pipeline.writer.stats.values()) > 0